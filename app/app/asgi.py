@@ -5,12 +5,125 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+
+Served by gunicorn with uvicorn workers when APP_SERVER=asgi (see
+scripts/run.sh). The DRF views and the ORM are synchronous, Django 3.2
+runs all of them on one thread per process - here WEB_THREADS threads
+run the requests, like the threads of a uWSGI worker. A thread keeps its
+database connection between requests (CONN_MAX_AGE, the pool) and closes
+it when the server stops. Streamed responses are read in the thread of
+their request too.
 """
 
+import asyncio
 import os
+import weakref
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connections
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+
+class StreamingASGIHandler(ASGIHandler):
+    """Django ASGI handler iterating streamed responses in a thread"""
+
+    async def send_response(self, response, send):
+        """Send the response, the streamed parts are read in the thread
+        of the request
+        """
+        if not response.streaming:
+            return await super().send_response(response, send)
+        # Django 3.2 iterates the streamed parts in the event loop, where
+        # the ORM refuses to run (the export reads the recipes while it is
+        # sent) - the handler sends the headers and an empty body, the
+        # parts are read one by one in the thread and sent before its end
+        parts = iter(response)
+        response.streaming_content = ()
+        read_part = sync_to_async(next)
+
+        async def send_parts(message):
+            if message['type'] == 'http.response.body' and \
+                    not message.get('more_body'):
+                while (part := await read_part(parts, None)) is not None:
+                    for chunk, _ in self.chunk_bytes(part):
+                        await send({
+                            'type': 'http.response.body',
+                            'body': chunk,
+                            'more_body': True,
+                        })
+            await send(message)
+
+        await super().send_response(response, send_parts)
+
+
+django.setup(set_prefix=False)  # like get_asgi_application()
+django_application = StreamingASGIHandler()
+
+# requests running Django code at the same time in a process - keep it
+# at most DB_POOL_MAX_SIZE, the other requests wait for a free thread
+WEB_THREADS = int(os.environ.get('WEB_THREADS') or 8)
+# event loop -> (queue of the requests, tasks running them)
+_runners = weakref.WeakKeyDictionary()
+
+
+async def _run_requests(requests):
+    """Run the requests of the queue one after the other in one thread"""
+    async with ThreadSensitiveContext():
+        try:
+            while True:
+                scope, receive, send, done = await requests.get()
+                if done.cancelled():  # the server gave up on it
+                    continue
+                try:
+                    await django_application(scope, receive, send)
+                    if not done.cancelled():
+                        done.set_result(None)
+                except Exception as e:
+                    if not done.cancelled():
+                        done.set_exception(e)
+                finally:
+                    done.cancel()  # the thread is stopped, else a no-op
+        finally:
+            # the thread is stopped with the context, its connections
+            # would never be closed (or given back to the pool)
+            await sync_to_async(connections.close_all)()
+
+
+def _get_requests():
+    """Return the queue of the requests, start the threads if needed"""
+    loop = asyncio.get_running_loop()
+    if loop not in _runners:
+        requests = asyncio.Queue()
+        _runners[loop] = requests, [
+            loop.create_task(_run_requests(requests))
+            for _ in range(WEB_THREADS)
+        ]
+    return _runners[loop][0]
+
+
+async def _stop_runners():
+    """Stop the threads of the event loop"""
+    _, tasks = _runners.pop(asyncio.get_running_loop(), (None, []))
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def application(scope, receive, send):
+    """Run a request in one of the threads, answer the lifespan events"""
+    if scope['type'] == 'lifespan':
+        # nothing to start - Django 3.2 does not take them
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await _stop_runners()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    done = asyncio.get_running_loop().create_future()
+    await _get_requests().put((scope, receive, send, done))
+    await done
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'core',
     'rest_framework',
     'rest_framework.authtoken',  # this is a seperate django app
@@ -51,6 +52,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # first to see the requests, last to see the responses (compressed
+    # after every other middleware is done with the body)
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -89,13 +93,23 @@ WSGI_APPLICATION = 'app.wsgi.application'
 #     }
 # }
 # the default configuration replaced with PostgreSQL
+# core.db.backends.postgresql is the Django backend plus health checks
+# and an optional pool (see core/db/backends/postgresql/base.py)
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.db.backends.postgresql',
         'HOST' : os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        # seconds a connection is reused by following requests, 0 closes
+        # it at the end of each request
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': bool(
+            int(os.environ.get('DB_CONN_HEALTH_CHECKS', 1))),
+        # max connections per worker process, 0 = no pool
+        'POOL_MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 0)),
+        'POOL_TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
     }
 }
 
@@ -153,7 +167,87 @@ AUTH_USER_MODEL = 'core.User'  # Use custom user model
 # we want to use schema provided by drf_scpectacular which is a package
 # that supports api documentaction
 REST_FRAMEWORK = {
-    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # JSON with orjson when it is installed, the same bytes as DRF's
+    # renderer either way (core/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Caches - local memory of each process by default, any Django cache
+# backend (e.g. memcached) can be configured with the env variables
+# MAX_ENTRIES/CULL_FREQUENCY define the eviction of the local caches
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+        'TIMEOUT': int(os.environ.get('CACHE_TIMEOUT', 300)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 1000)),
+            'CULL_FREQUENCY': int(os.environ.get('CACHE_CULL_FREQUENCY', 3)),
+        },
+    }
+}
+
+# Cache of API responses keyed by the user data version (recipe.views)
+RESPONSE_CACHE = {
+    'CACHE': os.environ.get('RESPONSE_CACHE_ALIAS', 'default'),
+    'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300)),
+}
+
+# Cache of authenticated API tokens (core.authentication)
+# CACHE is an optional alias of a Django cache shared by all processes
+# (e.g. redis/memcached), set it when running several processes - without
+# it MAX_SIZE tokens are kept per process for TTL seconds and a deleted
+# token or deactivated user still authenticates in the other processes
+# until the TTL runs out
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': int(os.environ.get('TOKEN_AUTH_CACHE_MAX_SIZE', 10000)),
+    'TTL': int(os.environ.get('TOKEN_AUTH_CACHE_TTL', 60)),
+    'CACHE': os.environ.get('TOKEN_AUTH_CACHE_ALIAS') or None,
+}
+
+# Processing of uploaded recipe images (core/images.py) - a job which is
+# processing for STALE_AFTER seconds is requeued, MAX_ATTEMPTS times, an
+# image no recipe uses is removed after BLOB_GRACE seconds
+IMAGE_PROCESSING = {
+    'JPEG_QUALITY': int(os.environ.get('IMAGE_JPEG_QUALITY', 85)),
+    'WEBP_QUALITY': int(os.environ.get('IMAGE_WEBP_QUALITY', 80)),
+    # longest side in px of the renditions made of every recipe image
+    'RENDITION_SIZES': [
+        int(size) for size in os.environ.get(
+            'IMAGE_RENDITION_SIZES', '128,512,1024').split(',')
+    ],
+    'MAX_ATTEMPTS': int(os.environ.get('IMAGE_JOB_MAX_ATTEMPTS', 3)),
+    'STALE_AFTER': int(os.environ.get('IMAGE_JOB_STALE_AFTER', 600)),
+    'BLOB_GRACE': int(os.environ.get('IMAGE_BLOB_GRACE', 3600)),
+    # bytes, checked while the upload is received (core/uploads.py)
+    'MAX_UPLOAD_SIZE': int(
+        os.environ.get('IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)),
+}
+
+# Compression of the API responses (core/middleware.py) - brotli when
+# the brotli package is installed and the client takes it, gzip otherwise
+# the collected static files are compressed once (manage.py
+# compress_static) with the highest levels and served by the proxy
+COMPRESSION = {
+    'MIN_SIZE': int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    'GZIP_LEVEL': int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+    'BROTLI_QUALITY': int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5)),
+    'CONTENT_TYPES': [
+        'application/json',
+        'application/x-ndjson',
+        'application/vnd.oai.openapi',
+        'application/vnd.oai.openapi+json',
+    ],
 }
 
 # This settings allows to upload an image through the web interface (REST Doc)
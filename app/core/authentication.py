@@ -0,0 +1,124 @@
+"""
+Authentication for the APIs.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+
+class LRUCache:
+    """Bounded in-process cache, least recently used entries go first"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()  # uWSGI runs with threads enabled
+
+    def get(self, key):
+        """Return the value or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        """Store the value, evicting the oldest entries above max_size"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Remove the value if present"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all values"""
+        with self._lock:
+            self._entries.clear()
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    """Return the per process cache of authenticated tokens"""
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                config = settings.TOKEN_AUTH_CACHE
+                _token_cache = LRUCache(config['MAX_SIZE'], config['TTL'])
+    return _token_cache
+
+
+def _shared_cache():
+    """Return the Django cache shared by processes or None"""
+    alias = settings.TOKEN_AUTH_CACHE.get('CACHE')
+    return caches[alias] if alias else None
+
+
+def _shared_key(key):
+    return f'auth-token:{key}'
+
+
+def invalidate_tokens(keys):
+    """Forget cached authentications of the tokens"""
+    shared = _shared_cache()
+    for key in keys:
+        if shared is not None:
+            shared.delete(_shared_key(key))
+        else:
+            get_token_cache().delete(key)
+
+
+# DRF TokenAuthentication runs a Token JOIN User query on every request
+# the result is cached for TTL seconds, it is invalidated by the signals
+# in core/signals.py when the token is deleted or the user is saved
+# with a shared Django cache (TOKEN_AUTH_CACHE['CACHE']) only that one is
+# used - an invalidation deletes the entry for all the processes at once
+# without it the entries are kept in the process, the other processes do
+# not see the invalidation and accept the token until the TTL runs out
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication with cached token lookups"""
+
+    def authenticate_credentials(self, key):
+        """Return (user, token) for the key, from the cache if possible"""
+        shared = _shared_cache()
+        if shared is not None:
+            entry = shared.get(_shared_key(key))
+            if entry is None:
+                entry = self._authenticate(key)
+                shared.set(
+                    _shared_key(key), entry,
+                    settings.TOKEN_AUTH_CACHE['TTL'],
+                )
+        else:
+            local = get_token_cache()
+            entry = local.get(key)
+            if entry is None:
+                entry = self._authenticate(key)
+                local.set(key, entry)
+        user, token = entry
+        # every request gets its own copy - views may modify request.user
+        return copy.copy(user), token
+
+    def _authenticate(self, key):
+        """Return (user, token) read from the db"""
+        # raises AuthenticationFailed for unknown keys and inactive
+        # users - failures are never cached
+        return super().authenticate_credentials(key)
@@ -0,0 +1,170 @@
+"""
+PostgreSQL backend with connection health checks and pooling.
+
+Extra keys of the DATABASES entry:
+    CONN_HEALTH_CHECKS - ping a reused connection before its first query in
+        a request and reconnect if the ping fails (see CONN_MAX_AGE), an
+        idle connection of the pool is pinged before it is handed out
+    POOL_MAX_SIZE - max number of connections of a process, 0 disables the
+        pool; idle connections are kept and reused by any thread
+    POOL_TIMEOUT - seconds to wait for a free connection of a full pool
+"""
+import os
+import threading
+
+from django.db.backends.postgresql import base
+from django.db.utils import OperationalError
+from psycopg2 import extensions
+
+
+class ConnectionPool:
+    """Caps the open connections of a process, idle ones are reused"""
+
+    def __init__(self, max_size, timeout):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self, connect, ping=False):
+        """Return an idle connection or a new one made by `connect()`
+        with `ping` an idle connection the server closed is replaced
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise OperationalError(
+                f'No free database connection after {self.timeout} sec')
+        try:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is not None and not connection.closed and \
+                    ping and not self._ping(connection):
+                connection.close()
+                connection = None
+            if connection is None or connection.closed:
+                connection = connect()
+        except BaseException:
+            self._slots.release()
+            raise
+        return connection
+
+    @staticmethod
+    def _ping(connection):
+        """Return whether the database answers on the connection"""
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    def release(self, connection, discard=False):
+        """Give the connection back to the pool"""
+        try:
+            status = connection.get_transaction_status() \
+                if not connection.closed else None
+            if status in (
+                    extensions.TRANSACTION_STATUS_INTRANS,
+                    extensions.TRANSACTION_STATUS_INERROR):
+                connection.rollback()
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                discard = True  # closed, broken or busy
+            if discard:
+                if not connection.closed:
+                    connection.close()
+            else:
+                with self._lock:
+                    self._idle.append(connection)
+        except Exception:
+            # a connection which cannot be reset is not reused
+            connection.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close the idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, max_size, timeout):
+    """Return the pool of this process for the connection settings"""
+    # a forked worker must not share the connections of its parent
+    key = (os.getpid(),) + key
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(max_size, timeout)
+        return _pools[key]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL connection with optional health checks and pooling"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def pool(self):
+        max_size = self.settings_dict.get('POOL_MAX_SIZE') or 0
+        if max_size <= 0:
+            return None
+        params = self.get_connection_params()
+        key = (self.alias,) + tuple(sorted(
+            (name, str(value)) for name, value in params.items()))
+        return get_pool(
+            key, max_size, self.settings_dict.get('POOL_TIMEOUT', 30))
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connection = pool.acquire(
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params),
+            ping=bool(self.settings_dict.get('CONN_HEALTH_CHECKS')),
+        )
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        # a connection closed inside an atomic block is still referenced
+        # by this wrapper, so it is not given to anybody else
+        pool.release(self.connection, discard=self.in_atomic_block)
+
+    def connect(self):
+        super().connect()
+        # a new connection is healthy, the pool pings an idle one before
+        # handing it out (see ConnectionPool.acquire)
+        self.health_check_done = True
+
+    # called by Django when a request starts and when it finishes
+    def close_if_unusable_or_obsolete(self):
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def close_if_health_check_failed(self):
+        """Close a reused connection if the database does not answer"""
+        if self.connection is None or self.health_check_done or \
+                not self.settings_dict.get('CONN_HEALTH_CHECKS') or \
+                self.in_atomic_block:
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
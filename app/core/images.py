@@ -0,0 +1,339 @@
+"""
+Background processing of uploaded recipe images.
+
+The upload request only writes the file to the staging directory and
+queues an ImageJob, the decoding and re-encoding is done by the worker
+(manage.py process_image_jobs) which switches the recipe to the new image
+and its renditions - smaller copies for the lists and thumbnails.
+
+Images are stored once per uploaded content as an ImageBlob (keyed by the
+sha256 of the upload) and counted references, recipes showing the same
+photo share the files which are removed when the last one lets go.
+"""
+import hashlib
+import io
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from core.models import ImageBlob, ImageJob, Recipe, UserDataVersion
+
+# relative to MEDIA_ROOT
+STAGING_DIR = os.path.join('uploads', 'staging')
+BLOB_DIR = os.path.join('uploads', 'recipe')
+# file extensions of the formats written by _save
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+class HashingFile(File):
+    """A file computing the sha256 of the chunks read from it"""
+
+    def __init__(self, file, name=None):
+        super().__init__(file, name)
+        self.sha256 = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for chunk in super().chunks(chunk_size):
+            self.sha256.update(chunk)
+            yield chunk
+
+
+def stage_upload(recipe, uploaded_file):
+    """Store the uploaded file as it is and queue a job for it"""
+    if hasattr(uploaded_file, 'staged_path'):
+        # already written and hashed by core.uploads.StagingUploadHandler
+        return ImageJob.objects.create(
+            recipe=recipe,
+            staged_path=uploaded_file.staged_path,
+            sha256=uploaded_file.sha256,
+        )
+    ext = os.path.splitext(uploaded_file.name)[1].lower()
+    # the chunks are hashed as they are written - one pass over the file
+    # and no decoding in the request
+    staged = HashingFile(uploaded_file, uploaded_file.name)
+    path = default_storage.save(
+        os.path.join(STAGING_DIR, f'{uuid.uuid4()}{ext}'), staged)
+    return ImageJob.objects.create(
+        recipe=recipe, staged_path=path, sha256=staged.sha256.hexdigest())
+
+
+def claim_jobs(limit):
+    """Mark up to `limit` pending jobs as processing and return them
+    SKIP LOCKED - workers running at the same time get different jobs
+    """
+    with transaction.atomic():
+        jobs = list(
+            ImageJob.objects.select_for_update(skip_locked=True)
+            .filter(status=ImageJob.PENDING)
+            .order_by('id')[:limit]
+        )
+        if jobs:
+            ImageJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=ImageJob.PROCESSING,
+                attempts=F('attempts') + 1,
+                updated_at=timezone.now(),
+            )
+    for job in jobs:
+        job.status = ImageJob.PROCESSING
+        job.attempts += 1
+    return jobs
+
+
+def requeue_stale_jobs():
+    """Give the jobs of workers which died back to the queue
+    returns the number of requeued jobs, the ones out of attempts fail
+    """
+    config = settings.IMAGE_PROCESSING
+    stale = ImageJob.objects.filter(
+        status=ImageJob.PROCESSING,
+        updated_at__lt=timezone.now() - timedelta(
+            seconds=config['STALE_AFTER']),
+    )
+    for job in stale.filter(attempts__gte=config['MAX_ATTEMPTS']):
+        release_job(job, 'The worker did not finish the job.')
+    return stale.update(status=ImageJob.PENDING, updated_at=timezone.now())
+
+
+def release_job(job, error):
+    """Put a job which failed back to the queue or fail it for good"""
+    if job.attempts < settings.IMAGE_PROCESSING['MAX_ATTEMPTS']:
+        job.status = ImageJob.PENDING
+    else:
+        job.status = ImageJob.FAILED
+        _delete_file(job.staged_path)
+    job.error = error
+    job.save(update_fields=['status', 'error', 'updated_at'])
+
+
+def process_job(job):
+    """Make the blob of the staged image unless an identical upload did,
+    then switch the recipe to it - returns the job with its final status
+    """
+    # pinned first - the blob is not collected while its files are made
+    blob = ImageBlob.objects.pin(
+        job.sha256 or _file_sha256(job.staged_path))
+    try:
+        if not blob.image:
+            blob = _render_blob(blob, job.staged_path)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        ImageBlob.objects.release(blob.pk)
+        if isinstance(e, OSError) and e.errno is not None:
+            # the disk, not the image (ENOSPC, EIO, a missing staged
+            # file) - Pillow raises its decoding errors without errno
+            release_job(job, str(e))
+            return job
+        # not an image (or a broken one), another attempt will not help
+        job.attempts = settings.IMAGE_PROCESSING['MAX_ATTEMPTS']
+        release_job(job, f'Invalid image: {e}')
+        return job
+    except Exception:
+        ImageBlob.objects.release(blob.pk)
+        raise
+
+    try:
+        _switch(job, blob)
+    except Exception:
+        ImageBlob.objects.release(blob.pk)
+        raise
+    return job
+
+
+def collect_garbage(batch_size=100):
+    """Remove the blobs no recipe has used for BLOB_GRACE seconds
+    returns the number of removed blobs
+    """
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.IMAGE_PROCESSING['BLOB_GRACE'])
+    with transaction.atomic():
+        blobs = list(
+            ImageBlob.objects.select_for_update(skip_locked=True)
+            .filter(ref_count=0, updated_at__lt=cutoff)[:batch_size]
+        )
+        # the files go under the row lock - an upload of the same image
+        # waits for it in ImageBlob.objects.pin and makes a new blob
+        for blob in blobs:
+            delete_image_files(blob.image, blob.renditions)
+        ImageBlob.objects.filter(pk__in=[blob.pk for blob in blobs]).delete()
+    return len(blobs)
+
+
+def make_renditions(image, stem):
+    """Save downscaled WebP and JPEG copies of an image named after `stem`,
+    return their paths as {size: {format: path}}
+    """
+    config = settings.IMAGE_PROCESSING
+    renditions = {}
+    # every size is scaled down from the previous one, not the original
+    for size in sorted(config['RENDITION_SIZES'], reverse=True):
+        image = image.copy()
+        image.thumbnail((size, size), reducing_gap=3.0)
+        renditions[str(size)] = {
+            'webp': _save(
+                image, f'{stem}-{size}', 'WEBP',
+                quality=config['WEBP_QUALITY'], method=4,
+            ),
+            'jpeg': _save(
+                _flatten(image), f'{stem}-{size}', 'JPEG',
+                quality=config['JPEG_QUALITY'], optimize=True,
+                progressive=True,
+            ),
+        }
+    return renditions
+
+
+def render_stored_renditions(path):
+    """Make the renditions of an image already in the media storage
+    a top level function - run by the processes of the backfill command
+    """
+    with default_storage.open(path) as f, Image.open(f) as image:
+        image.load()
+        upright = _upright(image)
+    return make_renditions(upright, os.path.splitext(path)[0])
+
+
+def image_paths(path, renditions):
+    """Return the paths of an image and of its renditions"""
+    paths = {path} if path else set()
+    for formats in (renditions or {}).values():
+        paths.update(formats.values())
+    return paths
+
+
+def delete_image_files(path, renditions):
+    """Remove an image and its renditions from the media storage"""
+    delete_files(image_paths(path, renditions))
+
+
+def delete_files(paths):
+    """Remove files from the media storage, the missing ones are skipped"""
+    for path in paths:
+        _delete_file(path)
+
+
+def _switch(job, blob):
+    """Show the image of the blob on the recipe of the job"""
+    with transaction.atomic():
+        # the row lock orders the switches of concurrent jobs of a recipe
+        recipe = Recipe.objects.select_for_update() \
+            .only('id', 'user_id', 'image', 'image_renditions', 'image_blob') \
+            .filter(pk=job.recipe_id).first()
+        newer = ImageJob.objects.filter(
+            recipe_id=job.recipe_id, pk__gt=job.pk, status=ImageJob.DONE,
+        ).exists()
+        if recipe is None or newer:
+            # recipe deleted, or a later upload is already shown
+            ImageBlob.objects.release(blob.pk)
+        else:
+            Recipe.objects.filter(pk=recipe.pk).update(
+                image=blob.image,
+                image_renditions=blob.renditions,
+                image_blob=blob,
+            )
+            UserDataVersion.objects.bump(recipe.user_id)
+            if recipe.image_blob_id:
+                ImageBlob.objects.release(recipe.image_blob_id)
+            else:
+                # uploaded before the blobs, the files are the recipe's
+                old = recipe.image.name, recipe.image_renditions
+                transaction.on_commit(lambda: delete_image_files(*old))
+        job.status = ImageJob.DONE
+        job.error = ''
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        transaction.on_commit(lambda: _delete_file(job.staged_path))
+
+
+def _render_blob(blob, staged_path):
+    """Write the files of a new blob from the staged upload"""
+    path, renditions = _render(
+        staged_path, os.path.join(BLOB_DIR, blob.sha256[:2], blob.sha256))
+    updated = ImageBlob.objects.filter(pk=blob.pk, image='') \
+        .update(image=path, renditions=renditions)
+    if updated:
+        blob.image, blob.renditions = path, renditions
+        return blob
+    # a job of the same upload was faster
+    blob.refresh_from_db()
+    delete_files(
+        image_paths(path, renditions) -
+        image_paths(blob.image, blob.renditions)
+    )
+    return blob
+
+
+def _render(staged_path, stem):
+    """Write the re-encoded image and its renditions, return the path of
+    the image (relative to MEDIA_ROOT) and of the renditions
+    """
+    with default_storage.open(staged_path) as f, Image.open(f) as image:
+        image.load()
+        image = _upright(image)
+    if image.mode == 'RGBA':
+        path = _save(image, stem, 'PNG', optimize=True)
+    else:
+        path = _save(
+            image, stem, 'JPEG',
+            quality=settings.IMAGE_PROCESSING['JPEG_QUALITY'],
+            optimize=True, progressive=True,
+        )
+    return path, make_renditions(image, stem)
+
+
+def _upright(image):
+    """Return the pixels of an image turned as its EXIF orientation says,
+    in RGBA if it has transparency and in RGB otherwise
+    """
+    keep_alpha = image.format in ('PNG', 'GIF', 'WEBP') and (
+        image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    )
+    # the files written from it have no EXIF at all, which drops the GPS
+    # positions of phone photos too
+    image = ImageOps.exif_transpose(image)
+    return image.convert('RGBA' if keep_alpha else 'RGB')
+
+
+def _flatten(image):
+    """Return an RGB image, transparent pixels on white (for JPEG)"""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _save(image, stem, image_format, **params):
+    """Encode an image into the media storage, return the stored path"""
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **params)
+    data = buffer.getvalue()
+    # named by the content - the URL changes when the content does, so
+    # the files are cached forever (see proxy/default.conf.tpl)
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    path = f'{stem}.{digest}.{EXTENSIONS[image_format]}'
+    if default_storage.exists(path):
+        return path
+    return default_storage.save(path, ContentFile(data))
+
+
+def _file_sha256(path):
+    """Return the sha256 of a file in the media storage"""
+    digest = hashlib.sha256()
+    with default_storage.open(path) as f:
+        for chunk in f.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _delete_file(path):
+    """Remove a file from the media storage if it is there"""
+    try:
+        default_storage.delete(path)
+    except OSError:  # left behind, it is not used any more
+        pass
@@ -0,0 +1,21 @@
+"""
+Batches of rows for the commands which rewrite whole tables.
+"""
+
+
+def keyset_batches(queryset, batch_size, *fields):
+    """Yield the rows of the queryset in id order, batch_size at a time
+
+    a batch is a list of ids, or of (id, *fields) tuples with fields
+    """
+    # keyset batches - WHERE id > last id, no OFFSET: every batch is
+    # found through the primary key however far the loop is, the callers
+    # commit each batch on its own so no transaction locks the table
+    rows = queryset.order_by('pk').values_list('pk', *fields)
+    last_id = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        yield batch if fields else [pk for pk, in batch]
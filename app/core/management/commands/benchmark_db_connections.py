@@ -0,0 +1,83 @@
+"""
+Django command to measure the cost of opening database connections
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+
+
+# (name, settings) - every mode simulates requests with the settings
+# POOL_MAX_SIZE None is replaced by the number of threads
+MODES = [
+    ('new connection per request',
+     {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'POOL_MAX_SIZE': 0}),
+    ('persistent',
+     {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': False, 'POOL_MAX_SIZE': 0}),
+    ('persistent + health checks',
+     {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True, 'POOL_MAX_SIZE': 0}),
+    ('pooled + health checks',
+     {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True, 'POOL_MAX_SIZE': None}),
+]
+
+
+class Command(BaseCommand):
+    """Django command: benchmark connection reuse modes"""
+    help = 'Compare request latency with new, persistent and pooled ' \
+        'database connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument(
+            '--threads', type=int, default=1,
+            help='Concurrent request threads, like uWSGI threads',
+        )
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        self.alias = options['database']
+        threads = options['threads']
+        baseline = None
+        for name, mode in MODES:
+            mode = dict(mode)
+            if mode.get('POOL_MAX_SIZE') is None:
+                mode['POOL_MAX_SIZE'] = threads
+            elapsed = self._run(mode, options['requests'], threads)
+            per_request = elapsed / options['requests'] * 1000
+            baseline = baseline or per_request
+            self.stdout.write(
+                f'{name:30} {per_request:8.3f} ms/request '
+                f'({baseline / per_request:.1f}x)'
+            )
+
+    def _run(self, mode, requests, threads):
+        """Return the seconds needed for the requests in the mode"""
+        settings_dict = connections[self.alias].settings_dict
+        saved = {key: settings_dict.get(key) for key in mode}
+        settings_dict.update(mode)
+        try:
+            per_thread = [requests // threads] * threads
+            per_thread[0] += requests % threads
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(self._requests, per_thread))
+            return time.perf_counter() - start
+        finally:
+            settings_dict.update(saved)
+
+    def _requests(self, count):
+        """Simulate requests running one query"""
+        # each thread has its own connection, the settings are shared
+        connection = connections[self.alias]
+        try:
+            for _ in range(count):
+                # these signals close/recycle connections like a request
+                request_started.send(sender=self.__class__)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                request_finished.send(sender=self.__class__)
+        finally:
+            connection.close()
@@ -0,0 +1,98 @@
+"""
+Django command to compare the JSON renderers and parsers of the API
+"""
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.management.seeding import allow_factory_requests, \
+    seed_recipes
+from core.models import Recipe
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+from recipe.serializers import RecipeDetailSerializer, \
+    RecipeFastListSerializer
+
+
+class Command(BaseCommand):
+    """Django command: MB/s of DRF's JSON renderer and parser and of the
+    orjson ones, on the recipe list and detail payloads of seeded recipes
+
+    every size is seeded for one user and rolled back afterwards
+    """
+    help = 'Benchmark the JSON renderers and parsers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='100,1000,10000',
+            help='Comma separated numbers of recipes in the payloads',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Runs per renderer and parser, the best one is reported',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.stdout.write(
+            f'{"payload":>14} {"KB":>8} {"render MB/s":>18} {"speedup":>8} '
+            f'{"parse MB/s":>18} {"speedup":>8}'
+        )
+        with allow_factory_requests():
+            for size in sizes:
+                with transaction.atomic():
+                    payloads = self._payloads(size)
+                    transaction.set_rollback(True)
+                for name, data in payloads:
+                    self._compare(f'{name} {size}', data, options['repeat'])
+
+    def _payloads(self, size):
+        """Seed `size` recipes, return the list and detail payloads"""
+        user, = seed_recipes(users=1, recipes=size)
+        context = {'request': Request(APIRequestFactory().get('/'))}
+        queryset = Recipe.objects.filter(user=user).order_by('-id')
+        rows = queryset.values(*RecipeFastListSerializer.values_fields)
+        recipes = queryset.prefetch_related('tags', 'ingredients')
+        return [
+            ('list', RecipeFastListSerializer(rows, context).data),
+            ('detail', RecipeDetailSerializer(
+                recipes, many=True, context=context).data),
+        ]
+
+    def _compare(self, name, data, repeat):
+        """Time both renderers and parsers on `data`, print a row"""
+        body = JSONRenderer().render(data)
+        if FastJSONRenderer().render(data) != body:
+            raise CommandError(f'The renderers differ on the {name} payload')
+        mb = len(body) / 1024 / 1024
+        render = [
+            self._best(lambda: renderer.render(data), repeat)
+            for renderer in (JSONRenderer(), FastJSONRenderer())
+        ]
+        parse = [
+            self._best(lambda: parser.parse(io.BytesIO(body)), repeat)
+            for parser in (JSONParser(), FastJSONParser())
+        ]
+        self.stdout.write(
+            f'{name:>14} {len(body) / 1024:>8.0f} '
+            f'{mb / render[0]:>8.1f} {mb / render[1]:>9.1f} '
+            f'{render[0] / render[1]:>7.1f}x '
+            f'{mb / parse[0]:>8.1f} {mb / parse[1]:>9.1f} '
+            f'{parse[0] / parse[1]:>7.1f}x'
+        )
+
+    def _best(self, run, repeat):
+        """Return the shortest time of `repeat` runs"""
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        return min(times)
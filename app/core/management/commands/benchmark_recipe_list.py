@@ -0,0 +1,85 @@
+"""
+Django command to compare the serializers of the recipe list
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.management.seeding import allow_factory_requests, \
+    seed_recipes
+from core.models import Recipe, Tag, Ingredient
+from recipe.serializers import RecipeFastListSerializer, RecipeSerializer
+from recipe.views import RecipeViewSet
+
+
+class Command(BaseCommand):
+    """Django command: rows/sec of RecipeSerializer and of the fast list
+    serializer, from the query to the rendered JSON
+
+    every size is seeded for one user and rolled back afterwards
+    """
+    help = 'Benchmark the recipe list serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000,100000',
+            help='Comma separated numbers of recipes',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Runs per serializer, the best one is reported',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.stdout.write(
+            f'{"recipes":>10} {"full rows/s":>14} {"fast rows/s":>14} '
+            f'{"speedup":>8}'
+        )
+        with allow_factory_requests():
+            for size in sizes:
+                with transaction.atomic():
+                    full, fast = self._run(size, options['repeat'])
+                    transaction.set_rollback(True)
+                self.stdout.write(
+                    f'{size:>10} {size / full:>14.0f} {size / fast:>14.0f} '
+                    f'{full / fast:>7.1f}x'
+                )
+
+    def _run(self, size, repeat):
+        """Seed `size` recipes, return the best times of both serializers"""
+        user, = seed_recipes(users=1, recipes=size)
+        with connection.cursor() as cursor:
+            for model in (Recipe, Tag, Ingredient):
+                cursor.execute(
+                    'ANALYZE ' +
+                    connection.ops.quote_name(model._meta.db_table))
+        context = {'request': Request(APIRequestFactory().get('/'))}
+        queryset = Recipe.objects.filter(user=user).order_by('-id')
+
+        def full():
+            recipes = queryset.defer(
+                'description', 'image', 'search_vector', 'tag_ids',
+                'ingredient_ids',
+            ).prefetch_related(*RecipeViewSet()._attr_prefetches())
+            return RecipeSerializer(recipes, many=True, context=context).data
+
+        def fast():
+            rows = queryset.values(*RecipeFastListSerializer.values_fields)
+            return RecipeFastListSerializer(rows, context).data
+
+        return self._best(full, repeat), self._best(fast, repeat)
+
+    def _best(self, serialize, repeat):
+        """Return the shortest time of querying, serializing and rendering"""
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            JSONRenderer().render(serialize())
+            times.append(time.perf_counter() - start)
+        return min(times)
@@ -0,0 +1,72 @@
+"""
+Django command to precompress the collected static files
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import compression
+
+# text formats - the images and fonts of the admin are compressed already
+# the proxy knows the types of these (proxy/default.conf.tpl)
+EXTENSIONS = ('.css', '.js', '.svg', '.json', '.map')
+
+
+class Command(BaseCommand):
+    """Django command: write the .gz and .br siblings of the collected
+    static files, run after collectstatic
+
+    the proxy sends a sibling as it is to the clients which take it
+    (gzip_static, see proxy/default.conf.tpl) - compressed once with the
+    highest levels, no CPU time per request
+    """
+    help = 'Write compressed copies of the collected static files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-size', type=int, default=settings.COMPRESSION['MIN_SIZE'],
+            help='Smaller files are not compressed',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        written = skipped = 0
+        for directory, _, names in os.walk(settings.STATIC_ROOT):
+            for name in names:
+                if not name.endswith(EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                if os.path.getsize(path) < options['min_size']:
+                    continue
+                for encoding in compression.ENCODINGS:
+                    if self._compress(path, encoding):
+                        written += 1
+                    else:
+                        skipped += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'{written} compressed files written, {skipped} skipped'))
+
+    def _compress(self, path, encoding):
+        """Write the sibling of a file unless it is up to date or not
+        smaller, returns True when the sibling was written
+        """
+        target = f'{path}.{"br" if encoding == "br" else "gz"}'
+        mtime = os.path.getmtime(path)
+        # the sibling has the time of the file it was made of, a file
+        # copied again by collectstatic has a new one
+        if os.path.exists(target) and os.path.getmtime(target) == mtime:
+            return False
+        with open(path, 'rb') as f:
+            data = f.read()
+        compressed = compression.compress(
+            data, encoding, 11 if encoding == 'br' else 9)
+        if len(compressed) >= len(data):
+            # the proxy sends the file itself
+            if os.path.exists(target):
+                os.remove(target)
+            return False
+        with open(target, 'wb') as f:
+            f.write(compressed)
+        os.utime(target, (mtime, mtime))
+        return True
@@ -0,0 +1,132 @@
+"""
+Django command to print the query plans of the API endpoints
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.management.seeding import allow_factory_requests, \
+    seed_recipes
+from core.models import Recipe, Tag, Ingredient
+from recipe.views import RecipeViewSet, TagViewSet, IngredientViewSet
+
+
+class Command(BaseCommand):
+    """Django command: EXPLAIN ANALYZE the queries of the endpoints
+
+    the endpoints run on seeded data which is rolled back at the end,
+    every SELECT they send is explained - a Seq Scan on a big table or
+    a new Sort node shows an index which is missing or not used
+    """
+    help = 'Seed data and print EXPLAIN ANALYZE of the endpoint queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument(
+            '--recipes', type=int, default=1000, help='Recipes per user')
+        parser.add_argument(
+            '--tags', type=int, default=50, help='Tags per user')
+        parser.add_argument(
+            '--ingredients', type=int, default=200,
+            help='Ingredients per user',
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Commit the seeded data instead of rolling it back',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        with transaction.atomic():
+            users = seed_recipes(
+                users=options['users'],
+                recipes=options['recipes'],
+                tags=options['tags'],
+                ingredients=options['ingredients'],
+            )
+            # fresh statistics, or the planner guesses the row counts
+            with connection.cursor() as cursor:
+                for model in (Recipe, Tag, Ingredient,
+                              Recipe.tags.through,
+                              Recipe.ingredients.through):
+                    cursor.execute(
+                        'ANALYZE ' +
+                        connection.ops.quote_name(model._meta.db_table))
+
+            summary = []
+            with allow_factory_requests():
+                for endpoint in self._endpoints(users[0]):
+                    summary.append(self._explain(users[0], *endpoint))
+
+            self.stdout.write('\n== summary')
+            for name, elapsed, queries, seq_scans in summary:
+                self.stdout.write(
+                    f'{name:60} {elapsed:8.2f} ms {queries:3} queries '
+                    f'{seq_scans:3} seq scans'
+                )
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def _endpoints(self, user):
+        """Return (name, view, url kwargs, query params) to explain"""
+        recipe = Recipe.objects.filter(user=user).order_by('-id').first()
+        tags = ','.join(str(pk) for pk in Tag.objects.filter(
+            user=user).values_list('id', flat=True)[:2])
+        ingredients = ','.join(str(pk) for pk in Ingredient.objects.filter(
+            user=user).values_list('id', flat=True)[:2])
+        recipe_list = RecipeViewSet.as_view({'get': 'list'})
+        recipe_detail = RecipeViewSet.as_view({'get': 'retrieve'})
+        tag_list = TagViewSet.as_view({'get': 'list'})
+        ingredient_list = IngredientViewSet.as_view({'get': 'list'})
+        return [
+            ('recipe:recipe-list', recipe_list, {}, {}),
+            ('recipe:recipe-list', recipe_list, {}, {'page_size': 50}),
+            ('recipe:recipe-list', recipe_list, {}, {'tags': tags}),
+            ('recipe:recipe-list', recipe_list, {},
+             {'tags': tags, 'match': 'all'}),
+            ('recipe:recipe-list', recipe_list, {},
+             {'ingredients': ingredients}),
+            ('recipe:recipe-list', recipe_list, {},
+             {'search': 'recipe', 'page_size': 50}),
+            ('recipe:recipe-detail', recipe_detail, {'pk': recipe.id}, {}),
+            ('recipe:tag-list', tag_list, {}, {}),
+            ('recipe:tag-list', tag_list, {}, {'assigned_only': 1}),
+            ('recipe:ingredient-list', ingredient_list, {}, {}),
+            ('recipe:ingredient-list', ingredient_list, {},
+             {'assigned_only': 1}),
+        ]
+
+    def _explain(self, user, url_name, view, kwargs, params):
+        """Run the endpoint, explain its queries, return a summary row"""
+        request = APIRequestFactory().get(
+            reverse(url_name, kwargs=kwargs), params)
+        force_authenticate(request, user=user)
+        name = request.get_full_path()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = view(request, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+        self.stdout.write(
+            f'\n== GET {name} ({response.status_code}, {elapsed:.2f} ms, '
+            f'{len(queries)} queries)'
+        )
+
+        seq_scans = 0
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            # EXPLAIN ANALYZE runs the query again, with the real params
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sql)
+                plan = [row[0] for row in cursor.fetchall()]
+            seq_scans += sum('Seq Scan' in line for line in plan)
+            self.stdout.write(f'-- {sql}')
+            for line in plan:
+                self.stdout.write(f'   {line}')
+        return f'GET {name}', elapsed, len(queries), seq_scans
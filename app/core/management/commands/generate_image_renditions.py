@@ -0,0 +1,97 @@
+"""
+Django command to backfill the renditions of recipe images
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from core import images
+from core.management.batches import keyset_batches
+from core.models import Recipe, UserDataVersion
+
+
+def _renditions(path):
+    """Make the renditions of one image, return (renditions, error)"""
+    try:
+        return images.render_stored_renditions(path), None
+    except Exception as e:  # reported, the other images go on
+        return None, str(e)
+
+
+class Command(BaseCommand):
+    """Django command: make the missing renditions of recipe images
+
+    new uploads get their renditions from the image worker, this fills
+    them for images uploaded before - decoding and resizing is CPU bound,
+    so the images are spread over processes, one per core by default
+    """
+    help = 'Generate the renditions of existing recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Number of images processed at the same time',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Number of recipes updated in one transaction',
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Regenerate the renditions of all images',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        # the blobs of new uploads are made with their renditions
+        recipes = Recipe.objects.exclude(image='').exclude(image=None) \
+            .filter(image_blob=None)
+        if not options['all']:
+            recipes = recipes.filter(image_renditions={})
+        batches = keyset_batches(
+            recipes, options['batch_size'],
+            'user_id', 'image', 'image_renditions')
+
+        done = failed = 0
+        batch = next(batches, None)
+        # the pool forks its processes at the first map, after this - they
+        # get a copy of this one without its db connections
+        connections.close_all()
+        with ProcessPoolExecutor(
+                max_workers=options['processes'],
+                initializer=django.setup) as pool:
+            while batch:
+                results = pool.map(
+                    _renditions, [image for _, _, image, _ in batch])
+                with transaction.atomic():
+                    users = set()
+                    for (pk, user_id, image, old), (renditions, error) in \
+                            zip(batch, results):
+                        if error:
+                            failed += 1
+                            self.stderr.write(f'Recipe {pk}: {error}')
+                        elif self._switch(pk, image, old, renditions):
+                            done += 1
+                            users.add(user_id)
+                    UserDataVersion.objects.bump(*users)
+                self.stdout.write(f'{done} images done, {failed} failed')
+                batch = next(batches, None)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated the renditions of {done} images'))
+
+    def _switch(self, pk, image, old, renditions):
+        """Store the renditions unless the image changed meanwhile"""
+        updated = Recipe.objects.filter(pk=pk, image=image) \
+            .update(image_renditions=renditions)
+        if updated:
+            # the names follow the content, unchanged files are kept
+            unused = images.image_paths(None, old) - \
+                images.image_paths(None, renditions)
+        else:
+            # a new upload was processed, it has its own renditions
+            unused = images.image_paths(None, renditions)
+        transaction.on_commit(lambda: images.delete_files(unused))
+        return updated
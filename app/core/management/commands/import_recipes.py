@@ -0,0 +1,270 @@
+"""
+Django command to bulk load recipes from JSONL/CSV files
+"""
+import csv
+import io
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.models import Recipe, Tag, Ingredient, UserDataVersion
+
+
+# the recipe fields read from the input files
+RECIPE_FIELDS = ['title', 'description', 'time_minutes', 'price', 'link']
+# the tag/ingredient columns written by COPY
+ATTR_COLUMNS = ['id', 'name', 'user_id', 'recipe_count']
+# max_length of the names, titles and links - checked before the COPY
+MAX_LENGTH = 255
+
+
+class Command(BaseCommand):
+    """Django command: import recipes with PostgreSQL COPY
+
+    JSONL: one recipe object per line, tags/ingredients as lists of names
+    CSV: a header row, tags/ingredients as names separated by '|'
+    the owner is the `user` email of a row or the --user option
+    """
+    help = 'Bulk load recipes, tags and ingredients from JSONL/CSV files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='JSONL or CSV files')
+        parser.add_argument(
+            '--format', choices=['jsonl', 'csv'],
+            help='Input format, guessed from the file extension by default',
+        )
+        parser.add_argument(
+            '--user', help='Email of the owner of rows without a user',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Number of recipes committed in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        self.default_user = options['user']
+        self.user_ids = {}  # email -> user id
+        # user id -> {name: id}, loaded from the db once per user and
+        # then used to dedupe the names of the whole import in memory
+        self.tag_ids = {}
+        self.ingredient_ids = {}
+
+        records = self._read(options['paths'], options['format'])
+        recipes = rows = 0
+        start = time.monotonic()
+        while True:
+            batch = list(islice(records, options['batch_size']))
+            if not batch:
+                break
+            # every batch is committed on its own so a failure does not
+            # throw away the batches which were already loaded
+            with transaction.atomic():
+                rows += self._load_batch(batch)
+            recipes += len(batch)
+            elapsed = max(time.monotonic() - start, 1e-6)
+            self.stdout.write(
+                f'{recipes} recipes imported, {rows} rows, '
+                f'{rows / elapsed:.0f} rows/sec'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {recipes} recipes ({rows} rows) in '
+            f'{time.monotonic() - start:.1f} sec'
+        ))
+
+    def _read(self, paths, file_format):
+        """Yield (location, record) from the input files one at a time"""
+        for path in paths:
+            fmt = file_format or os.path.splitext(path)[1].lstrip('.')
+            if fmt == 'ndjson':
+                fmt = 'jsonl'
+            if fmt not in ('jsonl', 'csv'):
+                raise CommandError(f'{path}: unknown format, use --format')
+            with open(path, newline='', encoding='utf-8') as f:
+                if fmt == 'csv':
+                    # the header is line 1
+                    for line, row in enumerate(csv.DictReader(f), start=2):
+                        row['tags'] = self._split(row.get('tags'))
+                        row['ingredients'] = self._split(
+                            row.get('ingredients'))
+                        yield f'{path}:{line}', row
+                else:
+                    for line, text in enumerate(f, start=1):
+                        if text.strip():
+                            yield self._parse(f'{path}:{line}', text)
+
+    def _parse(self, location, text):
+        """Return (location, record) of a JSONL line"""
+        try:
+            record = json.loads(text)
+        except ValueError as e:
+            raise CommandError(f'{location}: invalid JSON ({e})')
+        if not isinstance(record, dict):
+            raise CommandError(f'{location}: not a JSON object')
+        return location, record
+
+    def _split(self, value):
+        """Split a CSV cell with names separated by |"""
+        return [name for name in (value or '').split('|') if name]
+
+    def _user_id(self, location, record):
+        """Return the id of the user owning the record"""
+        email = record.get('user') or self.default_user
+        if not email:
+            raise CommandError(f'{location}: no user, use --user')
+        if email not in self.user_ids:
+            user_id = get_user_model().objects.filter(email=email) \
+                .values_list('id', flat=True).first()
+            if user_id is None:
+                raise CommandError(f'{location}: unknown user {email}')
+            self.user_ids[email] = user_id
+            self.tag_ids[user_id] = dict(
+                Tag.objects.filter(user_id=user_id).values_list('name', 'id'))
+            self.ingredient_ids[user_id] = dict(
+                Ingredient.objects.filter(user_id=user_id)
+                .values_list('name', 'id'))
+        return self.user_ids[email]
+
+    def _names(self, location, values):
+        """Return names from a list of names or of {'name': ...} objects"""
+        names = []
+        for value in values or []:
+            name = value.get('name') if isinstance(value, dict) else value
+            if not isinstance(name, str) or not name.strip() or \
+                    len(name.strip()) > MAX_LENGTH:
+                raise CommandError(f'{location}: invalid name {value!r}')
+            names.append(name.strip())
+        return list(dict.fromkeys(names))
+
+    def _recipe_row(self, location, record):
+        """Return the validated recipe column values of a record"""
+        try:
+            title = record['title']
+            time_minutes = int(record['time_minutes'])
+            price = Decimal(str(record['price'])).quantize(Decimal('0.01'))
+        except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+            raise CommandError(f'{location}: invalid recipe ({e!r})')
+        if not isinstance(title, str) or not title or \
+                len(title) > MAX_LENGTH or abs(price) >= 1000:
+            raise CommandError(f'{location}: invalid title or price')
+        link = record.get('link') or ''
+        if not isinstance(link, str) or len(link) > MAX_LENGTH:
+            raise CommandError(f'{location}: invalid link')
+        return [
+            title,
+            record.get('description') or '',
+            time_minutes,
+            price,
+            link,
+        ]
+
+    def _reserve_ids(self, model, count):
+        """Take `count` ids from the sequence of the model table"""
+        if not count:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                [model._meta.db_table, model._meta.pk.column, count],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _copy(self, model, columns, rows):
+        """Load rows into the model table with COPY ... FROM STDIN"""
+        if not rows:
+            return 0
+        buffer = io.StringIO()
+        # all values quoted - an unquoted empty CSV value would be NULL
+        csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(rows)
+        buffer.seek(0)
+        qn = connection.ops.quote_name
+        sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            qn(model._meta.db_table),
+            ', '.join(qn(column) for column in columns),
+        )
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, buffer)
+        return len(rows)
+
+    def _new_attrs(self, model, known, wanted):
+        """Give ids to the (user id, name) pairs which are not in the db"""
+        missing = [
+            (user_id, name)
+            for user_id, name in dict.fromkeys(wanted)
+            if name not in known[user_id]
+        ]
+        rows = []
+        for (user_id, name), pk in zip(
+                missing, self._reserve_ids(model, len(missing))):
+            known[user_id][name] = pk
+            rows.append([pk, name, user_id, 0])  # recounted below
+        return rows
+
+    def _load_batch(self, batch):
+        """Load one batch of records, return the number of inserted rows"""
+        recipes = []
+        for location, record in batch:
+            recipes.append((
+                self._user_id(location, record),
+                self._recipe_row(location, record),
+                self._names(location, record.get('tags')),
+                self._names(location, record.get('ingredients')),
+            ))
+
+        new_tags = self._new_attrs(Tag, self.tag_ids, [
+            (user_id, name) for user_id, _, tags, _ in recipes
+            for name in tags
+        ])
+        new_ingredients = self._new_attrs(
+            Ingredient, self.ingredient_ids, [
+                (user_id, name) for user_id, _, _, ingredients in recipes
+                for name in ingredients
+            ])
+
+        recipe_rows, tag_links, ingredient_links = [], [], []
+        recipe_ids = self._reserve_ids(Recipe, len(recipes))
+        for recipe_id, (user_id, values, tags, ingredients) in zip(
+                recipe_ids, recipes):
+            # the arrays of links are filled by sync_denormalized below,
+            # imported recipes have no image renditions
+            recipe_rows.append(
+                [recipe_id, user_id] + values + ['{}', '{}', '{}'])
+            tag_links += [
+                [recipe_id, self.tag_ids[user_id][name]] for name in tags]
+            ingredient_links += [
+                [recipe_id, self.ingredient_ids[user_id][name]]
+                for name in ingredients
+            ]
+
+        # COPY sends no signals - cached responses of the users are dropped
+        UserDataVersion.objects.bump(
+            *{user_id for user_id, _, _, _ in recipes})
+        rows = sum([
+            self._copy(Tag, ATTR_COLUMNS, new_tags),
+            self._copy(Ingredient, ATTR_COLUMNS, new_ingredients),
+            self._copy(
+                Recipe,
+                ['id', 'user_id'] + RECIPE_FIELDS +
+                ['tag_ids', 'ingredient_ids', 'image_renditions'],
+                recipe_rows,
+            ),
+            self._copy(
+                Recipe.tags.through, ['recipe_id', 'tag_id'], tag_links),
+            self._copy(
+                Recipe.ingredients.through, ['recipe_id', 'ingredient_id'],
+                ingredient_links,
+            ),
+        ])
+        # and the denormalized columns are computed by one UPDATE
+        Recipe.objects.filter(pk__in=recipe_ids).sync_denormalized()
+        Tag.objects.filter(pk__in={pk for _, pk in tag_links}).recount()
+        Ingredient.objects.filter(
+            pk__in={pk for _, pk in ingredient_links}).recount()
+        return rows
@@ -0,0 +1,82 @@
+"""
+Django command to process the uploaded recipe images
+"""
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core import images
+
+
+class Command(BaseCommand):
+    """Django command: the worker of the image jobs queue
+
+    the jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED so any
+    number of workers can run, Pillow releases the GIL while it decodes
+    and encodes so the jobs of one worker run in threads
+    between the jobs the images no recipe uses any more are removed
+    """
+    help = 'Process the queued recipe image uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of images processed at the same time',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when the queue is empty instead of waiting for jobs',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait before looking at an empty queue again',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        self.stopping = False
+        # docker stop sends SIGTERM - finish the claimed jobs first
+        signal.signal(signal.SIGTERM, self._stop)
+
+        processed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while not self.stopping:
+                requeued = images.requeue_stale_jobs()
+                if requeued:
+                    self.stdout.write(f'{requeued} stale jobs requeued')
+                collected = images.collect_garbage()
+                if collected:
+                    self.stdout.write(f'{collected} unused images removed')
+                jobs = images.claim_jobs(options['workers'])
+                if jobs:
+                    for job in pool.map(self._process, jobs):
+                        self.stdout.write(
+                            f'Image job {job.id} of recipe {job.recipe_id}: '
+                            f'{job.status} {job.error}'.rstrip()
+                        )
+                    processed += len(jobs)
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} image jobs'))
+
+    def _stop(self, signum, frame):
+        """Exit after the current jobs"""
+        self.stopping = True
+
+    def _process(self, job):
+        """Process one job in a thread of the pool"""
+        try:
+            return images.process_job(job)
+        except Exception as e:  # the worker keeps going, the job is retried
+            images.release_job(job, str(e))
+            return job
+        finally:
+            # every thread has its own connection
+            connection.close()
@@ -0,0 +1,49 @@
+"""
+Django command to repair the recipe counts of tags and ingredients
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.management.batches import keyset_batches
+from core.models import Tag, Ingredient, UserDataVersion, recipe_count
+
+
+class Command(BaseCommand):
+    """Django command: recount the recipes of all tags and ingredients
+
+    the counts are maintained on write, this repairs rows changed by raw
+    SQL or written before the counts existed, batch by batch, and reports
+    how many were wrong
+    """
+    help = 'Recount the recipes of tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of items recounted in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        for model in (Tag, Ingredient):
+            checked = corrected = 0
+            for batch in keyset_batches(
+                    model.objects.all(), options['batch_size']):
+                items = model.objects.filter(id__in=batch)
+                with transaction.atomic():
+                    # an update sends no signal - the owners of the wrong
+                    # counts get a new data version, else their cached
+                    # lists keep the wrong counts (a count changed by a
+                    # concurrent write meanwhile is bumped by that write)
+                    user_ids = set(
+                        items.exclude(recipe_count=recipe_count(model))
+                        .values_list('user_id', flat=True)
+                    )
+                    corrected += items.recount()
+                    UserDataVersion.objects.bump(*user_ids)
+                checked += len(batch)
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: {checked} checked, '
+                f'{corrected} corrected'
+            )
+        self.stdout.write(self.style.SUCCESS('Recipe counts reconciled'))
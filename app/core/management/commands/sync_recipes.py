@@ -0,0 +1,43 @@
+"""
+Django command to backfill the denormalized columns of recipes
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.management.batches import keyset_batches
+from core.models import Recipe, UserDataVersion
+
+
+class Command(BaseCommand):
+    """Django command: recompute search vectors and tag/ingredient ids
+
+    the columns are kept up to date on write, the command fills them for
+    rows written before they existed or by raw SQL, batch by batch so
+    that no transaction locks the whole table
+    """
+    help = 'Backfill the search vectors and tag/ingredient id arrays'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of recipes updated in one transaction',
+        )
+        parser.add_argument('--user', help='Email of the owner to sync')
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command"""
+        recipes = Recipe.objects.all()
+        if options['user']:
+            recipes = recipes.filter(user__email=options['user'])
+
+        synced = 0
+        for batch in keyset_batches(recipes, options['batch_size']):
+            recipes = Recipe.objects.filter(id__in=batch)
+            with transaction.atomic():
+                synced += recipes.sync_denormalized()
+                # an update sends no signal - the ETags and the cached
+                # responses of the owners would stay on the old data
+                UserDataVersion.objects.bump(*recipes.values_list(
+                    'user_id', flat=True).distinct())
+            self.stdout.write(f'{synced} recipes synced')
+        self.stdout.write(self.style.SUCCESS(f'Synced {synced} recipes'))
@@ -0,0 +1,73 @@
+"""
+Sample data and requests for the benchmark commands
+"""
+import random
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test.utils import override_settings
+
+from core.models import Recipe, Tag, Ingredient
+
+
+def seed_recipes(users=10, recipes=1000, tags=50, ingredients=200,
+                 per_recipe=3, seed=0):
+    """Create users with recipes linked to tags and ingredients
+    rows go in with bulk_create (no signals), run it in a transaction
+    which is rolled back or against a throw-away database
+    returns the created users
+    """
+    rnd = random.Random(seed)
+    run = uuid.uuid4().hex[:8]  # the emails must be unique between runs
+    created = []
+    for i in range(users):
+        # no password - hashing one takes longer than all the inserts
+        user = get_user_model().objects.create_user(
+            email=f'seed-{run}-{i}@example.com')
+        created.append(user)
+
+        user_tags = Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {n}') for n in range(tags))
+        user_ingredients = Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {n}')
+            for n in range(ingredients))
+        user_recipes = Recipe.objects.bulk_create(
+            (Recipe(
+                user=user,
+                title=f'Recipe {n}',
+                description=f'Sample recipe {n} of {user.email}',
+                time_minutes=rnd.randint(1, 180),
+                price=Decimal(rnd.randint(100, 9999)) / 100,
+            ) for n in range(recipes)),
+            batch_size=1000,
+        )
+
+        tag_links, ingredient_links = [], []
+        for recipe in user_recipes:
+            tag_links += [
+                Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+                for tag in rnd.sample(user_tags, min(per_recipe, tags))
+            ]
+            ingredient_links += [
+                Recipe.ingredients.through(
+                    recipe_id=recipe.id, ingredient_id=ingredient.id)
+                for ingredient in rnd.sample(
+                    user_ingredients, min(per_recipe, ingredients))
+            ]
+        Recipe.tags.through.objects.bulk_create(tag_links, batch_size=5000)
+        Recipe.ingredients.through.objects.bulk_create(
+            ingredient_links, batch_size=5000)
+        Recipe.objects.filter(user=user).sync_denormalized()
+        Tag.objects.filter(user=user).recount()
+        Ingredient.objects.filter(user=user).recount()
+    return created
+
+
+def allow_factory_requests():
+    """Return the settings under which the requests of APIRequestFactory
+    pass the host check
+    """
+    # the factory sends Host: testserver, which ALLOWED_HOSTS refuses
+    # outside the tests
+    return override_settings(ALLOWED_HOSTS=['testserver'])
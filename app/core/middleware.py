@@ -0,0 +1,61 @@
+"""
+Middleware of the app.
+"""
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from core import compression
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress the API responses bigger than COMPRESSION['MIN_SIZE']
+    with brotli or gzip, whichever the client takes (Accept-Encoding)
+
+    like Django's GZipMiddleware, with a size threshold, brotli and a
+    list of content types - not HTML, the browsable API pages carry the
+    CSRF token (BREACH)
+    """
+
+    def process_response(self, request, response):
+        """Compress the response body if it is worth it"""
+        config = settings.COMPRESSION
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '') \
+            .split(';')[0].strip().lower()
+        if content_type not in config['CONTENT_TYPES']:
+            return response
+        # not worth the CPU time (and the bytes of the gzip header)
+        if not response.streaming and \
+                len(response.content) < config['MIN_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = compression.choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+        level = config['BROTLI_QUALITY'] if encoding == 'br' \
+            else config['GZIP_LEVEL']
+
+        if response.streaming:
+            response.streaming_content = compression.compress_sequence(
+                response.streaming_content, encoding, level)
+            # the compressed size is not known before the end
+            del response['Content-Length']
+        else:
+            compressed = compression.compress(
+                response.content, encoding, level)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # another encoding, other bytes - the ETag of the response is weak
+        # (RFC 7232 section-2.1), If-None-Match still compares it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:49
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merge tags/ingredients with the same user and name into one row
+    so the unique constraints can be created on existing data
+    """
+    Recipe = apps.get_model('core', 'Recipe')
+    for model_name, field in (('Tag', 'tags'), ('Ingredient', 'ingredients')):
+        model = apps.get_model('core', model_name)
+        through = getattr(Recipe, field).through
+        fk = f'{model_name.lower()}_id'
+        duplicates = (
+            model.objects.values('user_id', 'name')
+            .annotate(count=Count('id'), keep_id=Min('id'))
+            .filter(count__gt=1)
+        )
+        for duplicate in duplicates:
+            dupe_ids = list(
+                model.objects.filter(
+                    user_id=duplicate['user_id'],
+                    name=duplicate['name'],
+                ).exclude(id=duplicate['keep_id']).values_list('id', flat=True)
+            )
+            recipe_ids = through.objects.filter(
+                **{f'{fk}__in': dupe_ids}
+            ).values_list('recipe_id', flat=True)
+            through.objects.bulk_create(
+                [
+                    through(recipe_id=recipe_id, **{fk: duplicate['keep_id']})
+                    for recipe_id in set(recipe_ids)
+                ],
+                ignore_conflicts=True,
+            )
+            model.objects.filter(id__in=dupe_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_versions(apps, schema_editor):
+    """Create the data versions of the existing users"""
+    User = apps.get_model('core', 'User')
+    UserDataVersion = apps.get_model('core', 'UserDataVersion')
+    UserDataVersion.objects.bulk_create(
+        [UserDataVersion(user_id=pk)
+         for pk in User.objects.values_list('id', flat=True)],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_tag_ingredient_user_name_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDataVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.user')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:08
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+# a frozen copy of core.models.recipe_search_vector, as it was when this
+# migration was written - later changes of the model must not change it
+def search_vector(Recipe):
+    """Return the search vector expression of the recipe rows"""
+    def names(through, column):
+        return Subquery(
+            through.objects.filter(recipe_id=OuterRef('pk'))
+            .values('recipe_id')
+            .annotate(names=StringAgg(f'{column}__name', ' '))
+            .values('names')
+        )
+
+    return (
+        SearchVector('title', weight='A', config='english') +
+        SearchVector(
+            names(Recipe.tags.through, 'tag'),
+            names(Recipe.ingredients.through, 'ingredient'),
+            weight='B',
+            config='english',
+        ) +
+        SearchVector('description', weight='C', config='english')
+    )
+
+
+def fill_search_vectors(apps, schema_editor):
+    """Compute the search vectors of the existing recipes"""
+    Recipe = apps.get_model('core', 'Recipe')
+    ids = Recipe.objects.order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        # committed batch by batch, the rows are found by their id
+        batch = list(ids.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        with transaction.atomic():
+            Recipe.objects.filter(id__in=batch) \
+                .update(search_vector=search_vector(Recipe))
+        last_id = batch[-1]
+
+
+class Migration(migrations.Migration):
+
+    # the vectors of the existing recipes are filled in batches which are
+    # committed one by one - no transaction locks the whole recipe table
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # before the index - building it once is faster than updating it
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='core_recipe_search_idx'),
+        ),
+    ]
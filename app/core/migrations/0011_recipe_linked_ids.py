@@ -0,0 +1,80 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:12
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields import ArrayField
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 5000
+
+
+# a frozen copy of core.models.recipe_linked_ids, like in 0010
+def linked_ids(Recipe):
+    """Return the expressions of the sorted tag_ids/ingredient_ids"""
+    def ids(through, column):
+        output_field = ArrayField(models.BigIntegerField())
+        return Coalesce(
+            Subquery(
+                through.objects.filter(recipe_id=OuterRef('pk'))
+                .values('recipe_id')
+                .annotate(ids=ArrayAgg(column, ordering=column))
+                .values('ids'),
+                output_field=output_field,
+            ),
+            Value([], output_field=output_field),
+        )
+
+    return {
+        'tag_ids': ids(Recipe.tags.through, 'tag_id'),
+        'ingredient_ids': ids(Recipe.ingredients.through, 'ingredient_id'),
+    }
+
+
+def fill_linked_ids(apps, schema_editor):
+    """Compute the tag/ingredient id arrays of the existing recipes"""
+    Recipe = apps.get_model('core', 'Recipe')
+    ids = Recipe.objects.order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        batch = list(ids.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        with transaction.atomic():
+            Recipe.objects.filter(id__in=batch) \
+                .update(**linked_ids(Recipe))
+        last_id = batch[-1]
+
+
+class Migration(migrations.Migration):
+
+    # filled in batches committed one by one, like 0010
+    atomic = False
+
+    dependencies = [
+        ('core', '0010_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.RunPython(fill_linked_ids, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tag_ids'], name='core_recipe_tag_ids_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ingredient_ids'], name='core_recipe_ingredient_ids_idx'),
+        ),
+    ]
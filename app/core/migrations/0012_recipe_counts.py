@@ -0,0 +1,57 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# a frozen copy of core.models.recipe_count, like in 0010
+def recipe_count(attr_model):
+    """Return the expression counting the recipes of the rows"""
+    through = attr_model.recipe_set.through
+    column = f'{attr_model._meta.model_name}_id'
+    return Coalesce(
+        Subquery(
+            through.objects.filter(**{column: OuterRef('pk')})
+            .order_by().values(column)
+            .annotate(count=Count('*')).values('count'),
+            output_field=models.IntegerField(),
+        ),
+        0,
+    )
+
+
+def count_recipes(apps, schema_editor):
+    """Count the recipes of the existing tags and ingredients"""
+    for name in ('Tag', 'Ingredient'):
+        model = apps.get_model('core', name)
+        model.objects.update(recipe_count=recipe_count(model))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recipe_linked_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_recipes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(condition=models.Q(('recipe_count__gt', 0)), fields=['user', 'name'], name='core_ingredient_assigned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(condition=models.Q(('recipe_count__gt', 0)), fields=['user', 'name'], name='core_tag_assigned_idx'),
+        ),
+    ]
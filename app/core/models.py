@@ -3,8 +3,17 @@ Dababase  models.
 """
 import uuid
 import os
+import threading
+from contextlib import contextmanager
 from django.conf import settings
-from django.db import models  # noqa
+from django.contrib.postgres.aggregates import ArrayAgg, StringAgg
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models, transaction  # noqa
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -61,12 +70,260 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
 
 
+# recipes, tags and ingredients whose denormalized columns are recomputed
+# at the end of the Recipe.objects.sync_once() block running in the thread
+_pending = threading.local()
+
+
+def recipe_count(attr_model):
+    """Return the expression counting the recipes of the tag/ingredient rows
+    the model is a parameter so that migrations can pass the historical one
+    """
+    through = attr_model.recipe_set.through
+    column = f'{attr_model._meta.model_name}_id'
+    return Coalesce(
+        Subquery(
+            through.objects.filter(**{column: OuterRef('pk')})
+            .order_by().values(column)
+            .annotate(count=Count('*')).values('count'),
+            output_field=models.IntegerField(),
+        ),
+        0,
+    )
+
+
+class RecipeAttrQuerySet(models.QuerySet):
+    """Query set of recipe attributes"""
+
+    def recount(self):
+        """Recompute recipe_count, return the number of corrected rows"""
+        # the rows are locked first (in id order - no deadlocks), so the
+        # count, a new statement with a new READ COMMITTED snapshot, sees
+        # the links of the concurrent transactions which held the locks
+        # savepoint=False: no SAVEPOINT queries inside an outer atomic
+        with transaction.atomic(savepoint=False):
+            locked = list(self.select_for_update().order_by('pk')
+                          .values_list('pk', flat=True))
+            if not locked:
+                return 0
+            counted = recipe_count(self.model)
+            return self.model.objects.filter(pk__in=locked) \
+                .exclude(recipe_count=counted) \
+                .update(recipe_count=counted)
+
+
+# manager shared by the models which are owned by a user and identified
+# by their name (tags, ingredients)
+class RecipeAttrManager(models.Manager.from_queryset(RecipeAttrQuerySet)):
+    """Manager for recipe attributes"""
+
+    def recount_recipes(self, *pks):
+        """Recompute recipe_count of the items - see sync_once"""
+        counts = getattr(_pending, 'counts', None)
+        if counts is not None:
+            counts.setdefault(self.model, set()).update(pks)
+        elif pks:
+            self.filter(pk__in=pks).recount()
+
+    def get_or_create_by_names(self, user, names):
+        """Return a dict name -> object, creating the missing ones
+        set based: one SELECT for all names, and for the missing ones
+        one INSERT ... ON CONFLICT DO NOTHING and one SELECT to read them
+        back, whatever the number of names
+        """
+        # unique and sorted - concurrent writes with the same names in
+        # another order take the locks of the unique index in the same
+        # order, they wait for each other instead of deadlocking
+        names = sorted(set(names))
+        if not names:
+            return {}
+        objs = {
+            obj.name: obj for obj in self.filter(user=user, name__in=names)
+        }
+        missing = [name for name in names if name not in objs]
+        if missing:
+            # the unique (user, name) constraint turns concurrent inserts
+            # of the same name into no-ops instead of duplicates
+            self.bulk_create(
+                [self.model(user=user, name=name) for name in missing],
+                ignore_conflicts=True,
+            )
+            # bulk_create sends no signals, so the data version is bumped
+            # here - only when there are new rows, the cached responses
+            # stay valid when all the names existed
+            UserDataVersion.objects.bump(user.id)
+            objs.update(
+                (obj.name, obj)
+                for obj in self.filter(user=user, name__in=missing)
+            )
+        return objs
+
+
+# text search configuration of the recipe search vectors and queries
+SEARCH_CONFIG = 'english'
+
+
+def recipe_search_vector(recipe_model):
+    """Return the search vector expression of the recipe rows
+    title weighs most, then the tag and ingredient names, then description
+    the model is a parameter so that migrations can pass the historical one
+    """
+    def names(through, column):
+        # the names of the linked rows in one string, NULL without links
+        return Subquery(
+            through.objects.filter(recipe_id=OuterRef('pk'))
+            .values('recipe_id')
+            .annotate(names=StringAgg(f'{column}__name', ' '))
+            .values('names')
+        )
+
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG) +
+        SearchVector(
+            names(recipe_model.tags.through, 'tag'),
+            names(recipe_model.ingredients.through, 'ingredient'),
+            weight='B',
+            config=SEARCH_CONFIG,
+        ) +
+        SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def recipe_linked_ids(recipe_model):
+    """Return the expressions of the tag_ids and ingredient_ids arrays
+    the ids are sorted - the API renders the linked items in this order
+    """
+    def ids(through, column):
+        output_field = ArrayField(models.BigIntegerField())
+        # array_agg(... ORDER BY ...) - Django drops the ORDER BY of
+        # subqueries, an ordered aggregate keeps it
+        return Coalesce(
+            Subquery(
+                through.objects.filter(recipe_id=OuterRef('pk'))
+                .values('recipe_id')
+                .annotate(ids=ArrayAgg(column, ordering=column))
+                .values('ids'),
+                output_field=output_field,
+            ),
+            Value([], output_field=output_field),
+        )
+
+    return {
+        'tag_ids': ids(recipe_model.tags.through, 'tag_id'),
+        'ingredient_ids': ids(
+            recipe_model.ingredients.through, 'ingredient_id'),
+    }
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Query set of recipes"""
+
+    def sync_denormalized(self):
+        """Recompute the columns copied from the links - one UPDATE"""
+        return self.update(
+            search_vector=recipe_search_vector(self.model),
+            **recipe_linked_ids(self.model),
+        )
+
+
+# the search vector and the id arrays of a recipe are copies of its
+# tags/ingredients, they are recomputed from the m2m tables by the signals
+# (core/signals.py) and explicitly by the bulk writers, which send none
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+    """Manager for recipes"""
+
+    def sync(self, *recipe_ids):
+        """Recompute the denormalized columns of the recipes"""
+        deferred = getattr(_pending, 'recipe_ids', None)
+        if deferred is not None:
+            deferred.update(recipe_ids)
+        elif recipe_ids:
+            self.filter(pk__in=recipe_ids).sync_denormalized()
+
+    # like UserDataVersion.objects.bump_once - a write of a recipe with
+    # its tags and ingredients sends several signals, inside this block
+    # they only collect the recipes (sync) and tags/ingredients
+    # (recount_recipes) which are updated once at the end
+    @contextmanager
+    def sync_once(self):
+        """Recompute the denormalized columns once for the whole block"""
+        if getattr(_pending, 'recipe_ids', None) is not None:
+            yield  # an outer block does it
+            return
+        _pending.recipe_ids, _pending.counts = set(), {}
+        try:
+            yield
+        finally:
+            recipe_ids, counts = _pending.recipe_ids, _pending.counts
+            _pending.recipe_ids = _pending.counts = None
+        # not in finally - the transaction is unusable after an error
+        self.sync(*recipe_ids)
+        for model, pks in counts.items():
+            model.objects.recount_recipes(*pks)
+
+
 # this model is created from scratch - it uses Model as the basis
+class ImageBlobManager(models.Manager):
+    """Manager for the stored images shared by recipes"""
+
+    def pin(self, sha256):
+        """Take a reference to the blob of an upload, creating it if it is
+        new - the blob is not collected while it is pinned
+        """
+        with transaction.atomic():
+            # the row lock waits for a collection of the same blob
+            blob, _ = self.select_for_update().get_or_create(sha256=sha256)
+            self.filter(pk=blob.pk).update(
+                ref_count=models.F('ref_count') + 1)
+        blob.ref_count += 1
+        return blob
+
+    def release(self, *pks):
+        """Drop references to blobs, a blob without references is removed
+        later by core.images.collect_garbage
+        """
+        for pk in filter(None, pks):
+            self.filter(pk=pk).update(
+                ref_count=models.F('ref_count') - 1,
+                updated_at=timezone.now(),
+            )
+
+
+class ImageBlob(models.Model):
+    """A processed image with its renditions, stored once for all the
+    recipes using it (identical uploads share it)
+    """
+    # of the uploaded bytes, computed while the upload is staged
+    sha256 = models.CharField(max_length=64, unique=True)
+    # paths relative to MEDIA_ROOT, empty until processed (core/images.py)
+    image = models.CharField(max_length=255, blank=True)
+    renditions = models.JSONField(default=dict, blank=True)
+    # recipes and image jobs holding the blob
+    ref_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ImageBlobManager()
+
+    class Meta:
+        indexes = [
+            # the blobs waiting to be collected
+            models.Index(
+                fields=['updated_at'],
+                condition=models.Q(ref_count=0),
+                name='core_imageblob_unused_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return self.sha256
+
+
 class Recipe(models.Model):
     """Recipe object model"""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False,  # core_recipe_user_id_desc_idx starts with user
     )
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
@@ -75,11 +332,91 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    image = models.ImageField(
+        null=True, upload_to=recipe_image_file_path, max_length=255)
+    # smaller copies of the image: {size: {format: path}} (core/images.py)
+    image_renditions = models.JSONField(
+        default=dict, blank=True, editable=False)
+    # the blob the image and renditions are copied from, None for images
+    # uploaded before the blobs existed
+    image_blob = models.ForeignKey(
+        ImageBlob,
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.PROTECT,  # blobs are collected when unreferenced
+        related_name='recipes',
+    )
+    # title, description, tag and ingredient names for the full text
+    # search - kept up to date by core/signals.py and the bulk writers
+    search_vector = SearchVectorField(null=True, editable=False)
+    # copies of the m2m links for filtering without joins (&& and @>)
+    tag_ids = ArrayField(
+        models.BigIntegerField(), default=list, blank=True, editable=False)
+    ingredient_ids = ArrayField(
+        models.BigIntegerField(), default=list, blank=True, editable=False)
+
+    objects = RecipeManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='core_recipe_search_idx'),
+            GinIndex(fields=['tag_ids'], name='core_recipe_tag_ids_idx'),
+            GinIndex(
+                fields=['ingredient_ids'],
+                name='core_recipe_ingredient_ids_idx',
+            ),
+            # the recipe list: WHERE user_id = ... ORDER BY id DESC
+            models.Index(
+                fields=['user', '-id'],
+                name='core_recipe_user_id_desc_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+
+class ImageJob(models.Model):
+    """Processing of an uploaded recipe image by the image worker"""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, related_name='image_jobs')
+    # the upload as received, relative to MEDIA_ROOT (see core/images.py)
+    staged_path = models.CharField(max_length=255)
+    # of the staged file, the key of its ImageBlob
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the queue - the done/failed jobs are not in the index
+            models.Index(
+                fields=['status', 'id'],
+                condition=models.Q(status__in=['pending', 'processing']),
+                name='core_imagejob_queue_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.status}'
+
+
 class Tag(models.Model):
     """Tag for filtering recipes."""
     name = models.CharField(max_length=255)
@@ -88,6 +425,30 @@ class Tag(models.Model):
         on_delete=models.CASCADE
     )
 
+    # number of linked recipes, kept up to date by core/signals.py
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = RecipeAttrManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                # covering - the lists (user, ORDER BY name) need only
+                # the index, no heap access
+                include=['id'],
+                name='core_tag_user_name_uniq',
+            ),
+        ]
+        indexes = [
+            # the assigned_only list: only the items with recipes
+            models.Index(
+                fields=['user', 'name'],
+                condition=models.Q(recipe_count__gt=0),
+                name='core_tag_assigned_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -100,5 +461,88 @@ class Ingredient(models.Model):
         on_delete=models.CASCADE
     )
 
+    # number of linked recipes, kept up to date by core/signals.py
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = RecipeAttrManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                # covering - the lists (user, ORDER BY name) need only
+                # the index, no heap access
+                include=['id'],
+                name='core_ingredient_user_name_uniq',
+            ),
+        ]
+        indexes = [
+            # the assigned_only list: only the items with recipes
+            models.Index(
+                fields=['user', 'name'],
+                condition=models.Q(recipe_count__gt=0),
+                name='core_ingredient_assigned_idx',
+            ),
+        ]
+
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class UserDataVersionManager(models.Manager):
+    """Manager for user data versions"""
+
+    _deferred = threading.local()
+
+    def get_version(self, user_id):
+        """Return the current data version of the user or None"""
+        return self.filter(user_id=user_id) \
+            .values_list('version', flat=True).first()
+
+    def bump(self, *user_ids):
+        """Change the data version of the users - one UPDATE for all"""
+        deferred = getattr(self._deferred, 'user_ids', set())
+        user_ids = set(user_ids) - deferred
+        if not user_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {self.model._meta.db_table} '
+                'SET version = version + 1 WHERE user_id = ANY(%s)',
+                [list(user_ids)],
+            )
+
+    # a write of a recipe with its tags and ingredients sends many signals
+    # which would bump the version many times, inside this block they are
+    # skipped and the version is bumped once at the end
+    @contextmanager
+    def bump_once(self, user_id):
+        """Bump the data version once for all the changes in the block"""
+        deferred = getattr(self._deferred, 'user_ids', set())
+        if user_id in deferred:  # an outer block bumps it
+            yield
+            return
+        self._deferred.user_ids = deferred | {user_id}
+        try:
+            yield
+        finally:
+            self._deferred.user_ids = deferred
+        # not in finally - the transaction is unusable after an error
+        self.bump(user_id)
+
+
+# cached API responses are keyed by this version instead of being deleted
+# when the data changes - a changed version makes all the cached responses
+# of the user unreachable at once, old entries are evicted by the cache
+# the row is created with the user (core/signals.py) and bumped by the
+# signals whenever a recipe, tag, ingredient or their links change
+class UserDataVersion(models.Model):
+    """Version of the recipes, tags and ingredients of a user"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    version = models.BigIntegerField(default=0)
+
+    objects = UserDataVersionManager()
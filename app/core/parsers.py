@@ -0,0 +1,37 @@
+"""
+JSON parser of the API backed by orjson.
+
+Like core.renderers, without orjson (or for the input it does not take)
+the parser is DRF's JSONParser.
+"""
+import codecs
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from core.renderers import FastJSONRenderer, orjson
+
+
+class FastJSONParser(JSONParser):
+    """Parse JSON request bodies with orjson
+
+    unlike json.loads orjson reads the integers over 64 bits as floats,
+    bigger than any integer field of the API (and of PostgreSQL) anyway
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Parse the incoming bytestream as JSON, return the data"""
+        encoding = (parser_context or {}).get(
+            'encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # lone surrogates... json.loads takes them, and gives the
+            # error messages of DRF for invalid JSON
+            return super().parse(
+                io.BytesIO(body), media_type, parser_context)
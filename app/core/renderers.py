@@ -0,0 +1,53 @@
+"""
+JSON renderer of the API backed by orjson.
+
+orjson is optional - without it (or for the output it cannot write the
+way json.dumps does) the renderer is DRF's JSONRenderer, so the bytes of
+a response do not depend on which one wrote them.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # the pure Python renderer of DRF is used
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Render the compact JSON of DRF with orjson
+
+    the types orjson does not know (Decimal, lazy strings, ...) and the
+    dates - orjson formats them on its own - go through DRF's encoder,
+    pretty printed or ASCII-only output is left to json.dumps
+    floats are the shortest repr too but the exponents differ (1e16, not
+    1e+16) and a NaN or infinite float is written as null instead of
+    failing - the serializers of the API do not output floats
+    """
+    options = orjson and orjson.OPT_NON_STR_KEYS | \
+        orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into JSON, returning a bytestring"""
+        if orjson is None or data is None or self.ensure_ascii \
+                or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=self.options,
+            )
+        except orjson.JSONEncodeError:
+            # e.g. integers over 64 bits - json.dumps writes them, or
+            # raises the error DRF would
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # escaped like DRF does, the output stays a strict javascript subset
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028') \
+                .replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,178 @@
+"""
+Signal handlers of the core app.
+"""
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core.authentication import invalidate_tokens
+from core.models import (
+    ImageBlob,
+    ImageJob,
+    Recipe,
+    Tag,
+    Ingredient,
+    UserDataVersion,
+)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Forget the cached authentication of a deleted token"""
+    invalidate_tokens([instance.key])
+
+
+# any change of a user (deactivation, is_active, name...) drops its cached
+# authentications, the next request reads the fresh user from the db
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, **kwargs):
+    """Forget the cached authentications of a changed user"""
+    if created:
+        UserDataVersion.objects.create(user=instance)
+    else:
+        invalidate_tokens(
+            Token.objects.filter(user_id=instance.pk)
+            .values_list('key', flat=True)
+        )
+
+
+# the data version of the owner changes with every write of its recipes,
+# tags, ingredients and the links between them (see UserDataVersion)
+# bulk operations do not send signals and bump the version themselves
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_data_changed(sender, instance, **kwargs):
+    """Bump the data version of the owner"""
+    UserDataVersion.objects.bump(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_links_changed(sender, instance, action, **kwargs):
+    """Bump the data version when tags/ingredients are (un)linked"""
+    if action.startswith('post_'):
+        UserDataVersion.objects.bump(instance.user_id)
+
+
+# the search vector of a recipe holds its title, description and the names
+# of its tags and ingredients, tag_ids/ingredient_ids hold its links, so
+# they change with the recipe, with its links and with renames and deletes
+# of the linked tags/ingredients (see Recipe.objects.sync)
+# bulk operations do not send signals and sync the recipes themselves
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, update_fields=None, **kwargs):
+    """Recompute the denormalized columns of a saved recipe"""
+    if update_fields and not {'title', 'description'} & set(update_fields):
+        return
+    Recipe.objects.sync(instance.pk)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_links_synced(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """Recompute the denormalized columns of (un)linked recipes"""
+    if not reverse:  # recipe.tags.add(...)
+        if action.startswith('post_'):
+            Recipe.objects.sync(instance.pk)
+    elif action == 'pre_clear':  # tag.recipe_set.clear()
+        instance._synced_recipe_ids = _linked_recipe_ids(instance)
+    elif action == 'post_clear':
+        Recipe.objects.sync(*instance._synced_recipe_ids)
+    elif action in ('post_add', 'post_remove'):  # tag.recipe_set.add(...)
+        Recipe.objects.sync(*pk_set)
+
+
+def _linked_recipe_ids(attr):
+    """Return the ids of the recipes linked to a tag or an ingredient"""
+    return list(attr.recipe_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def recipe_attr_saved(sender, instance, created, update_fields=None,
+                      **kwargs):
+    """Recompute the search vectors of the recipes of a renamed item"""
+    if created or (update_fields and 'name' not in update_fields):
+        return
+    Recipe.objects.sync(*_linked_recipe_ids(instance))
+
+
+# the links go with the deleted item (cascade, no m2m_changed signal)
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def recipe_attr_deleting(sender, instance, **kwargs):
+    """Remember the recipes of an item which is going to be deleted"""
+    instance._synced_recipe_ids = _linked_recipe_ids(instance)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_deleted(sender, instance, **kwargs):
+    """Recompute the columns of the recipes of a deleted item"""
+    Recipe.objects.sync(*getattr(instance, '_synced_recipe_ids', []))
+
+
+# recipe_count of tags/ingredients changes with the links, the affected
+# items are recounted from the m2m tables (see RecipeAttrQuerySet.recount)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_links_counted(sender, instance, action, reverse, model, pk_set,
+                         **kwargs):
+    """Recount the recipes of (un)linked tags/ingredients"""
+    if reverse:  # tag.recipe_set.add(...)
+        if action.startswith('post_'):
+            type(instance).objects.recount_recipes(instance.pk)
+    elif action == 'pre_clear':  # recipe.tags.clear()
+        instance._counted_ids = list(
+            sender.objects.filter(recipe_id=instance.pk)
+            .values_list(f'{model._meta.model_name}_id', flat=True))
+    elif action == 'post_clear':
+        model.objects.recount_recipes(*instance._counted_ids)
+    elif action in ('post_add', 'post_remove'):  # recipe.tags.add(...)
+        model.objects.recount_recipes(*pk_set)
+
+
+# the links go with the deleted recipe (cascade, no m2m_changed signal)
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    """Remember the links and the image blob of a recipe to be deleted"""
+    instance._deleted_links = Recipe.objects.filter(pk=instance.pk) \
+        .values_list('tag_ids', 'ingredient_ids', 'image_blob_id') \
+        .first() or ([], [], None)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Recount the recipes of the tags/ingredients of a deleted recipe"""
+    tag_ids, ingredient_ids, _ = instance._deleted_links
+    Tag.objects.recount_recipes(*tag_ids)
+    Ingredient.objects.recount_recipes(*ingredient_ids)
+
+
+# jobs of a deleted recipe go with it (cascade) before the worker ran
+@receiver(post_delete, sender=ImageJob)
+def image_job_deleted(sender, instance, **kwargs):
+    """Remove the staged upload of a job which was not processed"""
+    if instance.status in (ImageJob.PENDING, ImageJob.PROCESSING):
+        transaction.on_commit(
+            lambda: default_storage.delete(instance.staged_path))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_released(sender, instance, **kwargs):
+    """Drop the reference of a deleted recipe to its image blob"""
+    ImageBlob.objects.release(instance._deleted_links[2])
@@ -0,0 +1,151 @@
+"""
+Tests for the ASGI application
+"""
+import asyncio
+import json
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+from rest_framework.authtoken.models import Token
+
+from app.asgi import application
+from core.db.backends.postgresql import base
+from core.models import Recipe, Tag
+from recipe.views import RecipeViewSet
+
+
+async def get(path, headers=()):
+    """Send a GET request to the application, return (status, body)"""
+    communicator = ApplicationCommunicator(application, {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'query_string': b'',
+        'headers': [(b'host', b'testserver'), *headers],
+    })
+    await communicator.send_input({'type': 'http.request'})
+    start = await communicator.receive_output(10)
+    body = b''
+    while True:
+        message = await communicator.receive_output(10)
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    await communicator.wait()
+    return start['status'], body
+
+
+class ASGIApplicationTests(SimpleTestCase):
+    """Test the ASGI entrypoint of the production server"""
+
+    @async_to_sync
+    async def test_lifespan(self):
+        """Test the lifespan events of the server are answered"""
+        communicator = ApplicationCommunicator(application, {
+            'type': 'lifespan'})
+
+        await communicator.send_input({'type': 'lifespan.startup'})
+        started = await communicator.receive_output()
+        await communicator.send_input({'type': 'lifespan.shutdown'})
+        stopped = await communicator.receive_output()
+        await communicator.wait()
+
+        self.assertEqual(started['type'], 'lifespan.startup.complete')
+        self.assertEqual(stopped['type'], 'lifespan.shutdown.complete')
+
+    @async_to_sync
+    async def test_health_check(self):
+        """Test a request goes through Django"""
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': '/api/health-check/',
+            'query_string': b'',
+            'headers': [(b'host', b'testserver')],
+        })
+
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output()
+        body = await communicator.receive_output()
+        await communicator.wait()
+
+        self.assertEqual(start['status'], 200)
+        self.assertEqual(json.loads(body['body']), {'healthy': True})
+
+
+# the requests run in a real event loop (asyncio.run) - under async_to_sync
+# the sync code of Django would run in the thread of the test
+@patch('app.asgi.WEB_THREADS', 2)
+class ASGIThreadsTests(TransactionTestCase):
+    """Test the threads running the requests of the ASGI application"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+        self.user = user
+        token = Token.objects.create(user=user)
+        self.headers = [(b'authorization', f'Token {token.key}'.encode())]
+
+    def get_many(self, path, count):
+        """Send `count` requests at the same time, return the statuses"""
+        async def send():
+            return await asyncio.gather(
+                *(get(path, self.headers) for _ in range(count)))
+
+        return [status for status, _ in asyncio.run(send())]
+
+    def test_pool_connections_given_back(self):
+        """Test more requests than pooled connections are served"""
+        # a pool of its own, not one the other tests made
+        with patch.dict(connection.settings_dict, {
+                'CONN_MAX_AGE': 60, 'POOL_MAX_SIZE': 2, 'POOL_TIMEOUT': 1}), \
+                patch.dict(base._pools, clear=True):
+            pool = connection.pool
+            try:
+                statuses = self.get_many('/api/recipe/recipes/', 6)
+            finally:
+                pool.close()  # the test database is dropped later
+
+        self.assertEqual(statuses, [200] * 6)
+
+    def test_connections_reused(self):
+        """Test the threads keep their connections (CONN_MAX_AGE)"""
+        new_connection = base.DatabaseWrapper.get_new_connection
+        with patch.dict(connection.settings_dict, {'CONN_MAX_AGE': 60}), \
+                patch.object(base.DatabaseWrapper, 'get_new_connection',
+                             autospec=True,
+                             side_effect=new_connection) as patched:
+            statuses = self.get_many('/api/recipe/recipes/', 6)
+
+        self.assertEqual(statuses, [200] * 6)
+        self.assertLessEqual(patched.call_count, 2)
+
+    @patch.object(RecipeViewSet, 'export_chunk_size', 2)
+    def test_streaming_export(self):
+        """Test the streamed export reads its recipes in the thread"""
+        for i in range(5):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Soup {i}', time_minutes=5, price=1)
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'T{i}'))
+
+        status, body = asyncio.run(
+            get('/api/recipe/recipes/export/', self.headers))
+
+        self.assertEqual(status, 200)
+        lines = body.decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)['title'] for line in lines],
+            [f'Soup {i}' for i in range(5)],
+        )
@@ -0,0 +1,156 @@
+"""
+Tests for the cached token authentication.
+"""
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from core.authentication import (
+    CachedTokenAuthentication,
+    LRUCache,
+    get_token_cache,
+)
+
+
+class LRUCacheTests(SimpleTestCase):
+    """Test the in-process LRU cache"""
+
+    def test_evicts_least_recently_used(self):
+        """Test the oldest unused entry is evicted above the max size"""
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    @patch('core.authentication.time.monotonic')
+    def test_entries_expire(self, patched_monotonic):
+        """Test entries are gone after the TTL"""
+        patched_monotonic.return_value = 100
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+
+        patched_monotonic.return_value = 159
+        self.assertEqual(cache.get('a'), 1)
+        patched_monotonic.return_value = 160
+        self.assertIsNone(cache.get('a'))
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Test authenticating tokens through the cache"""
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def test_cached_authentication_runs_no_query(self):
+        """Test the second authentication of a token is not queried"""
+        user, token = self.auth.authenticate_credentials(self.token.key)
+
+        with CaptureQueriesContext(connection) as queries:
+            cached_user, cached_token = \
+                self.auth.authenticate_credentials(self.token.key)
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cached_user, self.user)
+        self.assertEqual(cached_token, self.token)
+        self.assertIsNot(cached_user, user)
+
+    def test_deleted_token_invalidated(self):
+        """Test a deleted token cannot authenticate any more"""
+        self.auth.authenticate_credentials(self.token.key)
+        self.token.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_deactivated_user_invalidated(self):
+        """Test the token of a deactivated user cannot authenticate"""
+        self.auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+    def test_api_request_with_cached_token(self):
+        """Test repeated API requests skip the token query"""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        url = reverse('user:me')
+
+        res = client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            res = client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+        self.assertFalse(
+            any('authtoken_token' in q['sql'] for q in queries))
+
+
+@override_settings(TOKEN_AUTH_CACHE={'MAX_SIZE': 10, 'TTL': 60,
+                                     'CACHE': 'default'})
+class SharedTokenCacheTests(TestCase):
+    """Test authenticating tokens through a cache shared by processes"""
+
+    def setUp(self):
+        get_token_cache().clear()
+        caches['default'].clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+        self.token = Token.objects.create(user=self.user)
+        # authenticators of two processes - they share no local state
+        self.auths = [CachedTokenAuthentication(), CachedTokenAuthentication()]
+
+    def test_cached_in_shared_cache_only(self):
+        """Test the authentication is shared and not kept per process"""
+        self.auths[0].authenticate_credentials(self.token.key)
+
+        with CaptureQueriesContext(connection) as queries:
+            user, _ = self.auths[1].authenticate_credentials(self.token.key)
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(user, self.user)
+        self.assertIsNone(get_token_cache().get(self.token.key))
+
+    def test_deleted_token_invalidated_for_all(self):
+        """Test a deleted token is rejected by every authenticator"""
+        for auth in self.auths:
+            auth.authenticate_credentials(self.token.key)
+        self.token.delete()
+
+        for auth in self.auths:
+            with self.assertRaises(AuthenticationFailed):
+                auth.authenticate_credentials(self.token.key)
+
+    def test_deactivated_user_invalidated_for_all(self):
+        """Test a deactivated user is rejected by every authenticator"""
+        for auth in self.auths:
+            auth.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+
+        for auth in self.auths:
+            with self.assertRaises(AuthenticationFailed):
+                auth.authenticate_credentials(self.token.key)
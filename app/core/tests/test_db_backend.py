@@ -0,0 +1,117 @@
+"""
+Tests for the PostgreSQL backend with health checks and pooling.
+"""
+from unittest.mock import MagicMock
+
+from django.db import connection
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase, TestCase
+from psycopg2 import extensions
+
+from core.db.backends.postgresql.base import ConnectionPool
+
+
+def fake_connection():
+    """Return a mocked idle psycopg2 connection"""
+    conn = MagicMock(closed=False)
+    conn.get_transaction_status.return_value = \
+        extensions.TRANSACTION_STATUS_IDLE
+    return conn
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Test the connection pool"""
+
+    def test_reuses_released_connection(self):
+        """Test a released connection is given to the next caller"""
+        pool = ConnectionPool(max_size=2, timeout=0)
+        conn = pool.acquire(fake_connection)
+        pool.release(conn)
+
+        self.assertIs(pool.acquire(fake_connection), conn)
+
+    def test_caps_open_connections(self):
+        """Test no more than max_size connections are handed out"""
+        pool = ConnectionPool(max_size=1, timeout=0.01)
+        conn = pool.acquire(fake_connection)
+
+        with self.assertRaises(OperationalError):
+            pool.acquire(fake_connection)
+        pool.release(conn)
+        self.assertIs(pool.acquire(fake_connection), conn)
+
+    def test_broken_connection_not_reused(self):
+        """Test a connection in an unknown state is closed"""
+        pool = ConnectionPool(max_size=1, timeout=0)
+        conn = pool.acquire(fake_connection)
+        conn.get_transaction_status.return_value = \
+            extensions.TRANSACTION_STATUS_UNKNOWN
+        pool.release(conn)
+
+        conn.close.assert_called_once()
+        self.assertIsNot(pool.acquire(fake_connection), conn)
+
+    def test_ping_replaces_dead_idle_connection(self):
+        """Test an idle connection which does not answer is replaced"""
+        pool = ConnectionPool(max_size=1, timeout=0)
+        conn = pool.acquire(fake_connection)
+        pool.release(conn)
+        conn.cursor.side_effect = OperationalError('server closed')
+
+        self.assertIsNot(pool.acquire(fake_connection, ping=True), conn)
+        conn.close.assert_called_once()
+
+
+class DatabaseWrapperTests(TestCase):
+    """Test health checks and pooling of real connections"""
+
+    def setUp(self):
+        # a separate connection - the test one is inside a transaction
+        self.db = connection.copy()
+
+    def tearDown(self):
+        self.db.close()
+        if self.db.pool is not None:
+            self.db.pool.close()  # the test database is dropped later
+
+    def test_health_check_replaces_dead_connection(self):
+        """Test a reused connection which died is replaced"""
+        self.db.settings_dict['CONN_HEALTH_CHECKS'] = True
+        self.db.ensure_connection()
+        dead = self.db.connection
+        dead.close()  # like a server restart or an idle timeout
+
+        self.db.close_if_unusable_or_obsolete()  # a new request starts
+        with self.db.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+        self.assertIsNot(self.db.connection, dead)
+
+    def test_pool_reuses_connection(self):
+        """Test a closed connection goes back to the pool and is reused"""
+        self.db.settings_dict['POOL_MAX_SIZE'] = 1
+        self.db.ensure_connection()
+        raw = self.db.connection
+
+        self.db.close()
+        self.db.ensure_connection()
+
+        self.assertIs(self.db.connection, raw)
+        self.assertFalse(raw.closed)
+
+    def test_pool_replaces_terminated_connection(self):
+        """Test an idle pooled connection killed by the server is replaced"""
+        self.db.settings_dict['POOL_MAX_SIZE'] = 1
+        self.db.settings_dict['CONN_HEALTH_CHECKS'] = True
+        self.db.ensure_connection()
+        raw = self.db.connection
+        pid = raw.get_backend_pid()
+        self.db.close()  # the request ends, back to the pool
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+        self.db.close_if_unusable_or_obsolete()  # a new request starts
+        with self.db.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+        self.assertIsNot(self.db.connection, raw)
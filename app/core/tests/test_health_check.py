@@ -20,4 +20,13 @@ class HealthCheckTests(TestCase):
         url = reverse('health-check')
         res = client.get(url)
 
-        self.assertEqual(res.status_code, status.HTTP_200_OK)
\ No newline at end of file
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json(), {'healthy': True})
+
+    def test_health_check_get_only(self):
+        """Test the health check only answers GET"""
+        client = APIClient()
+        url = reverse('health-check')
+        res = client.post(url)
+
+        self.assertEqual(res.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -0,0 +1,220 @@
+"""
+Tests for the processing of uploaded images.
+"""
+import errno
+import hashlib
+import io
+import os
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import images
+from core.models import ImageBlob, ImageJob, Recipe, UserDataVersion
+
+
+def jpeg_upload(size, orientation=None):
+    """Return an uploaded JPEG file, with an EXIF orientation if given"""
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    Image.new('RGB', size, 'red').save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue())
+
+
+class ImageProcessingTests(TestCase):
+    """Test the image jobs"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='testpass123')
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=5,
+            price=Decimal('5.50'),
+        )
+
+    def tearDown(self):
+        for blob in ImageBlob.objects.all():
+            images.delete_image_files(blob.image, blob.renditions)
+        for job in ImageJob.objects.all():
+            images._delete_file(job.staged_path)
+
+    def process_jobs(self):
+        """Run the queued jobs like the image worker"""
+        with self.captureOnCommitCallbacks(execute=True):
+            return [images.process_job(job) for job in images.claim_jobs(10)]
+
+    def test_exif_orientation_applied(self):
+        """Test a photo taken sideways is stored upright"""
+        images.stage_upload(self.recipe, jpeg_upload((40, 20), 6))
+
+        job, = self.process_jobs()
+
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.recipe.refresh_from_db()
+        with Image.open(self.recipe.image.path) as image:
+            self.assertEqual(image.size, (20, 40))
+            self.assertNotIn(0x0112, image.getexif())
+        self.assertTrue(self.recipe.image.name.endswith('.jpg'))
+
+    def test_renditions_generated(self):
+        """Test the WebP and JPEG renditions of every size are stored"""
+        images.stage_upload(self.recipe, jpeg_upload((1600, 800)))
+
+        self.process_jobs()
+
+        self.recipe.refresh_from_db()
+        renditions = self.recipe.image_renditions
+        self.assertEqual(set(renditions), {'128', '512', '1024'})
+        for size, formats in renditions.items():
+            self.assertEqual(set(formats), {'webp', 'jpeg'})
+            for image_format, path in formats.items():
+                with Image.open(os.path.join(
+                        settings.MEDIA_ROOT, path)) as image:
+                    self.assertEqual(image.format, image_format.upper())
+                    self.assertEqual(image.size, (int(size), int(size) // 2))
+
+    def test_identical_uploads_share_blob(self):
+        """Test the same photo is stored once for all its recipes"""
+        other = Recipe.objects.create(
+            user=self.user, title='Other', time_minutes=5,
+            price=Decimal('1.00'),
+        )
+        images.stage_upload(self.recipe, jpeg_upload((10, 10)))
+        images.stage_upload(other, jpeg_upload((10, 10)))
+
+        self.process_jobs()
+
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(self.recipe.image_blob, blob)
+        self.assertEqual(other.image.name, blob.image)
+        self.assertEqual(other.image_renditions, blob.renditions)
+
+    @override_settings(IMAGE_PROCESSING={
+        **settings.IMAGE_PROCESSING, 'BLOB_GRACE': 0})
+    def test_unused_blob_collected(self):
+        """Test the files are removed when the last recipe lets go"""
+        other = Recipe.objects.create(
+            user=self.user, title='Other', time_minutes=5,
+            price=Decimal('1.00'),
+        )
+        images.stage_upload(self.recipe, jpeg_upload((10, 10)))
+        images.stage_upload(other, jpeg_upload((10, 10)))
+        self.process_jobs()
+        blob = ImageBlob.objects.get()
+        paths = images.image_paths(blob.image, blob.renditions)
+        self.assertEqual(len(paths), 7)
+
+        other.delete()
+        self.assertEqual(images.collect_garbage(), 0)
+
+        images.stage_upload(self.recipe, jpeg_upload((20, 20)))
+        self.process_jobs()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        self.assertEqual(images.collect_garbage(), 1)
+
+        self.assertFalse(ImageBlob.objects.filter(pk=blob.pk).exists())
+        for path in paths:
+            self.assertFalse(
+                os.path.exists(os.path.join(settings.MEDIA_ROOT, path)))
+
+    def test_file_names_follow_content(self):
+        """Test the stored files are named by the upload and their content"""
+        job = images.stage_upload(self.recipe, jpeg_upload((10, 10)))
+
+        self.process_jobs()
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(len(job.sha256), 64)
+        self.assertTrue(self.recipe.image.name.startswith(
+            f'uploads/recipe/{job.sha256[:2]}/{job.sha256}.'))
+        with self.recipe.image.open() as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self.assertTrue(self.recipe.image.name.endswith(f'.{digest[:16]}.jpg'))
+
+    def test_switch_bumps_data_version(self):
+        """Test the cached responses of the owner are dropped"""
+        images.stage_upload(self.recipe, jpeg_upload((10, 10)))
+        version = UserDataVersion.objects.get_version(self.user.id)
+
+        self.process_jobs()
+
+        self.assertNotEqual(
+            UserDataVersion.objects.get_version(self.user.id), version)
+
+    def test_claimed_jobs_not_claimed_again(self):
+        """Test a job is given to one worker only"""
+        images.stage_upload(self.recipe, jpeg_upload((10, 10)))
+
+        claimed = images.claim_jobs(10)
+
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual(images.claim_jobs(10), [])
+
+    def test_broken_image_failed(self):
+        """Test an image Pillow cannot decode is not retried"""
+        data = jpeg_upload((10, 10)).read()
+        images.stage_upload(
+            self.recipe, SimpleUploadedFile('photo.jpg', data[:200]))
+
+        job, = self.process_jobs()
+
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertIn('Invalid image', job.error)
+
+    def test_disk_error_retried(self):
+        """Test an error of the disk puts the job back to the queue"""
+        images.stage_upload(self.recipe, jpeg_upload((10, 10)))
+        error = OSError(errno.ENOSPC, 'No space left on device')
+
+        with patch('core.images._save', side_effect=error):
+            job, = self.process_jobs()
+
+        self.assertEqual(job.status, ImageJob.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('No space left on device', job.error)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 0)
+
+    @override_settings(IMAGE_PROCESSING={
+        **settings.IMAGE_PROCESSING, 'MAX_ATTEMPTS': 2})
+    def test_stale_jobs_requeued(self):
+        """Test the jobs of a dead worker are retried, then failed"""
+        job = images.stage_upload(self.recipe, jpeg_upload((10, 10)))
+        stale = timezone.now() - timedelta(
+            seconds=settings.IMAGE_PROCESSING['STALE_AFTER'] + 1)
+
+        for expected in (ImageJob.PENDING, ImageJob.FAILED):
+            images.claim_jobs(10)
+            ImageJob.objects.filter(pk=job.pk).update(updated_at=stale)
+            images.requeue_stale_jobs()
+            job.refresh_from_db()
+            self.assertEqual(job.status, expected)
+
+        self.assertFalse(os.path.exists(
+            os.path.join(settings.MEDIA_ROOT, job.staged_path)))
+
+    def test_deleted_recipe_drops_job(self):
+        """Test the staged file of a deleted recipe is removed"""
+        job = images.stage_upload(self.recipe, jpeg_upload((10, 10)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+
+        self.assertFalse(ImageJob.objects.exists())
+        self.assertFalse(os.path.exists(
+            os.path.join(settings.MEDIA_ROOT, job.staged_path)))
@@ -0,0 +1,94 @@
+"""
+Tests for the compression middleware
+"""
+import gzip
+import json
+from unittest import skipIf
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import SimpleTestCase, RequestFactory
+
+from core import compression
+from core.middleware import CompressionMiddleware
+
+PAYLOAD = json.dumps(
+    [{'id': i, 'title': f'Recipe {i}', 'price': '5.25'} for i in range(100)]
+).encode()
+
+
+def compressed_response(response, accept_encoding='gzip, deflate, br'):
+    """Return the response once through the middleware"""
+    request = RequestFactory().get(
+        '/api/recipe/recipes/', HTTP_ACCEPT_ENCODING=accept_encoding)
+    return CompressionMiddleware(lambda request: response)(request)
+
+
+def json_response(content=PAYLOAD, **kwargs):
+    """Return a JSON response of the content"""
+    return HttpResponse(content, content_type='application/json', **kwargs)
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Test compressing the API responses"""
+
+    def test_gzip(self):
+        """Test a response is gzipped for a client taking only gzip"""
+        res = compressed_response(json_response(), 'gzip')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(res['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(res['Content-Length']), len(res.content))
+        self.assertEqual(gzip.decompress(res.content), PAYLOAD)
+
+    @skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        """Test brotli is used when the client takes it"""
+        res = compressed_response(json_response())
+
+        self.assertEqual(res['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(res.content), PAYLOAD)
+
+    def test_not_compressed(self):
+        """Test small, refused and other responses are sent as they are"""
+        small = PAYLOAD[:settings.COMPRESSION['MIN_SIZE'] - 1]
+        html = HttpResponse(PAYLOAD, content_type='text/html')
+        cases = [
+            compressed_response(json_response(small)),
+            compressed_response(json_response(), 'identity'),
+            compressed_response(json_response(), 'gzip;q=0, br;q=0'),
+            compressed_response(html),
+        ]
+
+        for res in cases:
+            self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(cases[1]['Vary'], 'Accept-Encoding')
+
+    def test_weak_etag(self):
+        """Test the ETag of a compressed response is made weak"""
+        res = compressed_response(json_response(headers={'ETag': '"abc"'}))
+
+        self.assertEqual(res['ETag'], 'W/"abc"')
+
+    def test_streaming(self):
+        """Test a streaming response is compressed as it is read"""
+        lines = [b'{"id": %d, "title": "Recipe"}\n' % i for i in range(500)]
+        response = StreamingHttpResponse(
+            iter(lines), content_type='application/x-ndjson')
+
+        res = compressed_response(response, 'gzip')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertFalse(res.has_header('Content-Length'))
+        self.assertEqual(
+            gzip.decompress(b''.join(res.streaming_content)), b''.join(lines))
+
+    def test_accepted_encodings(self):
+        """Test parsing the Accept-Encoding header"""
+        self.assertEqual(
+            compression.accepted_encodings('gzip;q=0.5, BR, x;q=0, y;q=no'),
+            {'gzip', 'br'},
+        )
+        self.assertEqual(compression.choose_encoding('*'), 'br'
+                         if compression.brotli else 'gzip')
+        self.assertIsNone(compression.choose_encoding(''))
@@ -4,6 +4,7 @@ Test models
 
 from unittest.mock import patch
 from decimal import Decimal
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 from django.contrib.auth import get_user_model  # helper function
 from core import models
@@ -105,3 +106,147 @@ class ModelTests(TestCase):
         file_path = models.recipe_image_file_path(None, 'example.jpg')
 
         self.assertEqual(file_path, f'uploads/recipe/{uuid}.jpg')
+
+    def test_tag_name_unique_per_user(self):
+        """Test a user cannot have two tags with the same name"""
+        user = create_user()
+        other_user = create_user(email='other@example.com')
+        models.Tag.objects.create(user=user, name='Vegan')
+        models.Tag.objects.create(user=other_user, name='Vegan')
+
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name='Vegan')
+
+    def test_get_or_create_by_names(self):
+        """Test getting existing and creating new ingredients in bulk"""
+        user = create_user()
+        salt = models.Ingredient.objects.create(user=user, name='Salt')
+
+        ingredients = models.Ingredient.objects.get_or_create_by_names(
+            user, ['Salt', 'Pepper', 'Pepper'])
+
+        self.assertEqual(set(ingredients), {'Salt', 'Pepper'})
+        self.assertEqual(ingredients['Salt'], salt)
+        self.assertEqual(
+            models.Ingredient.objects.filter(user=user).count(), 2)
+
+    def test_get_or_create_by_names_inserts_sorted(self):
+        """Test the names are inserted in sorted order, whatever the
+        order of the payload (the same lock order for concurrent writes)
+        """
+        user = create_user()
+
+        tags = models.Tag.objects.get_or_create_by_names(
+            user, ['Vegan', 'Dessert', 'Breakfast'])
+
+        ids = [tags[name].id for name in ('Breakfast', 'Dessert', 'Vegan')]
+        self.assertEqual(ids, sorted(ids))
+
+    def test_get_or_create_by_names_existing_no_bump(self):
+        """Test the data version is kept when all the names exist"""
+        user = create_user()
+        models.Tag.objects.get_or_create_by_names(user, ['Vegan', 'Quick'])
+        versions = models.UserDataVersion.objects
+        version = versions.get_version(user.id)
+
+        tags = models.Tag.objects.get_or_create_by_names(user, ['Vegan'])
+        self.assertEqual(versions.get_version(user.id), version)
+        models.Tag.objects.get_or_create_by_names(user, ['Vegan', 'Soup'])
+        self.assertEqual(versions.get_version(user.id), version + 1)
+        self.assertEqual(set(tags), {'Vegan'})
+
+    def test_user_data_version_bumped_on_changes(self):
+        """Test the data version of a user changes with its recipe data"""
+        user = create_user()
+        other_user = create_user(email='other@example.com')
+        versions = models.UserDataVersion.objects
+        seen = [versions.get_version(user.id)]
+
+        tag = models.Tag.objects.create(user=user, name='Vegan')
+        seen.append(versions.get_version(user.id))
+        recipe = models.Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=Decimal('1.00'))
+        seen.append(versions.get_version(user.id))
+        recipe.tags.add(tag)
+        seen.append(versions.get_version(user.id))
+        tag.delete()
+        seen.append(versions.get_version(user.id))
+
+        self.assertEqual(len(set(seen)), len(seen))
+        self.assertEqual(versions.get_version(other_user.id), 0)
+
+    def test_user_data_version_bump_once(self):
+        """Test changes inside bump_once change the version only once"""
+        user = create_user()
+        versions = models.UserDataVersion.objects
+        version = versions.get_version(user.id)
+
+        with versions.bump_once(user.id):
+            tag = models.Tag.objects.create(user=user, name='Vegan')
+            tag.name = 'Vegetarian'
+            tag.save()
+            self.assertEqual(versions.get_version(user.id), version)
+
+        self.assertEqual(versions.get_version(user.id), version + 1)
+
+    def test_user_data_version_bump_once_error(self):
+        """Test a db error inside bump_once is raised as it is"""
+        user = create_user()
+        models.Tag.objects.create(user=user, name='Vegan')
+        versions = models.UserDataVersion.objects
+        version = versions.get_version(user.id)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            with versions.bump_once(user.id):
+                models.Tag.objects.create(user=user, name='Vegan')
+
+        self.assertEqual(versions.get_version(user.id), version)
+        versions.bump(user.id)  # not deferred any more
+        self.assertEqual(versions.get_version(user.id), version + 1)
+
+    def test_recipe_count_maintained(self):
+        """Test recipe_count follows links, clears and deletes"""
+        user = create_user()
+        tag = models.Tag.objects.create(user=user, name='Vegan')
+        ingredient = models.Ingredient.objects.create(user=user, name='Kale')
+        recipes = [
+            models.Recipe.objects.create(
+                user=user, title=f'Soup {i}', time_minutes=5, price=1)
+            for i in range(3)
+        ]
+
+        def counts():
+            tag.refresh_from_db()
+            ingredient.refresh_from_db()
+            return tag.recipe_count, ingredient.recipe_count
+
+        for recipe in recipes:
+            recipe.tags.add(tag)
+        recipes[0].ingredients.add(ingredient)
+        self.assertEqual(counts(), (3, 1))
+
+        recipes[0].tags.remove(tag)
+        recipes[1].tags.clear()
+        self.assertEqual(counts(), (1, 1))
+
+        tag.recipe_set.add(recipes[0])
+        recipes[0].delete()
+        self.assertEqual(counts(), (1, 0))
+
+    def test_recount_repairs_counts(self):
+        """Test recount corrects only the wrong counts"""
+        user = create_user()
+        tag = models.Tag.objects.create(user=user, name='Vegan')
+        models.Tag.objects.create(user=user, name='Quick')
+        recipe = models.Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=1)
+        recipe.tags.add(tag)
+        models.Tag.objects.update(recipe_count=7)
+
+        corrected = models.Tag.objects.all().recount()
+
+        self.assertEqual(corrected, 2)
+        self.assertEqual(
+            dict(models.Tag.objects.values_list('name', 'recipe_count')),
+            {'Vegan': 1, 'Quick': 0},
+        )
@@ -0,0 +1,119 @@
+"""
+Tests for the orjson renderer and parser
+"""
+import io
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnDict
+
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+
+
+def sample_payload():
+    """Return data like the responses of the API"""
+    recipe = ReturnDict({
+        'id': 1,
+        'title': 'Crème brûlée\u2028\u2029 "quoted" \\ </script>',
+        'time_minutes': 45,
+        'price': Decimal('5.25'),
+        'link': '',
+        'tags': [{'id': 1, 'name': 'Désert'}, {'id': 2, 'name': '寿司'}],
+        'ingredients': [],
+        'image_renditions': {'128': {'webp': 'http://testserver/a.webp'}},
+    }, serializer=None)
+    return {
+        'count': 1,
+        'next': None,
+        'results': [recipe],
+        'created_at': datetime(2021, 6, 1, 12, 30, 5, 123456, timezone.utc),
+        'updated_at': datetime(
+            2021, 6, 1, 12, 30, tzinfo=timezone(timedelta(hours=2))),
+        'naive': datetime(2021, 6, 1, 12, 30),
+        'day': date(2021, 6, 1),
+        'time': time(8, 15, 0, 500),
+        'took': timedelta(minutes=1, milliseconds=5),
+        'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'lazy': _('This field is required.'),
+        'emoji': '\U0001f373',
+        'ok': True,
+        3: 'int key',
+    }
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    """Test the orjson renderer"""
+
+    def test_same_bytes_as_drf(self):
+        """Test the output is the one of DRF's JSONRenderer"""
+        data = sample_payload()
+
+        res = FastJSONRenderer().render(data)
+
+        self.assertEqual(res, JSONRenderer().render(data))
+        self.assertIn(b'"price":5.25', res)
+        self.assertIn(b'"created_at":"2021-06-01T12:30:05.123456Z"', res)
+        self.assertIn(b'\\u2028', res)
+
+    def test_fallbacks(self):
+        """Test the output json.dumps writes for orjson is the same"""
+        data = {'big': 2 ** 70, 'price': Decimal('12.50')}
+        renderer = FastJSONRenderer()
+
+        self.assertEqual(renderer.render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            renderer.render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+        self.assertEqual(renderer.render(None), b'')
+
+    def test_without_orjson(self):
+        """Test DRF's renderer is used when orjson is not installed"""
+        data = sample_payload()
+
+        with patch('core.renderers.orjson', None):
+            res = FastJSONRenderer().render(data)
+
+        self.assertEqual(res, JSONRenderer().render(data))
+
+    def test_unsupported_type(self):
+        """Test data JSON cannot represent fails like with DRF"""
+        with self.assertRaises(TypeError):
+            FastJSONRenderer().render({'value': object()})
+
+
+class FastJSONParserTests(SimpleTestCase):
+    """Test the orjson parser"""
+
+    def parse(self, parser, body):
+        return parser.parse(
+            io.BytesIO(body), 'application/json', {'encoding': 'utf-8'})
+
+    def test_same_data_as_drf(self):
+        """Test the parsed data is the one of DRF's JSONParser"""
+        body = FastJSONRenderer().render(sample_payload())
+        lone_surrogate = b'{"title": "\\ud83c"}'
+
+        for payload in (body, lone_surrogate):
+            self.assertEqual(
+                self.parse(FastJSONParser(), payload),
+                self.parse(JSONParser(), payload),
+            )
+
+    def test_invalid_json(self):
+        """Test invalid JSON gives the parse error of DRF"""
+        for body in (b'{"title": ', b'{"price": NaN}'):
+            with self.assertRaises(ParseError) as fast:
+                self.parse(FastJSONParser(), body)
+            with self.assertRaises(ParseError) as drf:
+                self.parse(JSONParser(), body)
+
+            self.assertEqual(fast.exception.detail, drf.exception.detail)
@@ -0,0 +1,125 @@
+"""
+Tests for the sizing of uWSGI by scripts/uwsgi_launcher.py.
+"""
+import importlib.util
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# the script is not a module of the app - /scripts in the image
+spec = importlib.util.spec_from_file_location(
+    'uwsgi_launcher',
+    os.path.join(settings.BASE_DIR.parent, 'scripts', 'uwsgi_launcher.py'),
+)
+launcher = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(launcher)
+
+MB = 1024 * 1024
+PHYSICAL = 4096 * MB
+
+
+def sysconf(name):
+    """Return the page size and the number of pages of a 4 GB machine"""
+    return {'SC_PAGE_SIZE': 4096, 'SC_PHYS_PAGES': PHYSICAL // 4096}[name]
+
+
+@patch('os.sysconf', sysconf)
+@patch('os.sched_getaffinity', lambda pid: set(range(8)), create=True)
+class CgroupLimitTests(SimpleTestCase):
+    """Test the CPUs and memory read from the cgroup files"""
+
+    def setUp(self):
+        self.cgroup = tempfile.TemporaryDirectory()
+        patcher = patch.object(launcher, 'CGROUP', self.cgroup.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.cgroup.cleanup)
+
+    def write(self, name, content):
+        """Write a file of the fake cgroup"""
+        path = os.path.join(self.cgroup.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_no_cgroup(self):
+        """Test the machine limits are used without cgroup files"""
+        self.assertEqual(launcher.cpu_limit(), 8)
+        self.assertEqual(launcher.memory_limit(), PHYSICAL)
+
+    def test_cgroup_v2_limits(self):
+        """Test the quota is rounded up to whole CPUs"""
+        self.write('cpu.max', '150000 100000\n')
+        self.write('memory.max', f'{512 * MB}\n')
+
+        self.assertEqual(launcher.cpu_limit(), 2)
+        self.assertEqual(launcher.memory_limit(), 512 * MB)
+
+    def test_cgroup_v2_no_limits(self):
+        """Test a quota and a memory limit of max are no limits"""
+        self.write('cpu.max', 'max 100000\n')
+        self.write('memory.max', 'max\n')
+
+        self.assertEqual(launcher.cpu_limit(), 8)
+        self.assertEqual(launcher.memory_limit(), PHYSICAL)
+
+    def test_cgroup_v1_limits(self):
+        """Test the v1 files, a quota below one CPU counts as one"""
+        self.write('cpu/cpu.cfs_quota_us', '50000\n')
+        self.write('cpu/cpu.cfs_period_us', '100000\n')
+        self.write('memory/memory.limit_in_bytes', f'{1024 * MB}\n')
+
+        self.assertEqual(launcher.cpu_limit(), 1)
+        self.assertEqual(launcher.memory_limit(), 1024 * MB)
+
+    def test_cgroup_v1_no_limits(self):
+        """Test a quota of -1 and a huge memory limit are no limits"""
+        self.write('cpu/cpu.cfs_quota_us', '-1\n')
+        self.write('cpu/cpu.cfs_period_us', '100000\n')
+        self.write('memory/memory.limit_in_bytes', '9223372036854771712\n')
+
+        self.assertEqual(launcher.cpu_limit(), 8)
+        self.assertEqual(launcher.memory_limit(), PHYSICAL)
+
+
+@patch.dict(os.environ, clear=True)
+class UwsgiConfigTests(SimpleTestCase):
+    """Test the number of processes for the limits"""
+
+    def test_workers_per_cpu(self):
+        """Test 2 workers per CPU when the memory holds them"""
+        config = launcher.uwsgi_config(2, 4096 * MB)
+
+        self.assertEqual(config['workers'], 4)
+        self.assertEqual(config['cheaper'], 1)
+        self.assertEqual(config['offload_threads'], 2)
+
+    def test_workers_capped_by_memory(self):
+        """Test the memory limits the workers below the CPU count"""
+        # 1024 MB * 0.8 holds 3 workers of 256 MB, 8 CPUs would give 16
+        config = launcher.uwsgi_config(8, 1024 * MB)
+
+        self.assertEqual(config['workers'], 3)
+        self.assertEqual(config['cheaper'], 1)
+
+    def test_one_worker_not_cheaper(self):
+        """Test at least one worker, and no busyness algorithm for it"""
+        config = launcher.uwsgi_config(4, 128 * MB)
+
+        self.assertEqual(config['workers'], 1)
+        self.assertEqual(config['cheaper'], 0)
+        self.assertNotIn('--cheaper', launcher.uwsgi_args(config))
+
+    def test_env_overrides(self):
+        """Test the env variables win over the limits"""
+        with patch.dict(os.environ, {
+                'WEB_WORKERS': '6', 'UWSGI_CHEAPER': '2',
+                'UWSGI_RELOAD_RSS': '512'}):
+            config = launcher.uwsgi_config(1, 128 * MB)
+
+        self.assertEqual(config['workers'], 6)
+        self.assertEqual(config['cheaper'], 2)
+        self.assertEqual(config['reload_rss'], 512)
@@ -2,11 +2,27 @@
 Test custom Django managementcommands.
 """
 
+from decimal import Decimal
+from io import BytesIO, StringIO
 from unittest.mock import patch
+import gzip
+import json
+import os
+import tempfile
+from PIL import Image
 from psycopg2 import OperationalError as Psycopg2Error
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import compression, images
+from core.models import ImageJob, Recipe, Tag, Ingredient
 
 
 @patch('core.management.commands.wait_for_db.Command.check')
@@ -30,3 +46,368 @@ class CommandTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, len(errors_sequence))
         patched_check.assert_called_with(databases=['default'])
+
+
+class ImportRecipesCommandTests(TestCase):
+    """Test the import_recipes command"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, name, content):
+        """Write an input file and return its path"""
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_import_jsonl(self):
+        """Test importing recipes with shared tags in several batches"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        lines = [
+            {'title': f'Soup {i}', 'time_minutes': 10, 'price': '4.5',
+             'tags': ['Vegan', 'Quick'], 'ingredients': [{'name': 'Salt'}]}
+            for i in range(5)
+        ]
+        path = self._write(
+            'recipes.jsonl', '\n'.join(json.dumps(line) for line in lines))
+
+        out = StringIO()
+        call_command('import_recipes', path, user=self.user.email,
+                     batch_size=2, stdout=out)
+
+        recipes = Recipe.objects.filter(user=self.user)
+        self.assertEqual(recipes.count(), 5)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(
+            Ingredient.objects.filter(user=self.user).count(), 1)
+        for recipe in recipes:
+            self.assertEqual(recipe.price, Decimal('4.50'))
+            self.assertEqual(recipe.description, '')
+            self.assertIn(vegan, recipe.tags.all())
+            self.assertEqual(recipe.ingredients.count(), 1)
+        # COPY sends no signals, the command computes the search vectors
+        self.assertEqual(recipes.filter(search_vector='salt').count(), 5)
+        vegan.refresh_from_db()
+        self.assertEqual(vegan.recipe_count, 5)
+        self.assertIn('rows/sec', out.getvalue())
+        # the reserved ids come from the sequences so the ORM continues
+        # after the imported rows
+        Recipe.objects.create(
+            user=self.user, title='New', time_minutes=1, price=1)
+
+    def test_import_csv(self):
+        """Test importing recipes of the users named in the rows"""
+        other = get_user_model().objects.create_user(
+            email='other@example.com',
+            password='testpass123',
+        )
+        path = self._write('recipes.csv', (
+            'user,title,time_minutes,price,link,tags,ingredients\n'
+            'user@example.com,Curry,30,5.99,,Thai|Dinner,Rice\n'
+            'other@example.com,Pongal,40,4.50,http://x.com,,\n'
+        ))
+
+        call_command('import_recipes', path, stdout=StringIO())
+
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertEqual(recipe.title, 'Curry')
+        self.assertEqual(
+            sorted(tag.name for tag in recipe.tags.all()),
+            ['Dinner', 'Thai'],
+        )
+        other_recipe = Recipe.objects.get(user=other)
+        self.assertEqual(other_recipe.link, 'http://x.com')
+        self.assertFalse(other_recipe.tags.exists())
+
+    def test_import_invalid_row(self):
+        """Test an invalid row stops the import with its location"""
+        path = self._write('recipes.jsonl', '{"title": "No price"}\n')
+
+        with self.assertRaisesMessage(CommandError, 'recipes.jsonl:1'):
+            call_command('import_recipes', path, user=self.user.email,
+                         stdout=StringIO())
+
+    def test_import_invalid_records(self):
+        """Test broken lines and too long values are reported with their
+        location before anything is loaded
+        """
+        recipe = {'title': 'Soup', 'time_minutes': 5, 'price': '1'}
+        records = [
+            ('{"title": ', 'invalid JSON'),
+            ('["Soup"]', 'not a JSON object'),
+            (json.dumps(dict(recipe, tags=['x' * 256])), 'invalid name'),
+            (json.dumps(dict(recipe, link='x' * 256)), 'invalid link'),
+        ]
+        for text, message in records:
+            path = self._write('recipes.jsonl', json.dumps(recipe) + '\n'
+                               + text + '\n')
+            with self.subTest(message), \
+                    self.assertRaisesMessage(
+                        CommandError, f'recipes.jsonl:2: {message}'):
+                call_command('import_recipes', path, user=self.user.email,
+                             stdout=StringIO())
+
+        self.assertFalse(Recipe.objects.exists())
+
+
+class ExplainQueriesCommandTests(TestCase):
+    """Test the explain_queries command"""
+
+    def test_explain_queries(self):
+        """Test the plans are printed and the seeded data rolled back"""
+        out = StringIO()
+
+        call_command('explain_queries', users=2, recipes=20, tags=5,
+                     ingredients=5, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn('== GET /api/recipe/tags/', output)
+        self.assertIn('Execution Time', output)
+        self.assertIn('== summary', output)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(get_user_model().objects.exists())
+
+
+class BenchmarkRecipeListCommandTests(TestCase):
+    """Test the benchmark_recipe_list command"""
+
+    def test_benchmark_recipe_list(self):
+        """Test a row per size is printed and the data rolled back"""
+        out = StringIO()
+
+        call_command(
+            'benchmark_recipe_list', sizes='10,20', repeat=1, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[2].lstrip().startswith('20 '))
+        self.assertFalse(Recipe.objects.exists())
+
+
+class BenchmarkJsonRendererCommandTests(TestCase):
+    """Test the benchmark_json_renderer command"""
+
+    def test_benchmark_json_renderer(self):
+        """Test a row per payload is printed and the data rolled back"""
+        out = StringIO()
+
+        call_command(
+            'benchmark_json_renderer', sizes='10', repeat=1, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].lstrip().startswith('list 10 '))
+        self.assertTrue(lines[2].lstrip().startswith('detail 10 '))
+        self.assertFalse(Recipe.objects.exists())
+
+
+class CompressStaticCommandTests(SimpleTestCase):
+    """Test the compress_static command"""
+
+    def setUp(self):
+        self.static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.static_root.cleanup)
+        self.path = os.path.join(self.static_root.name, 'admin', 'base.css')
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('body { color: black; }\n' * 200)
+        with open(os.path.join(self.static_root.name, 'small.js'), 'w') as f:
+            f.write('x = 1;')
+        with open(os.path.join(self.static_root.name, 'logo.png'), 'wb') as f:
+            f.write(b'\x89PNG' * 1000)
+
+    def test_compress_static(self):
+        """Test the siblings of the text files are written once"""
+        with self.settings(STATIC_ROOT=self.static_root.name):
+            call_command('compress_static', stdout=StringIO())
+            out = StringIO()
+            call_command('compress_static', stdout=out)
+
+        with gzip.open(self.path + '.gz') as f, open(self.path, 'rb') as css:
+            self.assertEqual(f.read(), css.read())
+        root = self.static_root.name
+        names = {
+            os.path.relpath(os.path.join(directory, name), root)
+            for directory, _, files in os.walk(root)
+            for name in files
+        }
+        siblings = {'admin/base.css.gz'}
+        if compression.brotli:
+            siblings.add('admin/base.css.br')
+        self.assertEqual(
+            names, {'admin/base.css', 'small.js', 'logo.png'} | siblings)
+        self.assertIn(f'0 compressed files written, {len(siblings)}',
+                      out.getvalue())
+
+
+class SyncRecipesCommandTests(TestCase):
+    """Test the sync_recipes command"""
+
+    def test_sync_recipes(self):
+        """Test the denormalized columns are recomputed in batches"""
+        user = get_user_model().objects.create_user('user@example.com')
+        tag = Tag.objects.create(user=user, name='Vegan')
+        recipes = []
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                user=user, title=f'Soup {i}', time_minutes=5, price=1)
+            recipe.tags.add(tag)
+            recipes.append(recipe)
+        # like rows written before the columns existed
+        Recipe.objects.update(tag_ids=[], search_vector=None)
+
+        out = StringIO()
+        call_command('sync_recipes', batch_size=2, stdout=out)
+
+        for recipe in recipes:
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.tag_ids, [tag.id])
+            self.assertEqual(recipe.ingredient_ids, [])
+        self.assertEqual(
+            Recipe.objects.filter(search_vector='vegan').count(), 3)
+        self.assertIn('Synced 3 recipes', out.getvalue())
+
+    def test_sync_recipes_changes_etag(self):
+        """Test the synced recipes are not answered with a stale ETag"""
+        user = get_user_model().objects.create_user('user@example.com')
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=1)
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse('recipe:recipe-detail', args=[recipe.id])
+        etag = client.get(url)['ETag']
+        Recipe.objects.update(search_vector=None)
+
+        call_command('sync_recipes', stdout=StringIO())
+        res = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_sync_recipes_raw_linked_ids(self):
+        """Test id arrays written by raw SQL are rewritten in id order"""
+        user = get_user_model().objects.create_user('user@example.com')
+        tags = [Tag.objects.create(user=user, name=f'T{i}') for i in range(3)]
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=1)
+        recipe.tags.add(*tags)
+        ids = [tag.id for tag in tags]
+        # wrong and unsorted, like an array written by hand
+        Recipe.objects.update(tag_ids=list(reversed(ids))[1:])
+
+        call_command('sync_recipes', stdout=StringIO())
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.tag_ids, ids)
+
+
+class ReconcileRecipeCountsCommandTests(TestCase):
+    """Test the reconcile_recipe_counts command"""
+
+    def test_reconcile_recipe_counts(self):
+        """Test wrong counts are repaired and reported"""
+        user = get_user_model().objects.create_user('user@example.com')
+        tags = [Tag.objects.create(user=user, name=f'T{i}') for i in range(3)]
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=1)
+        recipe.tags.add(*tags)
+        Tag.objects.filter(pk__in=[tags[0].pk, tags[1].pk]) \
+            .update(recipe_count=0)
+
+        out = StringIO()
+        call_command('reconcile_recipe_counts', batch_size=2, stdout=out)
+
+        self.assertEqual(
+            list(Tag.objects.values_list('recipe_count', flat=True)),
+            [1, 1, 1],
+        )
+        self.assertIn('tags: 3 checked, 2 corrected', out.getvalue())
+
+    def test_reconcile_recipe_counts_cached_list(self):
+        """Test the cached tag list shows the repaired counts"""
+        user = get_user_model().objects.create_user('user@example.com')
+        tag = Tag.objects.create(user=user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=1)
+        recipe.tags.add(tag)
+        Tag.objects.update(recipe_count=0)
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse('recipe:tag-list')
+        # the wrong count is cached
+        self.assertEqual(client.get(url).data[0]['recipe_count'], 0)
+
+        call_command('reconcile_recipe_counts', stdout=StringIO())
+        self.assertEqual(client.get(url).data[0]['recipe_count'], 1)
+
+
+class ProcessImageJobsCommandTests(TransactionTestCase):
+    """Test the image worker - its threads have their own connections,
+    so the data is committed (TransactionTestCase)
+    """
+
+    def test_process_image_jobs_once(self):
+        """Test the queued images are processed and the command exits"""
+        user = get_user_model().objects.create_user(
+            email='user@example.com', password='testpass123')
+        recipe = Recipe.objects.create(
+            user=user, title='Sample', time_minutes=5, price=Decimal('5.00'))
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'PNG')
+        job = images.stage_upload(
+            recipe, SimpleUploadedFile('photo.png', buffer.getvalue()))
+        out = StringIO()
+
+        call_command('process_image_jobs', once=True, workers=2, stdout=out)
+
+        job.refresh_from_db()
+        recipe.refresh_from_db()
+        self.addCleanup(
+            images.delete_image_files,
+            recipe.image.name, recipe.image_renditions,
+        )
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertTrue(os.path.exists(recipe.image.path))
+        self.assertIn('Processed 1 image jobs', out.getvalue())
+
+
+class GenerateImageRenditionsCommandTests(TransactionTestCase):
+    """Test the backfill of renditions - the db connection is closed
+    before the processes start, so the data is committed
+    """
+
+    def test_generate_image_renditions(self):
+        """Test renditions are made for the images without them"""
+        user = get_user_model().objects.create_user(
+            email='user@example.com', password='testpass123')
+        recipe = Recipe.objects.create(
+            user=user, title='Sample', time_minutes=5, price=Decimal('5.00'))
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600)).save(buffer, 'JPEG')
+        recipe.image.save('photo.jpg', ContentFile(buffer.getvalue()))
+        Recipe.objects.create(
+            user=user, title='No image', time_minutes=5,
+            price=Decimal('5.00'),
+        )
+        out = StringIO()
+
+        call_command('generate_image_renditions', processes=2, stdout=out)
+
+        recipe.refresh_from_db()
+        self.addCleanup(
+            images.delete_image_files,
+            recipe.image.name, recipe.image_renditions,
+        )
+        self.assertEqual(set(recipe.image_renditions), {'128', '512', '1024'})
+        with recipe.image.storage.open(
+                recipe.image_renditions['512']['webp']) as f:
+            self.assertEqual(Image.open(f).size, (512, 384))
+        self.assertIn('Generated the renditions of 1 images', out.getvalue())
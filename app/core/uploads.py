@@ -0,0 +1,152 @@
+"""
+Upload handler of recipe images.
+
+The image of an upload_image request is written to the staging directory
+of the media volume as it is received - not kept in memory and not
+copied from a temporary file later - hashed on the way and rejected as
+soon as it is too big or does not start like an image.
+"""
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    StopFutureHandlers,
+)
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from core.images import STAGING_DIR
+
+# bytes needed by looks_like_image
+SIGNATURE_LENGTH = 12
+
+
+def looks_like_image(head):
+    """Return True when the first bytes are those of a JPEG, PNG, GIF or
+    WebP file - the formats the image worker is expected to decode
+    """
+    return head.startswith((
+        b'\xff\xd8\xff',
+        b'\x89PNG\r\n\x1a\n',
+        b'GIF87a',
+        b'GIF89a',
+    )) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+
+class UploadTooLarge(APIException):
+    """The uploaded file is bigger than IMAGE_PROCESSING['MAX_UPLOAD_SIZE']"""
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = _('The uploaded file is too large.')
+    default_code = 'too_large'
+
+
+class StagedUploadedFile(UploadedFile):
+    """A file written to the staging directory by StagingUploadHandler"""
+
+    def __init__(self, staged_path, sha256, name, content_type, size,
+                 charset, content_type_extra=None):
+        # relative to MEDIA_ROOT, the ImageJob takes the file as it is
+        self.staged_path = staged_path
+        self.sha256 = sha256
+        file = open(default_storage.path(staged_path), 'rb')
+        super().__init__(
+            file, name, content_type, size, charset, content_type_extra)
+
+    def temporary_file_path(self):
+        """Return the full path of the file"""
+        return self.file.name
+
+
+class StagingUploadHandler(FileUploadHandler):
+    """Stream the image field of the request to the staging directory
+    the other file fields go to the next handlers (the Django defaults)
+    """
+
+    def __init__(self, request=None, image_field='image'):
+        super().__init__(request)
+        self.image_field = image_field
+        self.max_size = settings.IMAGE_PROCESSING['MAX_UPLOAD_SIZE']
+        self.file = None
+        self.receiving = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        """Reject a request which is too big before reading any of it"""
+        # the other fields and the multipart boundaries come on top
+        if content_length and content_length > self.max_size + 64 * 1024:
+            raise UploadTooLarge()
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        """Open the staged file when the image field starts"""
+        super().new_file(field_name, file_name, *args, **kwargs)
+        # one image per request, a repeated field is left to the others
+        self.receiving = field_name == self.image_field and self.file is None
+        if not self.receiving:
+            return
+        ext = os.path.splitext(file_name)[1].lower()
+        self.staged_path = os.path.join(STAGING_DIR, f'{uuid.uuid4()}{ext}')
+        path = default_storage.path(self.staged_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'wb')
+        self.sha256 = hashlib.sha256()
+        self.head = b''  # the first bytes, until the format is checked
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        """Write and hash a chunk of the image, check the size and format"""
+        if not self.receiving:
+            return raw_data
+        if start + len(raw_data) > self.max_size:
+            self._discard()
+            raise UploadTooLarge()
+        if self.head is not None:
+            self.head += raw_data[:SIGNATURE_LENGTH]
+            if len(self.head) >= SIGNATURE_LENGTH:
+                self._check_format()
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        """Return the staged file of the image field"""
+        if not self.receiving:
+            return None
+        self.receiving = False
+        if self.head is not None:  # a file shorter than the signatures
+            self._check_format()
+        self.file.close()
+        return StagedUploadedFile(
+            self.staged_path,
+            self.sha256.hexdigest(),
+            self.file_name,
+            self.content_type,
+            file_size,
+            self.charset,
+            self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        """Remove the partial file of a cancelled upload"""
+        if self.receiving:
+            self._discard()
+
+    def _check_format(self):
+        """Reject the upload unless it starts like an image"""
+        head, self.head = self.head, None
+        if not looks_like_image(head):
+            self._discard()
+            raise ValidationError({'image': [_(
+                'Upload a valid image. The file you uploaded was either '
+                'not an image or a corrupted image.')]})
+
+    def _discard(self):
+        """Close and remove the partial staged file"""
+        self.receiving = False
+        self.file.close()
+        default_storage.delete(self.staged_path)
@@ -2,11 +2,13 @@
 Core views for app.
 """
 
-from rest_framework.decorators import api_view
-from rest_framework.response import Response
+from django.http import HttpResponseNotAllowed, JsonResponse
 
-# that's a method for a short simple implementation
-@api_view(['GET'])
-def health_check(request):
+
+# a plain async Django view - under ASGI (app/asgi.py) it runs in the
+# event loop of the worker, no view thread and no database connection
+async def health_check(request):
     """Return just a simple response: I'm OK"""
-    return Response({'healthy': True})
\ No newline at end of file
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    return JsonResponse({'healthy': True})
@@ -0,0 +1,32 @@
+"""
+Pagination for recipe APIs
+"""
+
+from rest_framework.pagination import CursorPagination
+
+
+# cursor (keyset) pagination filters on the last seen id (WHERE id < x)
+# instead of skipping rows with OFFSET, so every page costs the same
+# the cursor sent to the client is an opaque base64 encoded token
+class RecipeCursorPagination(CursorPagination):
+    """Keyset pagination of recipes ordered by id descending"""
+    ordering = '-id'  # must match the ordering of the RecipeViewSet
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        """Return the ordering - search results go by rank first"""
+        # see RecipeViewSet.get_queryset, the id breaks the ties
+        if 'rank' in queryset.query.annotations:
+            return ('-rank', '-id')
+        return super().get_ordering(request, queryset, view)
+
+    def get_page_size(self, request):
+        """Paginate only when the client asks for it with page_size/cursor"""
+        # unpaginated responses stay a plain list for existing clients
+        params = request.query_params
+        if self.page_size_query_param not in params and \
+                self.cursor_query_param not in params:
+            return None
+        return super().get_page_size(request)
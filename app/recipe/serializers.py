@@ -1,12 +1,46 @@
 """
 serializers for recipe APIs
 """
+from operator import itemgetter
 
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
-from core.models import Recipe, Tag, Ingredient
+from core.models import (
+    ImageJob,
+    Recipe,
+    Tag,
+    Ingredient,
+    UserDataVersion,
+)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+def rendition_urls(renditions, request):
+    """Return the URLs of image renditions as {size: {format: url}}"""
+    urls = {}
+    for size, formats in renditions.items():
+        urls[size] = {}
+        for image_format, path in formats.items():
+            url = default_storage.url(path)
+            # absolute like the URL of the image field
+            urls[size][image_format] = \
+                request.build_absolute_uri(url) if request else url
+    return urls
+
+
+# ?fields=id,title of the read endpoints - see SparseFieldsetMixin in
+# recipe/views.py which also narrows the queryset to the same fields
+class SparseFieldsMixin:
+    """Serializer rendering only the fields named in `fields`"""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class IngredientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for ingredients"""
 
     class Meta:
@@ -15,7 +49,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for tags"""
 
     class Meta:
@@ -24,17 +58,106 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+# the nested tags/ingredients of recipes stay id + name, the counts are
+# only rendered by the tag/ingredient endpoints
+class IngredientDetailSerializer(IngredientSerializer):
+    """Serializer for ingredient detail view"""
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ['recipe_count']
+        read_only_fields = ['id', 'recipe_count']
+
+
+class TagDetailSerializer(TagSerializer):
+    """Serializer for tag detail view"""
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ['recipe_count']
+        read_only_fields = ['id', 'recipe_count']
+
+
+# used instead of the default ListSerializer when a recipe serializer
+# is created with many=True (see list_serializer_class below)
+class RecipeListSerializer(serializers.ListSerializer):
+    """Serializer for creating many recipes at once"""
+
+    # all recipes, tags, ingredients and links are inserted in bulk
+    # so the number of queries does not depend on the number of recipes
+    @transaction.atomic
+    def create(self, validated_data):
+        """Create recipes with their nested tags and ingredients"""
+        auth_user = self.context['request'].user
+        # bulk_create sends no signals, the version is bumped explicitly
+        with UserDataVersion.objects.bump_once(auth_user.id):
+            return self._create(auth_user, validated_data)
+
+    def _create(self, auth_user, validated_data):
+        """Insert the recipes, tags, ingredients and links in bulk"""
+        items = []
+        for attrs in validated_data:
+            tags = attrs.pop('tags', [])
+            ingredients = attrs.pop('ingredients', [])
+            items.append((Recipe(**attrs), tags, ingredients))
+
+        # names from all the recipes are resolved in one round of lookups
+        tag_objs = Tag.objects.get_or_create_by_names(
+            auth_user,
+            [tag['name'] for _, tags, _ in items for tag in tags],
+        )
+        ingredient_objs = Ingredient.objects.get_or_create_by_names(
+            auth_user,
+            [ingredient['name']
+             for _, _, ingredients in items for ingredient in ingredients],
+        )
+        # PostgreSQL returns the ids of rows inserted by bulk_create
+        recipes = Recipe.objects.bulk_create(
+            [recipe for recipe, _, _ in items])
+
+        tag_links = {}  # dict keeps the order and drops repeated names
+        ingredient_links = {}
+        for recipe, tags, ingredients in items:
+            for tag in tags:
+                tag_links[(recipe.id, tag_objs[tag['name']].id)] = None
+            for ingredient in ingredients:
+                ingredient_id = ingredient_objs[ingredient['name']].id
+                ingredient_links[(recipe.id, ingredient_id)] = None
+        TagLink = Recipe.tags.through
+        TagLink.objects.bulk_create([
+            TagLink(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id, tag_id in tag_links
+        ])
+        IngredientLink = Recipe.ingredients.through
+        IngredientLink.objects.bulk_create([
+            IngredientLink(recipe_id=recipe_id, ingredient_id=ingredient_id)
+            for recipe_id, ingredient_id in ingredient_links
+        ])
+        Recipe.objects.filter(pk__in=[recipe.id for recipe in recipes]) \
+            .sync_denormalized()
+        Tag.objects.filter(pk__in={pk for _, pk in tag_links}).recount()
+        Ingredient.objects.filter(
+            pk__in={pk for _, pk in ingredient_links}).recount()
+        return recipes
+
+
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for recipes"""
 
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
+    # the lists show the small copies, not the uploaded image
+    image_renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ['id', 'title', 'time_minutes', 'price', 'link', 'tags',
-                  'ingredients']
+                  'ingredients', 'image_renditions']
         read_only_fields = ['id']
+        list_serializer_class = RecipeListSerializer
+
+    def get_image_renditions(self, recipe) -> dict:
+        """Return the URLs of the renditions as {size: {format: url}}"""
+        return rendition_urls(
+            recipe.image_renditions, self.context.get('request'))
 
 
     # helper function that gets or creates tags
@@ -43,71 +166,163 @@ class RecipeSerializer(serializers.ModelSerializer):
         # context is passed to the serializer by the view
         # which calls the serializer
         auth_user = self.context['request'].user
-        for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(
-                user =auth_user,
-                **tag   # we could use name = tag['name']
-                        # but this way we could add all fields of a tag
-                        # if any is added in the future
-                        # ... I don't know if it's worth since the model
-                        #  must be modified ...?
-            )
-            recipe.tags.add(tag_obj)
-
+        # all tags are created/fetched in one batch and linked to the
+        # recipe with a single bulk insert into the through table
+        tag_objs = Tag.objects.get_or_create_by_names(
+            auth_user,
+            [tag['name'] for tag in tags],
+        )
+        recipe.tags.add(*tag_objs.values())
 
     def _get_or_create_ingredients(self, ingredients, recipe):
         """Getting or creating ingredients as needed"""
         auth_user = self.context['request'].user
-        for ingredient in ingredients:
-            ingredient_obj, create = Ingredient.objects.get_or_create(
-                user=auth_user,
-                **ingredient
-            )
-            recipe.ingredients.add(ingredient_obj)
-
+        ingredient_objs = Ingredient.objects.get_or_create_by_names(
+            auth_user,
+            [ingredient['name'] for ingredient in ingredients],
+        )
+        recipe.ingredients.add(*ingredient_objs.values())
 
     # we need to overwrite a standard create because the standard one
     # does not support nested srializers - they work as read only by default
+    # atomic: a recipe is never left with only a part of its tags
+    @transaction.atomic
     def create(self, validated_data):
         """Create a recipe with nested tags list"""
         tags = validated_data.pop('tags', [])
         ingredients = validated_data.pop('ingredients', [])
-        recipe = Recipe.objects.create(**validated_data)
-        self._get_or_create_tags(tags, recipe)
-        self._get_or_create_ingredients(ingredients, recipe)
+        with UserDataVersion.objects.bump_once(validated_data['user'].id), \
+                Recipe.objects.sync_once():
+            recipe = Recipe.objects.create(**validated_data)
+            self._get_or_create_tags(tags, recipe)
+            self._get_or_create_ingredients(ingredients, recipe)
         return recipe
 
     # we need to overwrite the update like we did for the create method
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Update recipe."""
         tags = validated_data.pop('tags', None)
         ingredients = validated_data.pop('ingredients', None)
-        if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(tags, instance)
-        if ingredients is not None:
-            instance.ingredients.clear()
-            self._get_or_create_ingredients(ingredients, instance)
+        with UserDataVersion.objects.bump_once(instance.user_id), \
+                Recipe.objects.sync_once():
+            if tags is not None:
+                instance.tags.clear()
+                self._get_or_create_tags(tags, instance)
+            if ingredients is not None:
+                instance.ingredients.clear()
+                self._get_or_create_ingredients(ingredients, instance)
 
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
 
-        instance.save()
+            # only the changed columns - the image columns are written by
+            # the image worker and a stale copy would undo its switch
+            instance.save(update_fields=list(validated_data))
         return instance
 
 
+# DRF builds every field of the recipe and of every nested tag/ingredient
+# serializer per row, which is most of the time of a long list - this one
+# builds the same JSON from values() rows and id -> name maps in dicts
+class RecipeFastListSerializer:
+    """Read-only serializer of recipe lists, same output as
+    RecipeSerializer(many=True), fields included
+    """
+    # the columns read with values(), see RecipeViewSet.list
+    values_fields = [
+        'id', 'title', 'time_minutes', 'price', 'link', 'tag_ids',
+        'ingredient_ids', 'image_renditions',
+    ]
+    # the column of every field of RecipeSerializer
+    field_columns = dict(zip(RecipeSerializer.Meta.fields, values_fields))
+
+    def __init__(self, rows, context=None, fields=None):
+        self.rows = rows
+        self.context = context or {}
+        # in the order of RecipeSerializer
+        self.field_names = [
+            name for name in RecipeSerializer.Meta.fields
+            if fields is None or name in fields
+        ]
+
+    @classmethod
+    def values_fields_for(cls, fields):
+        """Return the columns to read for the fields, None for all"""
+        if fields is None:
+            return cls.values_fields
+        # the id is the position of the cursor pagination, always read
+        return ['id'] + [
+            cls.field_columns[name] for name in RecipeSerializer.Meta.fields
+            if name in fields and name != 'id'
+        ]
+
+    @property
+    def data(self):
+        """Return the serialized rows"""
+        rows = list(self.rows)
+        names = self.field_names
+        tags = self._names(Tag, rows, 'tag_ids') \
+            if 'tags' in names else {}
+        ingredients = self._names(Ingredient, rows, 'ingredient_ids') \
+            if 'ingredients' in names else {}
+        request = self.context.get('request')
+        # the field of the full serializer - same rounding and settings
+        price = RecipeSerializer().fields['price'].to_representation
+        getters = {
+            'id': itemgetter('id'),
+            'title': itemgetter('title'),
+            'time_minutes': itemgetter('time_minutes'),
+            'price': lambda row: price(row['price']),
+            'link': itemgetter('link'),
+            # the id arrays are ordered like the prefetched relations
+            'tags': lambda row: [
+                {'id': pk, 'name': tags[pk]}
+                for pk in row['tag_ids'] if pk in tags
+            ],
+            'ingredients': lambda row: [
+                {'id': pk, 'name': ingredients[pk]}
+                for pk in row['ingredient_ids'] if pk in ingredients
+            ],
+            'image_renditions': lambda row: rendition_urls(
+                row['image_renditions'], request),
+        }
+        getters = [(name, getters[name]) for name in names]
+        return [{name: get(row) for name, get in getters} for row in rows]
+
+    def _names(self, model, rows, column):
+        """Return {id: name} of the items linked to the rows"""
+        ids = {pk for row in rows for pk in row[column]}
+        if not ids:
+            return {}
+        return dict(
+            model.objects.filter(id__in=ids).values_list('id', 'name'))
+
+
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer for recipe detail view"""
 
     class Meta(RecipeSerializer.Meta):
         fields = RecipeSerializer.Meta.fields + ['description', 'image']
+        # set by the upload_image action only
+        read_only_fields = RecipeSerializer.Meta.read_only_fields + ['image']
 
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class RecipeImageSerializer(serializers.Serializer):
     """Serializer for uploading images to recipes"""
+    # only a file here - the worker decodes it (core/images.py)
+    image = serializers.FileField()
+
+
+class ImageJobSerializer(serializers.ModelSerializer):
+    """Serializer for the processing status of an uploaded image"""
+    url = serializers.HyperlinkedIdentityField(
+        view_name='recipe:imagejob-detail')
 
     class Meta:
-        model = Recipe
-        fields = ['id', 'image']
-        read_only_fields = ['id']
-        extra_kwargs = {'image': {'required': 'True'}}
\ No newline at end of file
+        model = ImageJob
+        fields = [
+            'id', 'url', 'recipe', 'status', 'error', 'created_at',
+            'updated_at',
+        ]
+        read_only_fields = fields
@@ -11,7 +11,7 @@ from rest_framework.test import APIClient
 
 from core.models import Ingredient, Recipe
 
-from recipe.serializers import IngredientSerializer
+from recipe.serializers import IngredientDetailSerializer
 
 INGREDIENTS_URL = reverse('recipe:ingredient-list')
 
@@ -56,7 +56,7 @@ class PrivateIngredientsApiTests(TestCase):
         res = self.client.get(INGREDIENTS_URL)
 
         ingredients = Ingredient.objects.all().order_by('-name')
-        serializer = IngredientSerializer(ingredients, many=True)
+        serializer = IngredientDetailSerializer(ingredients, many=True)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
@@ -110,8 +110,9 @@ class PrivateIngredientsApiTests(TestCase):
 
         res = self.client.get(INGREDIENTS_URL, {'assigned_only':1})
 
-        in1s = IngredientSerializer(in1)
-        in2s = IngredientSerializer(in2)
+        in1.refresh_from_db()  # recipe_count changed in the db
+        in1s = IngredientDetailSerializer(in1)
+        in2s = IngredientDetailSerializer(in2)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertIn(in1s.data, res.data)
@@ -135,7 +136,8 @@ class PrivateIngredientsApiTests(TestCase):
         )
         recipe1.ingredients.add(in1)
         recipe2.ingredients.add(in1)
-        in1s = IngredientSerializer(in1)
+        in1.refresh_from_db()
+        in1s = IngredientDetailSerializer(in1)
 
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
 
@@ -143,6 +145,12 @@ class PrivateIngredientsApiTests(TestCase):
         self.assertEqual(len(res.data), 1)
         self.assertIn(in1s.data, res.data)
 
+    def test_list_ingredients_sparse_fields(self):
+        """Test ?fields= renders only the listed fields"""
+        Ingredient.objects.create(user=self.user, name='Salt')
 
+        res = self.client.get(
+            INGREDIENTS_URL, {'fields': 'id,recipe_count'})
 
-
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(res.data[0]), ['id', 'recipe_count'])
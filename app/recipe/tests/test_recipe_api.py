@@ -3,19 +3,35 @@ tests for recipe APIs.
 """
 
 from decimal import Decimal
+import hashlib
+from unittest.mock import patch
+import json
 import tempfile
 import os
 from PIL import Image  # importing fromPillow library
+from django.conf import settings
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from rest_framework import status
-from rest_framework.test import APIClient
-from core.models import Recipe, Tag, Ingredient
-from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from core import images
+from core.models import ImageBlob, ImageJob, Recipe, Tag, Ingredient
+from recipe.serializers import (
+    RecipeDetailSerializer,
+    RecipeFastListSerializer,
+    RecipeSerializer,
+)
+from recipe.views import RecipeViewSet
 
 
 RECIPES_URL = reverse('recipe:recipe-list')
+BULK_CREATE_URL = reverse('recipe:recipe-bulk-create')
+EXPORT_URL = reverse('recipe:recipe-export')
 
 
 def detail_url(recipe_id):
@@ -406,6 +422,354 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(s2.data, res.data)
         self.assertNotIn(s3.data, res.data)
 
+    def test_filter_by_tags_match_all(self):
+        """Test match=all returns only recipes with every listed tag"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        other = Tag.objects.create(user=self.user, name='Other')
+        r1 = create_recipe(user=self.user, title='Salad')
+        r1.tags.add(vegan, quick, other)
+        r2 = create_recipe(user=self.user, title='Stew')
+        r2.tags.add(vegan, other)
+
+        params = {'tags': f'{vegan.id},{quick.id}', 'match': 'all'}
+        res = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [r1.id])
+
+    def test_filter_without_distinct(self):
+        """Test a recipe with several matching tags is listed once"""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Quick')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag1, tag2)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(
+                RECIPES_URL, {'tags': f'{tag1.id},{tag2.id}'})
+
+        self.assertEqual([r['id'] for r in res.data], [recipe.id])
+        self.assertFalse(any(
+            'DISTINCT' in query['sql'] for query in queries.captured_queries
+        ))
+
+    def test_filter_invalid_match(self):
+        """Test an unknown match mode is rejected"""
+        res = self.client.get(RECIPES_URL, {'tags': '1', 'match': 'some'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+
+class RecipePaginationTests(TestCase):
+    """Test the cursor pagination of the recipe list"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+
+    def test_list_unpaginated_by_default(self):
+        """Test the list is a plain list without pagination params"""
+        create_recipe(user=self.user)
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(res.data, list)
+
+    def test_paginate_with_cursor(self):
+        """Test walking all pages with the next cursor"""
+        recipes = [create_recipe(user=self.user) for _ in range(5)]
+
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+        ids = [recipe['id'] for recipe in res.data['results']]
+        while res.data['next']:
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(res.data['next'])
+            ids += [recipe['id'] for recipe in res.data['results']]
+            # keyset pagination never skips rows with OFFSET
+            for query in queries:
+                self.assertNotIn('OFFSET', query['sql'])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(ids, [recipe.id for recipe in reversed(recipes)])
+
+    def test_paginate_filtered_by_tags(self):
+        """Test pagination combined with filtering by tags"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        tagged = []
+        for i in range(4):
+            recipe = create_recipe(user=self.user)
+            if i % 2:
+                recipe.tags.add(tag)
+                tagged.append(recipe.id)
+
+        res = self.client.get(RECIPES_URL, {'page_size': 1, 'tags': tag.id})
+        first = res.data['results']
+        res = self.client.get(res.data['next'])
+        second = res.data['results']
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.data['next'])
+        self.assertEqual(
+            [first[0]['id'], second[0]['id']],
+            list(reversed(tagged)),
+        )
+
+
+class RecipeBulkCreateTests(TestCase):
+    """Test creating many recipes in one request"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+
+    def _payload(self, size):
+        """Return a list of recipes sharing some tags and ingredients"""
+        return [
+            {
+                'title': f'Synced recipe {i}',
+                'time_minutes': 10 + i,
+                'price': '4.50',
+                'description': 'Made offline',
+                'tags': [{'name': 'Offline'}, {'name': f'Tag {i}'}],
+                'ingredients': [{'name': 'Salt'}],
+            }
+            for i in range(size)
+        ]
+
+    def test_bulk_create_recipes(self):
+        """Test creating recipes with nested objects in bulk"""
+        offline = Tag.objects.create(user=self.user, name='Offline')
+        payload = self._payload(3)
+
+        res = self.client.post(BULK_CREATE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [recipe['title'] for recipe in res.data],
+            [item['title'] for item in payload],
+        )
+        recipes = Recipe.objects.filter(user=self.user)
+        self.assertEqual(recipes.count(), 3)
+        self.assertEqual(recipes.filter(search_vector='offline').count(), 3)
+        offline.refresh_from_db()
+        self.assertEqual(offline.recipe_count, 3)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 4)
+        self.assertEqual(
+            Ingredient.objects.filter(user=self.user).count(), 1)
+        for recipe in recipes:
+            self.assertIn(offline, recipe.tags.all())
+            self.assertEqual(recipe.ingredients.count(), 1)
+            self.assertEqual(recipe.description, 'Made offline')
+
+    def test_bulk_create_invalid_item(self):
+        """Test one invalid recipe reports errors and creates nothing"""
+        payload = self._payload(3)
+        del payload[1]['title']
+
+        res = self.client.post(BULK_CREATE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(res.data), 3)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('title', res.data[1])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+    def test_bulk_create_too_many(self):
+        """Test the number of recipes in one request is limited"""
+        size = RecipeViewSet.bulk_create_max_size + 1
+
+        res = self.client.post(
+            BULK_CREATE_URL, self._payload(size), format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+    def test_bulk_create_query_budget(self):
+        """Test the number of queries does not grow with the batch size"""
+        budget = RecipeViewSet.query_budget['bulk_create']
+
+        for size in (2, 50):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(
+                    BULK_CREATE_URL, self._payload(size), format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            self.assertLessEqual(len(queries), budget)
+
+
+class RecipeExportTests(TestCase):
+    """Test the streaming export of recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+
+    @patch.object(RecipeViewSet, 'export_chunk_size', 2)
+    def test_export_recipes(self):
+        """Test exporting recipes as JSON lines in several chunks"""
+        other_user = create_user(email='other@example.com', password='x123')
+        create_recipe(user=other_user)
+        recipes = []
+        for i in range(5):
+            recipe = create_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(Tag.objects.create(user=self.user, name=f'T{i}'))
+            recipes.append(recipe)
+
+        res = self.client.get(EXPORT_URL)
+        lines = b''.join(res.streaming_content).decode().splitlines()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(lines), len(recipes))
+        for line, recipe in zip(lines, recipes):
+            serializer = RecipeDetailSerializer(recipe)
+            self.assertEqual(json.loads(line), serializer.data)
+
+
+class RecipeConditionalRequestTests(TestCase):
+    """Test ETag / If-None-Match on the recipe endpoints"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+
+    def test_list_not_modified(self):
+        """Test a current ETag gets 304 with only the version query"""
+        res = self.client.get(RECIPES_URL)
+        etag = res['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res.content, b'')
+        self.assertEqual(len(queries), 1)
+
+    def test_any_etag_missing_recipe(self):
+        """Test If-None-Match: * does not hide a missing recipe"""
+        other_recipe = create_recipe(
+            user=create_user(email='other@example.com', password='x123'))
+
+        for recipe_id in (self.recipe.id + 1000, other_recipe.id):
+            res = self.client.get(
+                detail_url(recipe_id), HTTP_IF_NONE_MATCH='*')
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_etag_changes_with_data(self):
+        """Test a change of the user data makes the old ETag stale"""
+        res = self.client.get(detail_url(self.recipe.id))
+        etag = res['ETag']
+
+        self.recipe.title = 'Changed'
+        self.recipe.save()
+        res = self.client.get(
+            detail_url(self.recipe.id), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['title'], 'Changed')
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_etag_depends_on_url(self):
+        """Test other recipes and filters do not share an ETag"""
+        other = create_recipe(user=self.user)
+        etag = self.client.get(detail_url(self.recipe.id))['ETag']
+
+        res = self.client.get(detail_url(other.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.get(
+            RECIPES_URL, {'tags': '1'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_compressed_not_modified(self):
+        """Test the weak ETag of a compressed response gets 304"""
+        compression = dict(settings.COMPRESSION, MIN_SIZE=0)
+        with self.settings(COMPRESSION=compression):
+            res = self.client.get(RECIPES_URL, HTTP_ACCEPT_ENCODING='gzip')
+            etag = res['ETag']
+            res = self.client.get(
+                RECIPES_URL, HTTP_ACCEPT_ENCODING='gzip',
+                HTTP_IF_NONE_MATCH=etag)
+
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class RecipeSearchTests(TestCase):
+    """Test the full text search of recipes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+
+    def _search(self, **params):
+        res = self.client.get(RECIPES_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [r['id'] for r in res.data]
+
+    def test_search_ranked(self):
+        """Test matches in titles rank above tags and descriptions"""
+        in_description = create_recipe(
+            user=self.user, title='Soup', description='With curry paste')
+        in_title = create_recipe(user=self.user, title='Thai curry')
+        in_tag = self.client.post(RECIPES_URL, {
+            'title': 'Rice', 'time_minutes': 5, 'price': Decimal('1.00'),
+            'tags': [{'name': 'Curry'}],
+        }, format='json').data['id']
+        create_recipe(user=self.user, title='Fish and chips')
+        other = create_user(email='other@example.com', password='pass123')
+        create_recipe(user=other, title='Curry')
+
+        self.assertEqual(
+            self._search(search='curries'),
+            [in_title.id, in_tag, in_description.id],
+        )
+
+    def test_search_with_filter_and_pagination(self):
+        """Test search combines with the tag filter and the cursor pages"""
+        tag = Tag.objects.create(user=self.user, name='Quick')
+        recipes = []
+        for i in range(3):
+            recipe = create_recipe(user=self.user, title=f'Curry {i}')
+            recipe.tags.add(tag)
+            recipes.append(recipe)
+        create_recipe(user=self.user, title='Curry without tag')
+
+        ids = []
+        params = {'search': 'curry', 'tags': tag.id, 'page_size': 2}
+        res = self.client.get(RECIPES_URL, params)
+        ids += [r['id'] for r in res.data['results']]
+        res = self.client.get(res.data['next'])
+        ids += [r['id'] for r in res.data['results']]
+
+        self.assertIsNone(res.data['next'])
+        self.assertEqual(ids, [r.id for r in reversed(recipes)])
+
+    def test_search_follows_changes(self):
+        """Test the search sees recipe updates and tag renames"""
+        recipe = create_recipe(user=self.user, title='Stew')
+        tag = Tag.objects.create(user=self.user, name='Winter')
+        recipe.tags.add(tag)
+        self.assertEqual(self._search(search='winter'), [recipe.id])
+
+        self.client.patch(detail_url(recipe.id), {'title': 'Goulash'})
+        tag.name = 'Hearty'
+        tag.save()
+
+        self.assertEqual(self._search(search='goulash'), [recipe.id])
+        self.assertEqual(self._search(search='hearty'), [recipe.id])
+        self.assertEqual(self._search(search='winter'), [])
+        tag.delete()
+        self.assertEqual(self._search(search='hearty'), [])
 
 
 class ImageUploadTests(TestCase):
@@ -420,22 +784,156 @@ class ImageUploadTests(TestCase):
 
     # this is like a destructor for the test cases in the class
     def tearDown(self):
-        self.recipe.image.delete()
-
-    def test_upload_image(self):
-        """Test uploading an image to a recipe"""
+        for blob in ImageBlob.objects.all():
+            images.delete_image_files(blob.image, blob.renditions)
+        for job in ImageJob.objects.all():
+            if os.path.exists(os.path.join(
+                    settings.MEDIA_ROOT, job.staged_path)):
+                os.remove(os.path.join(settings.MEDIA_ROOT, job.staged_path))
+
+    def upload(self, img_format='JPEG', suffix='.jpg'):
+        """Upload a small image to the recipe"""
         url = image_upload_url(self.recipe.id)
-        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+        with tempfile.NamedTemporaryFile(suffix=suffix) as image_file:
             img = Image.new('RGB', (10,10))
-            img.save(image_file, format='JPEG')
+            img.save(image_file, format=img_format)
             image_file.seek(0)
             payload = {'image': image_file}
-            res = self.client.post(url, payload, format='multipart')
+            return self.client.post(url, payload, format='multipart')
+
+    def process_jobs(self):
+        """Run the queued jobs like the image worker"""
+        with self.captureOnCommitCallbacks(execute=True):
+            for job in images.claim_jobs(10):
+                images.process_job(job)
+
+    def test_upload_image(self):
+        """Test uploading an image to a recipe"""
+        res = self.upload()
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res.data['status'], ImageJob.PENDING)
+        self.assertEqual(res['Location'], res.data['url'])
+        job = ImageJob.objects.get(id=res.data['id'])
+        self.assertTrue(os.path.exists(
+            os.path.join(settings.MEDIA_ROOT, job.staged_path)))
+
+        self.process_jobs()
 
         self.recipe.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertFalse(os.path.exists(
+            os.path.join(settings.MEDIA_ROOT, job.staged_path)))
+
+    def test_image_renditions_listed(self):
+        """Test the recipe list links the renditions of the image"""
+        self.upload()
+        self.process_jobs()
+
+        res = self.client.get(RECIPES_URL)
+
+        renditions = res.data[0]['image_renditions']
+        self.assertEqual(set(renditions), {'128', '512', '1024'})
+        self.assertTrue(renditions['128']['webp'].startswith(
+            'http://testserver' + settings.MEDIA_URL))
+        self.assertTrue(renditions['128']['webp'].endswith('.webp'))
+
+    def test_image_job_status(self):
+        """Test the status of an upload is shown to the owner only"""
+        res = self.upload()
+        self.process_jobs()
+
+        res = self.client.get(res['Location'])
+
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertIn('image', res.data)
+        self.assertEqual(res.data['status'], ImageJob.DONE)
+        self.assertEqual(res.data['recipe'], self.recipe.id)
+
+        other = create_user(email='other@example.com', password='pass123')
+        self.client.force_authenticate(other)
+        res = self.client.get(res.data['url'])
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_image_replaces_previous(self):
+        """Test the latest processed upload is the recipe image"""
+        self.upload()
+        self.process_jobs()
+        self.recipe.refresh_from_db()
+        first = self.recipe.image.path
+
+        self.upload(img_format='PNG', suffix='.png')
+        self.process_jobs()
+
+        self.recipe.refresh_from_db()
+        self.assertNotEqual(self.recipe.image.path, first)
         self.assertTrue(os.path.exists(self.recipe.image.path))
+        # the old one is not used any more and goes with the next collection
+        self.assertEqual(
+            ImageBlob.objects.get(ref_count=0).image,
+            os.path.relpath(first, settings.MEDIA_ROOT),
+        )
+
+    def post_bytes(self, data):
+        """Upload a file with the given content"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            image_file.write(data)
+            image_file.seek(0)
+            return self.client.post(
+                url, {'image': image_file}, format='multipart')
+
+    def staged_files(self):
+        """Return the files in the staging directory"""
+        staging = os.path.join(settings.MEDIA_ROOT, images.STAGING_DIR)
+        return os.listdir(staging) if os.path.isdir(staging) else []
+
+    def test_upload_streamed_to_staging(self):
+        """Test the upload is staged and hashed by the upload handler"""
+        res = self.upload()
+
+        job = ImageJob.objects.get(id=res.data['id'])
+        with open(os.path.join(settings.MEDIA_ROOT, job.staged_path),
+                  'rb') as f:
+            self.assertEqual(job.sha256, hashlib.sha256(f.read()).hexdigest())
+
+    def test_upload_not_an_image_rejected(self):
+        """Test a file which does not start like an image is refused"""
+        before = self.staged_files()
+
+        res = self.post_bytes(b'not an image, just some text')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', res.data)
+        self.assertFalse(ImageJob.objects.exists())
+        self.assertEqual(self.staged_files(), before)
+
+    def test_upload_too_large_rejected(self):
+        """Test a file over the size limit is refused while received"""
+        before = self.staged_files()
+        limit = {**settings.IMAGE_PROCESSING, 'MAX_UPLOAD_SIZE': 1000}
+
+        with self.settings(IMAGE_PROCESSING=limit):
+            res = self.post_bytes(b'\xff\xd8\xff' + b'\0' * 5000)
+
+        self.assertEqual(
+            res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(ImageJob.objects.exists())
+        self.assertEqual(self.staged_files(), before)
+
+    def test_upload_not_an_image(self):
+        """Test a file which only starts like an image fails in the worker"""
+        res = self.post_bytes(b'\xff\xd8\xff' + b'but not a JPEG')
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+
+        self.process_jobs()
+
+        job = ImageJob.objects.get(id=res.data['id'])
+        self.recipe.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertIn('Invalid image', job.error)
+        self.assertFalse(self.recipe.image)
 
     def test_upload_image_bad_request(self):
         """Test uploading invalid image"""
@@ -446,8 +944,242 @@ class ImageUploadTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class RecipeFastListSerializerTests(TestCase):
+    """Test the fast list serializer renders like RecipeSerializer"""
 
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+        prices = ['0.05', '5.00', '-1.50', '999.99']
+        for i, price in enumerate(prices):
+            recipe = create_recipe(
+                user=self.user,
+                title=f'Zupa \u017curek "{i}" \u2028',
+                price=Decimal(price),
+                link='' if i % 2 else f'http://example.com/{i}',
+            )
+            # created in another order than the ids
+            recipe.tags.add(*[
+                Tag.objects.get_or_create(user=self.user, name=name)[0]
+                for name in ['Vegan', 'Soup', f'Tag {i}'][i % 3:]
+            ])
+            recipe.ingredients.add(
+                Ingredient.objects.get_or_create(
+                    user=self.user, name='Salt')[0])
+        Recipe.objects.filter(title__endswith='"0" \u2028').update(
+            image_renditions={
+                '128': {'webp': 'uploads/recipe/ab/ab-128.0123.webp'}})
+
+    def test_output_identical(self):
+        """Test the rendered JSON is byte for byte the same"""
+        request = APIRequestFactory().get(RECIPES_URL)
+        context = {'request': Request(request)}
+        queryset = RecipeViewSet.queryset.filter(user=self.user) \
+            .order_by('-id')
+
+        fast = RecipeFastListSerializer(
+            queryset.values(*RecipeFastListSerializer.values_fields),
+            context,
+        ).data
+        full = RecipeSerializer(
+            queryset.prefetch_related(*RecipeViewSet()._attr_prefetches()),
+            many=True,
+            context=context,
+        ).data
+
+        self.assertEqual(
+            JSONRenderer().render(fast), JSONRenderer().render(full))
+        self.assertEqual(len(fast), 4)
+
+    def test_list_uses_fast_serializer(self):
+        """Test the list endpoint returns the fast serializer output"""
+        res = self.client.get(RECIPES_URL, {'page_size': 2})
+        second = self.client.get(res.data['next'])
+
+        queryset = Recipe.objects.filter(user=self.user).order_by('-id') \
+            .prefetch_related(*RecipeViewSet()._attr_prefetches())
+        full = RecipeSerializer(
+            queryset, many=True, context={'request': res.wsgi_request}).data
+        self.assertEqual(
+            JSONRenderer().render(
+                res.data['results'] + second.data['results']),
+            JSONRenderer().render(full),
+        )
+
+
+class RecipeSparseFieldsTests(TestCase):
+    """Test ?fields= of the recipe list and detail"""
 
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+        for i in range(3):
+            self.recipe = create_recipe(user=self.user, title=f'Soup {i}')
+            self.recipe.tags.add(
+                Tag.objects.create(user=self.user, name=f'Tag {i}'))
+            self.recipe.ingredients.add(
+                Ingredient.objects.create(user=self.user, name=f'Ing {i}'))
+
+    def test_list_sparse_fields(self):
+        """Test the list renders and loads only the listed fields"""
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(RECIPES_URL, {'fields': 'title,id'})
 
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data,
+            [{'id': self.recipe.id, 'title': 'Soup 2'},
+             {'id': self.recipe.id - 1, 'title': 'Soup 1'},
+             {'id': self.recipe.id - 2, 'title': 'Soup 0'}],
+        )
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('"core_tag"', sql)
+        self.assertNotIn('"core_recipe"."price"', sql)
+
+    def test_list_sparse_fields_same_values(self):
+        """Test the listed fields are the ones of the full list"""
+        full = self.client.get(RECIPES_URL)
+        res = self.client.get(RECIPES_URL, {'fields': 'price,tags'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data,
+            [{'price': item['price'], 'tags': item['tags']}
+             for item in full.data],
+        )
 
+    def test_list_sparse_fields_paginated(self):
+        """Test the pages follow without the id among the fields"""
+        res = self.client.get(
+            RECIPES_URL, {'fields': 'title', 'page_size': 2})
+        second = self.client.get(res.data['next'])
 
+        self.assertEqual(
+            [item['title'] for item in res.data['results']] +
+            [item['title'] for item in second.data['results']],
+            ['Soup 2', 'Soup 1', 'Soup 0'],
+        )
+        self.assertEqual(list(second.data['results'][0]), ['title'])
+
+    def test_retrieve_sparse_fields(self):
+        """Test the detail loads only the listed columns and relations"""
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(
+                detail_url(self.recipe.id), {'fields': 'title,tags'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data,
+            {'title': 'Soup 2', 'tags': [
+                {'id': self.recipe.tags.get().id, 'name': 'Tag 2'}]},
+        )
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('"core_ingredient"', sql)
+        self.assertNotIn('"core_recipe"."description"', sql)
+
+    def test_unknown_field(self):
+        """Test asking for a field recipes do not have is rejected"""
+        res = self.client.get(RECIPES_URL, {'fields': 'title,user'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', res.data)
+
+
+class RecipeQueryBudgetTests(TestCase):
+    """Test the recipe endpoints stay within their SQL query budget"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+        # several recipes with nested objects so an N+1 pattern would
+        # immediately blow the budget
+        for i in range(5):
+            recipe = create_recipe(user=self.user, title=f'Recipe {i}')
+            recipe.tags.add(
+                Tag.objects.create(user=self.user, name=f'Tag {i}a'),
+                Tag.objects.create(user=self.user, name=f'Tag {i}b'),
+            )
+            recipe.ingredients.add(
+                Ingredient.objects.create(user=self.user, name=f'Ing {i}a'),
+                Ingredient.objects.create(user=self.user, name=f'Ing {i}b'),
+            )
+        self.recipe = recipe
+
+    def assertWithinQueryBudget(self, action, request, *args, **kwargs):
+        """Run the request and check the number of queries it used"""
+        budget = RecipeViewSet.query_budget[action]
+        with CaptureQueriesContext(connection) as queries:
+            res = request(*args, **kwargs)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{action} used {len(queries)} queries, budget is {budget}',
+        )
+        return res
+
+    def test_list_query_budget(self):
+        """Test listing recipes does not query per recipe"""
+        res = self.assertWithinQueryBudget('list', self.client.get,
+                                           RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 5)
+        self.assertEqual(len(res.data[0]['tags']), 2)
+
+    def test_retrieve_query_budget(self):
+        """Test retrieving a recipe stays within the budget"""
+        res = self.assertWithinQueryBudget(
+            'retrieve', self.client.get, detail_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['ingredients']), 2)
+
+    def test_create_query_budget(self):
+        """Test creating a recipe with nested objects stays within budget"""
+        payload = {
+            'title': 'Curry',
+            'time_minutes': 30,
+            'price': Decimal('2.50'),
+            'tags': [{'name': 'Tag 0a'}, {'name': 'Thai'}],
+            'ingredients': [{'name': 'Ing 0a'}, {'name': 'Rice'}],
+        }
+        res = self.assertWithinQueryBudget(
+            'create', self.client.post, RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_create_queries_independent_of_tag_count(self):
+        """Test nested tags are created with a constant number of queries"""
+        counts = []
+        for size in (1, 30):
+            payload = {
+                'title': f'Recipe with {size} tags',
+                'time_minutes': 30,
+                'price': Decimal('2.50'),
+                'tags': [{'name': f'Bulk tag {i}'} for i in range(size)],
+            }
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(RECIPES_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(res.data['tags']), size)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_partial_update_query_budget(self):
+        """Test updating recipe tags stays within budget"""
+        payload = {'tags': [{'name': 'Tag 0a'}, {'name': 'Lunch'}]}
+        res = self.assertWithinQueryBudget(
+            'partial_update', self.client.patch, detail_url(self.recipe.id),
+            payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_destroy_query_budget(self):
+        """Test deleting a recipe stays within budget"""
+        res = self.assertWithinQueryBudget(
+            'destroy', self.client.delete, detail_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
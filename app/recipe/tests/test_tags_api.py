@@ -4,14 +4,17 @@ Test fir the tags API
 from decimal import Decimal
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Tag, Recipe
 
-from recipe.serializers import TagSerializer
+from recipe.serializers import TagDetailSerializer
+from recipe.views import TagViewSet
 
 TAGS_URL = reverse('recipe:tag-list')
 
@@ -57,7 +60,7 @@ class PrivateTagsApiTests(TestCase):
         res = self.client.get(TAGS_URL)
 
         tags = Tag.objects.all().order_by('-name')
-        serializer = TagSerializer(tags, many=True)
+        serializer = TagDetailSerializer(tags, many=True)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
 
@@ -112,8 +115,9 @@ class PrivateTagsApiTests(TestCase):
 
         res = self.client.get(TAGS_URL, {'assigned_only':1})
 
-        tag1s = TagSerializer(tag1)
-        tag2s = TagSerializer(tag2)
+        tag1.refresh_from_db()  # recipe_count changed in the db
+        tag1s = TagDetailSerializer(tag1)
+        tag2s = TagDetailSerializer(tag2)
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertIn(tag1s.data, res.data)
@@ -138,7 +142,8 @@ class PrivateTagsApiTests(TestCase):
 
         recipe1.tags.add(tag1)
         recipe2.tags.add(tag1)
-        tag1s = TagSerializer(tag1)
+        tag1.refresh_from_db()
+        tag1s = TagDetailSerializer(tag1)
 
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
 
@@ -146,6 +151,77 @@ class PrivateTagsApiTests(TestCase):
         self.assertEqual(len(res.data), 1)
         self.assertIn(tag1s.data, res.data)
 
+    def test_list_tags_query_budget(self):
+        """Test listing assigned tags runs within the query budget"""
+        recipe = Recipe.objects.create(
+            title='Soup',
+            time_minutes=5,
+            price=Decimal('4.50'),
+            user=self.user1,
+        )
+        for i in range(5):
+            recipe.tags.add(Tag.objects.create(user=self.user1, name=f'T{i}'))
+        budget = TagViewSet.query_budget['list']
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 5)
+        self.assertLessEqual(len(queries), budget)
+
+    def test_update_tag_duplicate_name(self):
+        """Test renaming a tag to an existing name is rejected"""
+        Tag.objects.create(user=self.user1, name='Dessert')
+        tag = Tag.objects.create(user=self.user1, name='After Dinner')
+
+        url = detail_url(tag_id=tag.id)
+        res = self.client.patch(url, {'name': 'Dessert'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'After Dinner')
+
+    def test_list_tags_cached_until_data_changes(self):
+        """Test the tag list is cached and refreshed after changes"""
+        tag = Tag.objects.create(user=self.user1, name='Breakfast')
+        recipe = Recipe.objects.create(
+            title='Soup',
+            time_minutes=5,
+            price=Decimal('4.50'),
+            user=self.user1,
+        )
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+        self.assertEqual(res.data, [])
 
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(TAGS_URL, {'assigned_only': 1})
+        self.assertEqual(res.data, [])
+        self.assertEqual(len(queries), 1)  # only the data version
+
+        recipe.tags.add(tag)
+        res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        tag.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [TagDetailSerializer(tag).data])
+
+    def test_list_tags_sparse_fields(self):
+        """Test ?fields= renders and loads only the listed fields"""
+        Tag.objects.create(user=self.user1, name='Vegan')
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(TAGS_URL, {'fields': 'name'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{'name': 'Vegan'}])
+        sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"core_tag"."name"', sql)
+        self.assertNotIn('"core_tag"."recipe_count"', sql)
 
+    def test_list_tags_unknown_field(self):
+        """Test asking for a field tags do not have is rejected"""
+        res = self.client.get(TAGS_URL, {'fields': 'name,secret'})
 
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('fields', res.data)
@@ -10,6 +10,7 @@ router = DefaultRouter()
 router.register('recipes', views.RecipeViewSet)
 router.register('tags', views.TagViewSet)
 router.register('ingredients', views.IngredientViewSet)
+router.register('image-jobs', views.ImageJobViewSet)
 
 app_name = 'recipe'
 
@@ -1,14 +1,45 @@
 """
 Views for recipe APIs
 """
+import hashlib
+import json
+from itertools import islice
 
+from django.conf import settings
+from django.core.cache import caches
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from django.db import IntegrityError, transaction
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import (
+    F,
+    FloatField,
+    Prefetch,
+    Q,
+    prefetch_related_objects,
+)
+from django.db.models.functions import Cast
+from django.utils.translation import gettext as _
 from rest_framework import viewsets, mixins, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
-from core.models import Recipe, Tag, Ingredient
+from rest_framework.utils.encoders import JSONEncoder
+from core import images
+from core.authentication import CachedTokenAuthentication
+from core.uploads import StagingUploadHandler
+from core.models import (
+    SEARCH_CONFIG,
+    ImageJob,
+    Recipe,
+    Tag,
+    Ingredient,
+    UserDataVersion,
+)
 from recipe import serializers
+from recipe.pagination import RecipeCursorPagination
 from drf_spectacular.utils import (
     extend_schema_view,
     extend_schema,
@@ -16,6 +47,51 @@ from drf_spectacular.utils import (
     OpenApiTypes,
 )
 
+FIELDS_PARAMETER = OpenApiParameter(
+    'fields',
+    OpenApiTypes.STR,
+    description='Comma separated list of the fields to return, \
+        the other ones are neither loaded nor rendered.'
+)
+
+
+# ?fields= of the read actions - the serializer renders only the listed
+# fields and the queryset loads only their columns and relations
+class SparseFieldsetMixin:
+    """Sparse fieldsets of the list and retrieve actions"""
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self):
+        """Return the set of the requested fields, None for all of them"""
+        param = self.request.query_params.get('fields') \
+            if self.request else None
+        if not param or self.action not in self.sparse_actions:
+            return None
+        fields = {name.strip() for name in param.split(',')} - {''}
+        unknown = fields - set(self.get_serializer_class().Meta.fields)
+        if unknown:
+            msg = _('Unknown fields: %(fields)s.') % {
+                'fields': ', '.join(sorted(unknown))}
+            raise ValidationError({'fields': [msg]})
+        return fields
+
+    def get_sparse_columns(self, fields):
+        """Return the columns of the model read for the fields"""
+        meta = self.queryset.model._meta
+        # the relations are prefetched, not columns of the model
+        return ['id'] + [
+            name for name in sorted(fields)
+            if name != 'id' and not meta.get_field(name).many_to_many
+        ]
+
+    def get_serializer(self, *args, **kwargs):
+        """Return the serializer rendering the requested fields"""
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
+
+
 # we use ViewSet not a View, brcause VieSets have a lot of CRUD
 # operations done
 # the extend_schema_view is for the documentation used by drf_scpectacular
@@ -33,40 +109,204 @@ from drf_spectacular.utils import (
                 OpenApiTypes.STR,
                 description='Comma separated list of ingredients IDs [int] \
                     to filter the get query.'
-            )
+            ),
+            OpenApiParameter(
+                'search',
+                OpenApiTypes.STR,
+                description='Full text search in titles, descriptions, \
+                    tag and ingredient names - the best matches first.'
+            ),
+            OpenApiParameter(
+                'match',
+                OpenApiTypes.STR,
+                enum=['any', 'all'],
+                description='any (default): recipes with any of the listed \
+                    tags/ingredients, all: recipes with all of them.'
+            ),
+            FIELDS_PARAMETER,
         ]
-    )
+    ),
+    retrieve=extend_schema(parameters=[FIELDS_PARAMETER]),
 )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """ViewSet for manage recipe APIs"""
 
     serializer_class = serializers.RecipeDetailSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = [TokenAuthentication]  # type of auth we use
+    authentication_classes = [CachedTokenAuthentication]  # type of auth we use
     permission_classes = [IsAuthenticated]  # authentication required
+    pagination_class = RecipeCursorPagination  # ?page_size=N turns it on
+    # max number of SQL queries an action may run - enforced by the tests
+    # it must not depend on the number of recipes, tags or ingredients
+    query_budget = {
+        'list': 4,
+        'retrieve': 4,
+        'create': 21,
+        'partial_update': 16,
+        'destroy': 11,
+        'bulk_create': 19,
+    }
+    bulk_create_max_size = 500  # max number of recipes in one request
+    export_chunk_size = 500  # recipes read from the db cursor at a time
 
     def _params_to_ints(self, qs):
         """Convert a list of strings to integers like 1,4,5,2 """
         return [int(str_id) for str_id in qs.split(',')]
 
+    def _match_all(self):
+        """Return True when recipes must have all the listed tags"""
+        match = self.request.query_params.get('match', 'any')
+        if match not in ('any', 'all'):
+            raise ValidationError({'match': [_('Must be any or all.')]})
+        return match == 'all'
+
+    def _has_attrs(self, field, ids, match_all):
+        """Return the filter on an array of linked ids of the recipe"""
+        # tag_ids && ARRAY[...] (any of them) or tag_ids @> ARRAY[...]
+        # (all of them) - one table, answered by the GIN index of the array
+        lookup = 'contains' if match_all else 'overlap'
+        return Q(**{f'{field}__{lookup}': sorted(set(ids))})
+
+    def _attr_prefetches(self, fields=None):
+        """Prefetch tags and ingredients loading only the serialized columns
+        only the relations among `fields` when given
+        """
+        # ordered by id like the tag_ids/ingredient_ids arrays which the
+        # list (RecipeFastListSerializer) reads instead of the relations
+        prefetches = [
+            Prefetch(
+                'tags',
+                queryset=Tag.objects.only('id', 'name').order_by('id'),
+            ),
+            Prefetch(
+                'ingredients',
+                queryset=Ingredient.objects.only('id', 'name').order_by('id'),
+            ),
+        ]
+        return [
+            prefetch for prefetch in prefetches
+            if fields is None or prefetch.prefetch_to in fields
+        ]
+
     def get_queryset(self):
         """Retrieve recipes for authenticated user."""
-        # return self.queryset.filter(user=self.request.user).order_by('-id')
+        # the queryset is planned per action - the nested tags and
+        # ingredients are fetched with one query each instead of two
+        # queries per recipe (N+1) when the serializer walks the relations
         # self.request has authenticated user id inside
         tags = self.request.query_params.get('tags')
         ingredients = self.request.query_params.get('ingredients')
-        queryset = self.queryset
+        search = self.request.query_params.get('search')
+        match_all = self._match_all()
+        # the denormalized columns are only read by the database
+        queryset = self.queryset.filter(user=self.request.user) \
+            .defer('search_vector', 'tag_ids', 'ingredient_ids')
         if tags:
             tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = queryset.filter(
+                self._has_attrs('tag_ids', tag_ids, match_all))
         if ingredients:
             ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = queryset.filter(
+                self._has_attrs('ingredient_ids', ingredient_ids, match_all))
+
+        # the list reads values() rows, see list below
+        if self.action == 'retrieve':
+            fields = self.get_sparse_fields()
+            if fields is not None:
+                queryset = queryset.only(*self.get_sparse_columns(fields))
+            queryset = queryset.prefetch_related(
+                *self._attr_prefetches(fields))
+
+        if search:
+            # websearch syntax: "quoted phrase", or, -excluded
+            query = SearchQuery(
+                search, config=SEARCH_CONFIG, search_type='websearch')
+            queryset = queryset.filter(search_vector=query).annotate(
+                # double precision - the rank is a cursor position
+                # (RecipeCursorPagination) and must survive a round trip
+                rank=Cast(
+                    SearchRank(F('search_vector'), query), FloatField()),
+            )
+            return queryset.order_by('-rank', '-id')
 
-        return queryset.filter(user=self.request.user).order_by('-id').distinct()
+        # the filters do not join, a recipe comes back once - no DISTINCT
+        return queryset.order_by('-id')
         # order_by('id') standard asc order
         # order_by('-id') reverse order
 
+    def _etag(self, request, version):
+        """Return a strong ETag for the response at the data version"""
+        # the response only depends on the user data (its version), on the
+        # url (recipe id, filters, cursor) and on the rendered format
+        key = '|'.join([
+            str(request.user.id),
+            str(version),
+            request.path,
+            request.query_params.urlencode(),
+            request.accepted_media_type or '',
+        ])
+        return '"%s"' % hashlib.sha1(key.encode()).hexdigest()
+
+    def _conditional_response(self, handler, request, *args, **kwargs):
+        """Answer 304 when the client copy is current, before any query"""
+        # the version is read before the data - if the data changes in
+        # between, the response is newer than its ETag and the next poll
+        # simply gets a new response, never the other way around
+        version = UserDataVersion.objects.get_version(request.user.id)
+        if version is None:
+            return handler(request, *args, **kwargs)
+        etag = self._etag(request, version)
+        # weak comparison - the ETag of a compressed response is weak
+        # (core.middleware.CompressionMiddleware)
+        # '*' is no match - it would answer 304 before the recipe is looked
+        # up, also for a missing one or one of another user
+        if_none_match = {
+            tag[2:] if tag.startswith('W/') else tag
+            for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        }
+        if etag in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            # per user data: not for shared caches, revalidate every time
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Accept', 'Authorization'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        """List recipes - supports If-None-Match"""
+        return self._conditional_response(
+            self._list, request, *args, **kwargs)
+
+    def _list(self, request, *args, **kwargs):
+        """List recipes with the fast read-only serializer"""
+        queryset = self.filter_queryset(self.get_queryset())
+        fields = self.get_sparse_fields()
+        columns = serializers.RecipeFastListSerializer \
+            .values_fields_for(fields)
+        if 'rank' in queryset.query.annotations:
+            columns = columns + ['rank']  # the cursor position of a search
+        # plain dicts instead of model instances (the cursor pagination
+        # reads the position of dicts too)
+        queryset = queryset.values(*columns)
+        context = self.get_serializer_context()
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                serializers.RecipeFastListSerializer(
+                    page, context, fields).data)
+        return Response(
+            serializers.RecipeFastListSerializer(
+                queryset, context, fields).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a recipe - supports If-None-Match"""
+        return self._conditional_response(
+            super().retrieve, request, *args, **kwargs)
 
     def get_serializer_class(self):
         """Return serializer class for a request"""
@@ -80,15 +320,78 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Create a new recipe"""
         serializer.save(user=self.request.user)
 
+    # offline clients sync many recipes in one request instead of one
+    # request per recipe - the items are validated like single recipes
+    # and either all of them are created or none (errors listed per item)
+    @action(methods=['POST'], detail=False, url_path='bulk_create')
+    def bulk_create(self, request):
+        """Create many recipes at once."""
+        if isinstance(request.data, list) and \
+                len(request.data) > self.bulk_create_max_size:
+            msg = _('Too many recipes, max %(max)d in one request.') % {
+                'max': self.bulk_create_max_size}
+            raise ValidationError({'non_field_errors': [msg]})
+        serializer = self.get_serializer(data=request.data, many=True)
+
+        if serializer.is_valid():
+            recipes = serializer.save(user=self.request.user)
+            prefetch_related_objects(recipes, *self._attr_prefetches())
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def _export_lines(self, queryset):
+        """Yield recipes as JSON lines, one chunk of recipes at a time"""
+        # iterator() reads rows through a server-side cursor and does not
+        # cache them, the tags and ingredients are loaded once per chunk
+        # so only one chunk of recipes is kept in memory at any time
+        recipes = queryset.iterator(chunk_size=self.export_chunk_size)
+        serializer = serializers.RecipeDetailSerializer(
+            context=self.get_serializer_context())
+        while True:
+            chunk = list(islice(recipes, self.export_chunk_size))
+            if not chunk:
+                break
+            prefetch_related_objects(chunk, *self._attr_prefetches())
+            for recipe in chunk:
+                data = serializer.to_representation(recipe)
+                yield json.dumps(
+                    data, cls=JSONEncoder, ensure_ascii=False) + '\n'
+
+    @action(methods=['GET'], detail=False, url_path='export')
+    def export(self, request):
+        """Export all recipes of the user as newline delimited JSON."""
+        queryset = self.queryset.filter(user=request.user).order_by('id')
+        response = StreamingHttpResponse(
+            self._export_lines(queryset),
+            content_type='application/x-ndjson',
+        )
+        response['Content-Disposition'] = \
+            'attachment; filename="recipes.ndjson"'
+        return response
+
+    # decoding and re-encoding an image takes longer than the rest of the
+    # request, it is only stored here and processed by the image worker
+    # (manage.py process_image_jobs) - the response links the job status
+    @extend_schema(responses={202: serializers.ImageJobSerializer})
     @action(methods=['POST'], detail=True, url_path='upload_image')
     def upload_image(self, request, pk=None):
         """Upload an image to recipe."""
         recipe = self.get_object()
-        serializer = self.get_serializer(recipe, data=request.data)
+        # the image is streamed to the staging directory, checked and
+        # hashed while it is read - before request.data parses the body
+        request.upload_handlers.insert(0, StagingUploadHandler(request))
+        serializer = self.get_serializer(data=request.data)
 
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            job = images.stage_upload(
+                recipe, serializer.validated_data['image'])
+            data = serializers.ImageJobSerializer(
+                job, context=self.get_serializer_context()).data
+            return Response(
+                data,
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': data['url']},
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -100,19 +403,50 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 OpenApiTypes.INT,
                 enum=[0,1],
                 description="Filter by items assigned to recipes"
-            )
+            ),
+            FIELDS_PARAMETER,
         ]
     )
 )
 class BaseRecipeAttrViewSet(
+    SparseFieldsetMixin,
     mixins.DestroyModelMixin, # delete functionality needed only this import
     mixins.UpdateModelMixin, #update functionality needed only this import
     mixins.ListModelMixin,
     viewsets.GenericViewSet # this import should be hte last one!!
     ):
     """Base class for a recipe attributes"""
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    # max number of SQL queries an action may run - enforced by the tests
+    query_budget = {
+        'list': 2,
+    }
+
+    def _list_cache_key(self, request):
+        """Return the cache key of the list response or None"""
+        version = UserDataVersion.objects.get_version(request.user.id)
+        if version is None:
+            return None
+        params = hashlib.sha1(
+            request.query_params.urlencode().encode()).hexdigest()
+        # the model, not the basename - that one is only set by the router
+        model = self.queryset.model._meta.model_name
+        return f'recipe-attrs:{request.user.id}:{model}:{params}:{version}'
+
+    # pickers call the lists all the time, the response is cached until
+    # the user changes any recipe data (then the version in the key moves)
+    def list(self, request, *args, **kwargs):
+        """List the items - cached per user data version"""
+        key = self._list_cache_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+        cache = caches[settings.RESPONSE_CACHE['CACHE']]
+        data = cache.get(key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, settings.RESPONSE_CACHE['TIMEOUT'])
+        return Response(data)
 
     def get_queryset(self):
         """Filter query set to authenticated users"""
@@ -120,19 +454,46 @@ class BaseRecipeAttrViewSet(
             bool(int(self.request.query_params.get('assigned_only', 0)))
         queryset =  self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
-        return queryset.filter(user=self.request.user).order_by('-name').distinct()
+            # maintained count, no join - core_tag_assigned_idx
+            queryset = queryset.filter(recipe_count__gt=0)
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            queryset = queryset.only(*self.get_sparse_columns(fields))
+        return queryset.filter(user=self.request.user).order_by('-name')
+
+    def perform_update(self, serializer):
+        """Save the changes - names are unique per user"""
+        # the unique (user, name) constraint in the db is the check,
+        # so two concurrent renames cannot both succeed
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            msg = _('An item with this name already exists.')
+            raise ValidationError({'name': [msg]})
 
 
 
 class TagViewSet(BaseRecipeAttrViewSet): # this import should be hte last one!!!
     """Managr tags in the database"""
-    serializer_class = serializers.TagSerializer
+    serializer_class = serializers.TagDetailSerializer
     queryset = Tag.objects.all()
 
 
 # mixins.UpdateModelMixin mixins.Update adds automatically router url recipe:ingredient-detail
 class IngredientViewSet(BaseRecipeAttrViewSet):
     """Manage ingredients in the database."""
-    serializer_class = serializers.IngredientSerializer
+    serializer_class = serializers.IngredientDetailSerializer
     queryset = Ingredient.objects.all()
+
+
+class ImageJobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Status of the processing of uploaded recipe images"""
+    serializer_class = serializers.ImageJobSerializer
+    queryset = ImageJob.objects.all()
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """Filter query set to authenticated users"""
+        return self.queryset.filter(recipe__user=self.request.user)
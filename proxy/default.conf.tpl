@@ -1,13 +1,62 @@
+# the app server - uWSGI or gunicorn, see APP_SERVER in scripts/run.sh
+upstream app_server {
+    server ${APP_HOST}:${APP_PORT};
+    keepalive 16;
+}
+
 server {
     listen ${LISTEN_PORT};
 
+    # the recipe images are named by their content - a changed image has
+    # a new URL, so the browsers and CDNs may keep the files forever
+    location /static/media/uploads/recipe/ {
+        alias /vol/static/media/uploads/recipe/;
+        add_header Cache-Control "public, max-age=31536000, immutable";
+    }
+
+    # uploads waiting for the image worker are not public
+    location /static/media/uploads/staging/ {
+        deny all;
+    }
+
+    # the collected static files (admin, browsable API) - the .br or .gz
+    # copy written by manage.py compress_static goes to the clients which
+    # take it, compressed once instead of per request
+    location /static/static/ {
+        root /vol;
+        gzip_static on;
+        gzip_vary on;
+
+        # the type of the file, not of its .br copy
+        location ~ \.css$ {
+            types { }
+            default_type text/css;
+            include /etc/nginx/brotli_static;
+        }
+        location ~ \.js$ {
+            types { }
+            default_type application/javascript;
+            include /etc/nginx/brotli_static;
+        }
+        location ~ \.svg$ {
+            types { }
+            default_type image/svg+xml;
+            include /etc/nginx/brotli_static;
+        }
+        location ~ \.(json|map)$ {
+            types { }
+            default_type application/json;
+            include /etc/nginx/brotli_static;
+        }
+    }
+
     location /static {
         alias /vol/static;
     }
 
     location /{
-        uwsgi_pass      ${APP_HOST}:${APP_PORT};
-        include         /etc/nginx/uwsgi_params;
+        # app_uwsgi or app_asgi - the protocol of the app server
+        include         /etc/nginx/app_${APP_SERVER};
         client_max_body_size 10M;
     }
 }
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+Local benchmark of the two app servers of scripts/run.sh - uWSGI (WSGI)
+and gunicorn with uvicorn workers (ASGI, app/asgi.py): throughput and
+latency of the recipe list and of image uploads.
+
+Run it where the app runs, against a database you can write to:
+
+    docker-compose run --rm app sh -c \
+        "python manage.py wait_for_db && python /scripts/benchmark_servers.py"
+
+Both servers are started on a local port in turn with the same number of
+processes and threads and get the same requests for the same time. The
+recipes are seeded (always the same ones) for a throw-away user which is
+deleted at the end with its uploads. The servers talk HTTP here, behind
+the proxy uWSGI talks the uwsgi protocol - the proxy is not measured.
+
+The results depend on the machine, compare the servers on the same one.
+"""
+import argparse
+import http.client
+import io
+import math
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+APP_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, 'app')
+
+
+def server_command(server, port, workers, threads):
+    """Return the command line of a server, like in scripts/run.sh"""
+    if server == 'asgi':
+        return [
+            'gunicorn', 'app.asgi:application',
+            '--worker-class', 'uvicorn.workers.UvicornWorker',
+            '--workers', str(workers),
+            '--bind', f'127.0.0.1:{port}',
+        ]
+    return [
+        'uwsgi', '--http-socket', f'127.0.0.1:{port}',
+        '--workers', str(workers), '--threads', str(threads),
+        '--master', '--enable-threads', '--module', 'app.wsgi',
+        '--die-on-term', '--disable-logging',
+    ]
+
+
+def start_server(server, port, workers, threads, log):
+    """Start a server and wait until it answers the health check"""
+    env = dict(
+        os.environ,
+        WEB_THREADS=str(threads),
+        ALLOWED_HOSTS='127.0.0.1',
+        DEBUG='0',
+    )
+    process = subprocess.Popen(
+        server_command(server, port, workers, threads),
+        cwd=APP_DIR, env=env, stdout=log, stderr=log,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            connection.request('GET', '/api/health-check/')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'{server} did not start, see {log.name}')
+
+
+def stop_server(process):
+    """Stop a server, kill it if it does not exit"""
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def upload_body(size):
+    """Return a multipart body with a JPEG of about `size` bytes"""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.effect_noise((256, 256), 64).convert('RGB') \
+        .save(buffer, 'JPEG', quality=90)
+    # the upload handler only reads the first bytes, the worker is not
+    # running - padding makes the size without decoding more pixels
+    image = buffer.getvalue().ljust(size, b'\0')
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        'Content-Disposition: form-data; name="image"; '
+        'filename="benchmark.jpg"\r\n'
+        'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + image + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def load(port, method, path, headers, body, concurrency, duration):
+    """Send requests from `concurrency` clients for `duration` seconds,
+    return (latencies of the 2xx, other answers)
+    """
+    # a connection per request like the proxy opens to uWSGI - a
+    # keep-alive connection would hold one of its threads while idle
+    headers = dict(headers, Connection='close')
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        mine, failed = [], 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                continue
+            finally:
+                # uWSGI does not say it closes the connection
+                connection.close()
+            if 200 <= response.status < 300:
+                mine.append(time.perf_counter() - start)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(values, percent):
+    """Return the value under which `percent` % of the values are"""
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--servers', default='uwsgi,asgi')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--recipes', type=int, default=1000)
+    parser.add_argument('--upload-size', type=int, default=256 * 1024)
+    parser.add_argument('--port', type=int, default=8089)
+    args = parser.parse_args()
+
+    sys.path.insert(0, APP_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+    import django
+    django.setup()
+    from rest_framework.authtoken.models import Token
+    from core.management.seeding import seed_recipes
+    from core.models import ImageJob, Recipe
+
+    user, = seed_recipes(users=1, recipes=args.recipes)
+    token = Token.objects.create(user=user)
+    recipe_id = Recipe.objects.filter(user=user).order_by('id') \
+        .values_list('id', flat=True)[0]
+    auth = {'Authorization': f'Token {token.key}'}
+    upload, content_type = upload_body(args.upload_size)
+    paths = [
+        ('recipe list', 'GET', '/api/recipe/recipes/?page_size=50',
+         auth, None),
+        ('image upload', 'POST',
+         f'/api/recipe/recipes/{recipe_id}/upload_image/',
+         dict(auth, **{'Content-Type': content_type}), upload),
+    ]
+
+    print(
+        f'{os.cpu_count()} CPUs, {args.workers} workers x {args.threads} '
+        f'threads, {args.concurrency} connections, {args.duration:g} s, '
+        f'{args.recipes} recipes, {len(upload) // 1024} KB uploads'
+    )
+    print(f'{"server":<8} {"path":<14} {"req/s":>8} {"p50 ms":>8} '
+          f'{"p99 ms":>8} {"errors":>7}')
+    try:
+        for server in args.servers.split(','):
+            with tempfile.NamedTemporaryFile(
+                    'w', prefix=f'{server}-', suffix='.log',
+                    delete=False) as log:
+                process = start_server(
+                    server, args.port, args.workers, args.threads, log)
+                try:
+                    for name, method, path, headers, body in paths:
+                        load(args.port, method, path, headers, body,
+                             args.concurrency, args.warmup)
+                        latencies, errors = load(
+                            args.port, method, path, headers, body,
+                            args.concurrency, args.duration)
+                        print(
+                            f'{server:<8} {name:<14} '
+                            f'{len(latencies) / args.duration:>8.0f} '
+                            f'{percentile(latencies, 50) * 1000:>8.1f} '
+                            f'{percentile(latencies, 99) * 1000:>8.1f} '
+                            f'{errors:>7}'
+                        )
+                        # the staged uploads go with their jobs
+                        ImageJob.objects.filter(recipe_id=recipe_id).delete()
+                finally:
+                    stop_server(process)
+            os.remove(log.name)
+    finally:
+        user.delete()
+
+
+if __name__ == '__main__':
+    main()
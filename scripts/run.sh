@@ -4,7 +4,25 @@ set -e
 
 python manage.py wait_for_db
 python manage.py collectstatic --noinput
+# the .gz/.br copies of the static files sent by the proxy
+python manage.py compress_static
 python manage.py migrate
 
-uwsgi --socket :9000 --workers 4 --master --enable-threads --module app.wsgi
+# APP_SERVER=uwsgi (default): uWSGI started by scripts/uwsgi_launcher.py,
+# processes and threads sized for the CPU and memory limits of the
+# container (or WEB_WORKERS / WEB_THREADS), the proxy talks the uwsgi
+# protocol to it
+# APP_SERVER=asgi: gunicorn with uvicorn workers (app/asgi.py), WEB_WORKERS
+# processes running WEB_THREADS requests each, the proxy talks HTTP to it
+# the proxy must be started with the same APP_SERVER
+APP_SERVER=${APP_SERVER:-uwsgi}
 
+if [ "$APP_SERVER" = "asgi" ]; then
+    export WEB_THREADS=${WEB_THREADS:-8}
+    exec gunicorn app.asgi:application \
+        --worker-class uvicorn.workers.UvicornWorker \
+        --workers "${WEB_WORKERS:-4}" \
+        --bind :9000
+fi
+
+exec python /scripts/uwsgi_launcher.py
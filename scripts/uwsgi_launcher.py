@@ -0,0 +1,138 @@
+"""
+Start uWSGI sized for the container it runs in (see scripts/run.sh).
+
+The CPU quota and the memory limit of the container's cgroup (v1 or v2)
+decide the number of processes, so the same image runs on a 2 core and
+a 32 core node. Every value can be set with an env variable:
+
+    WEB_WORKERS       max worker processes (2 per CPU, as many as the
+                      memory holds with UWSGI_RELOAD_RSS each, at most
+                      WEB_MAX_WORKERS - 32 by default)
+    WEB_THREADS       threads per worker (4)
+    UWSGI_CHEAPER     workers kept when idle, the busyness algorithm
+                      starts more under load (a quarter of the max)
+    UWSGI_HARAKIRI    seconds before a stuck request is killed (60)
+    UWSGI_RELOAD_RSS  MB of memory after which a worker is replaced (256)
+    UWSGI_OFFLOAD_THREADS  threads sending files per worker (1 per CPU)
+"""
+import math
+import os
+import sys
+
+CGROUP = '/sys/fs/cgroup'
+# reserved for the master, the offload threads and the page cache
+MEMORY_HEADROOM = 0.8
+
+
+def _read(path):
+    """Return the stripped content of a file or None"""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit():
+    """Return the number of CPUs the container may use"""
+    try:
+        cpus = len(os.sched_getaffinity(0))  # cpuset
+    except AttributeError:  # not on Linux
+        cpus = os.cpu_count() or 1
+    quota = period = None
+    cpu_max = _read(os.path.join(CGROUP, 'cpu.max'))  # v2: "quota period"
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+    else:  # v1
+        quota = _read(os.path.join(CGROUP, 'cpu', 'cpu.cfs_quota_us'))
+        period = _read(os.path.join(CGROUP, 'cpu', 'cpu.cfs_period_us'))
+    try:
+        quota, period = int(quota), int(period)
+    except (TypeError, ValueError):  # "max" or no cgroup
+        return cpus
+    if quota <= 0 or period <= 0:  # -1 is no quota
+        return cpus
+    return max(1, min(cpus, math.ceil(quota / period)))
+
+
+def memory_limit():
+    """Return the bytes of memory the container may use"""
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    limit = _read(os.path.join(CGROUP, 'memory.max')) or \
+        _read(os.path.join(CGROUP, 'memory', 'memory.limit_in_bytes'))
+    try:
+        # no limit is "max" (v2) or a number close to 2**63 (v1)
+        return min(int(limit), physical)
+    except (TypeError, ValueError):
+        return physical
+
+
+def _env_int(name, default):
+    """Return the integer of an env variable, `default` if it is unset"""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def uwsgi_config(cpus, memory):
+    """Return the settings of uWSGI for the CPUs and memory"""
+    reload_rss = _env_int('UWSGI_RELOAD_RSS', 256)
+    workers = _env_int('WEB_WORKERS', max(1, min(
+        2 * cpus,
+        int(memory * MEMORY_HEADROOM / (reload_rss * 1024 * 1024)),
+        _env_int('WEB_MAX_WORKERS', 32),
+    )))
+    return {
+        'workers': workers,
+        'threads': _env_int('WEB_THREADS', 4),
+        # the busyness algorithm needs a worker more than it keeps
+        'cheaper': min(
+            _env_int('UWSGI_CHEAPER', max(1, workers // 4)), workers - 1),
+        'harakiri': _env_int('UWSGI_HARAKIRI', 60),
+        'reload_rss': reload_rss,
+        'offload_threads': _env_int('UWSGI_OFFLOAD_THREADS', cpus),
+    }
+
+
+def uwsgi_args(config, socket=':9000'):
+    """Return the command line of uWSGI for the settings"""
+    args = [
+        'uwsgi',
+        '--socket', socket,
+        '--module', 'app.wsgi',
+        '--master',
+        '--enable-threads',
+        '--die-on-term',  # docker stop sends SIGTERM, not a reload
+        '--need-app',
+        '--workers', str(config['workers']),
+        '--threads', str(config['threads']),
+        # the proxy buffers the request bodies, a slow upload does not
+        # count for the harakiri of the worker
+        '--harakiri', str(config['harakiri']),
+        '--harakiri-verbose',
+        '--reload-on-rss', str(config['reload_rss']),
+        '--offload-threads', str(config['offload_threads']),
+    ]
+    if config['cheaper'] > 0:
+        args += [
+            '--cheaper-algo', 'busyness',
+            '--cheaper', str(config['cheaper']),
+            '--cheaper-initial', str(config['cheaper']),
+            '--cheaper-step', '1',
+        ]
+    return args
+
+
+def main():
+    cpus, memory = cpu_limit(), memory_limit()
+    config = uwsgi_config(cpus, memory)
+    print(
+        f'uwsgi_launcher: {cpus} CPUs, {memory // (1024 * 1024)} MB -> '
+        + ', '.join(f'{name}={value}' for name, value in config.items()),
+        file=sys.stderr, flush=True,
+    )
+    args = uwsgi_args(config, *sys.argv[1:2])
+    os.execvp(args[0], args)
+
+
+if __name__ == '__main__':
+    main()